@@ -1,10 +1,11 @@
 import io
 
-import streamlit as st
-import numpy as np
 import pandas as pd
+import streamlit as st
 
+import cleansing
 import common
+import data_loader
 
 
 st.set_page_config(page_title='データクレンジング', layout='wide')
@@ -18,49 +19,76 @@ st.write('')
 uploaded_file = st.file_uploader("CSVまたはExcelファイルを選択してください", type=["csv", "xlsx"])
 
 if uploaded_file is not None:
-    # データの読み込み
-    if uploaded_file.type == 'text/csv':
-        data = pd.read_csv(uploaded_file)
+    # 大きな CSV は全体を読み込まず、チャンクごとのストリーミングで処理する
+    streaming = cleansing.use_streaming(uploaded_file.name, uploaded_file.size)
+
+    def read_chunks():
+        # アップロードされたファイルを先頭から読み直す（コピーは作らない）
+        uploaded_file.seek(0)
+        return pd.read_csv(uploaded_file, chunksize=cleansing.CHUNKSIZE)
+
+    if streaming:
+        st.subheader('元のデータ（先頭1000行）')
+        uploaded_file.seek(0)
+        st.write(pd.read_csv(uploaded_file, nrows=1000))
+        st.info(
+            'ファイルが大きいため、全体を読み込まずに分割して処理します。'
+            '処理済みデータは gzip 圧縮した CSV 形式でサーバーに保存し、'
+            f'圧縮後 {cleansing.DOWNLOAD_MAX_BYTES // (1024 * 1024)} MB までのものはダウンロードもできます。'
+        )
     else:
-        data = pd.read_excel(uploaded_file)
-    
-    st.subheader('元のデータ')
-    st.write(data)
+        # データの読み込み
+        data = data_loader.load_uploaded_file(uploaded_file)
 
-    processed_data = data
+        st.subheader('元のデータ')
+        st.write(data)
 
     # 処理オプション
     remove_outliers_option = st.checkbox('外れ値の削除')
     data_cleansing_option = st.checkbox('欠損値の削除')
     remove_empty_columns_option = st.checkbox('値が入っていないカラム（列）の削除')
 
-    if st.button('データ処理'):
-        # 外れ値の削除
-        if remove_outliers_option:
-            num_cols = processed_data.select_dtypes(include=np.number).columns
-            if not num_cols.empty:
-                Q1 = processed_data[num_cols].quantile(0.25)
-                Q3 = processed_data[num_cols].quantile(0.75)
-                IQR = Q3 - Q1
-                outlier_condition = (
-                    (processed_data[num_cols] < (Q1 - 1.5 * IQR)) | 
-                    (processed_data[num_cols] > (Q3 + 1.5 * IQR))
+    options = cleansing.CleansingOptions(
+        remove_outliers=remove_outliers_option,
+        drop_missing=data_cleansing_option,
+        drop_empty_columns=remove_empty_columns_option
+    )
+
+    # ファイル名の作成
+    download_file_name = f"{uploaded_file.name.rsplit('.', 1)[0]}_processed"
+
+    if streaming and st.button('データ処理'):
+        # 1回目の読み込みで列ごとの分位数スケッチから閾値を求め、
+        # 2回目の読み込みで処理しながら gzip 圧縮した CSV として保存する
+        saved_path, n_rows, thresholds = cleansing.clean_csv_to_file(read_chunks, download_file_name, options)
+        if remove_outliers_option and thresholds.bounds.empty:
+            st.warning('外れ値を削除する数値列がありません')
+
+        st.subheader('処理済みのデータ')
+        st.write(f'処理後の行数： {n_rows}')
+        if remove_outliers_option and thresholds.approximate:
+            st.caption('※外れ値の判定に使う四分位数は、分位数スケッチによる近似値です。')
+        st.write(f'処理済みデータ（gzip 圧縮した CSV）の保存先： {saved_path}')
+        # ダウンロードでは保存したファイル全体をメモリに読み込むため、大きさに上限を設ける
+        if saved_path.stat().st_size <= cleansing.DOWNLOAD_MAX_BYTES:
+            with open(saved_path, 'rb') as saved_file:
+                st.download_button(
+                    label='処理済みデータをダウンロード',
+                    data=saved_file,
+                    file_name=saved_path.name,
+                    mime='application/gzip'
                 )
-                processed_data = processed_data[~outlier_condition.any(axis=1)]
-            else:
-                st.warning('外れ値を削除する数値列がありません')
-
-        # 欠損値の削除
-        if data_cleansing_option:
-            processed_data = processed_data.dropna()
-            processed_data = processed_data.applymap(
-                lambda x: x.strip() if isinstance(x, str) else x
+        else:
+            st.info(
+                f'圧縮後の大きさが {cleansing.DOWNLOAD_MAX_BYTES // (1024 * 1024)} MB を超えるため、'
+                'ダウンロードボタンは表示しません。上の保存先から取得してください。'
             )
 
-        # 空のカラムの削除
-        if remove_empty_columns_option:
-            empty_columns = processed_data.columns[data.isna().all()].tolist()
-            processed_data = processed_data.dropna(axis=1, how='all')
+    elif not streaming and st.button('データ処理'):
+        # 外れ値の削除 → 欠損値の削除（文字列の前後の空白も除去） → 値が入っていないカラムの削除
+        processed_data, thresholds = cleansing.clean_frame(data, options)
+        if remove_outliers_option and thresholds.bounds.empty:
+            st.warning('外れ値を削除する数値列がありません')
 
         st.subheader('処理済みのデータ')
         st.write(processed_data)
@@ -68,9 +96,6 @@ if uploaded_file is not None:
         # ファイル形式の選択
         file_format = st.selectbox('ダウンロードするファイル形式を選択', ['Excel', 'CSV'])
 
-        # ファイル名の作成
-        download_file_name = f"{uploaded_file.name.rsplit('.', 1)[0]}_processed"
-        
         # ダウンロードボタン
         if file_format == 'CSV':
             csv_data = processed_data.to_csv(index=False)
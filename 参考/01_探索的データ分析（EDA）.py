@@ -5,6 +5,9 @@ import matplotlib.pyplot as plt
 import japanize_matplotlib
 
 import common
+import data_loader
+import eda_summary
+import streaming_summary
 
 
 st.set_page_config(page_title='探索的データ分析（EDA）', layout='wide')
@@ -25,18 +28,43 @@ use_demo_data = st.checkbox('デモデータを使用')
 
 # データフレームの作成
 df = None
+csv_summary = None
 if use_demo_data:
-    df = pd.read_excel('datasets/eda_demo.xlsx', sheet_name=0)
+    df = data_loader.load_demo_data('datasets/eda_demo.xlsx')
     st.write(df.head())
 else:
     if uploaded_file is not None:
-        if uploaded_file.type == 'text/csv':
-            df = pd.read_csv(uploaded_file)
-            st.write(df.head())
+        # 大きな CSV は全体を読み込まず、チャンクごとに読みながら要約統計量だけを求める
+        streaming = streaming_summary.use_streaming(uploaded_file.name, uploaded_file.size)
+        if streaming and not st.checkbox('ファイル全体を読み込んで可視化する（メモリを多く使います）'):
+            def read_chunks():
+                # アップロードされたファイルを先頭から読み直す（コピーは作らない）
+                uploaded_file.seek(0)
+                return pd.read_csv(uploaded_file, chunksize=streaming_summary.CHUNKSIZE)
+
+            uploaded_file.seek(0)
+            st.write(pd.read_csv(uploaded_file, nrows=5))
+            # 再実行のたびに読み直さないよう、ファイル内容のハッシュ値ごとに要約をキャッシュする
+            # （getbuffer はアップロードされた内容をコピーせずに参照する）
+            with uploaded_file.getbuffer() as buffer:
+                digest = data_loader.file_digest(buffer)
+            csv_summary = streaming_summary.cached_summary(digest, read_chunks)
         else:
-            df = pd.read_excel(uploaded_file)
+            df = data_loader.load_uploaded_file(uploaded_file)
             st.write(df.head())
 
+if csv_summary is not None:
+    st.subheader('要約統計量')
+    st.write(csv_summary.describe())
+    st.caption('ファイルが大きいため、全体を読み込まずに要約しました。四分位数と異なり数（unique）は近似値です。')
+    approximate_top = csv_summary.approximate_top_columns()
+    if approximate_top:
+        st.caption(
+            f"※{', '.join(map(str, approximate_top))} の最頻値（top）は、度数の多い値の候補の中での最頻値です"
+            "（どの値も出現回数が少ないため、候補から外れた値の方が多い可能性があります）。"
+        )
+    st.info('可視化にはファイル全体の読み込みが必要です。表示する場合は上のチェックボックスを選択してください。')
+
 if df is not None:
     # カテゴリ変数と数値変数の選択
     cols = df.columns.tolist()
@@ -77,12 +105,11 @@ if df is not None:
         fig.update_layout(bargap=0.2)
         st.plotly_chart(fig)
 
-    # 数値変数の可視化
+    # 数値変数の可視化（度数・五数要約を先に集計し、生データは図に埋め込まない）
     for col in numerical_cols:
-        fig = px.histogram(df, x=col, title=f'【{col}】 の可視化（ヒストグラム）')
-        fig.update_layout(bargap=0.2)
+        fig = eda_summary.histogram_figure(df[col], title=f'【{col}】 の可視化（ヒストグラム）', x_title=col)
         st.plotly_chart(fig)
-        fig = px.box(df, x=col, title=f'【{col}】 の可視化（箱ひげ図）')
+        fig = eda_summary.box_figure([(col, df[col])], title=f'【{col}】 の可視化（箱ひげ図）', value_title=col)
         st.plotly_chart(fig)
         
         # AI解釈機能の追加（数値変数ごと）
@@ -119,7 +146,12 @@ if df is not None:
             numerical_cols, 
             default=numerical_cols
         )
-        fig = px.box(df, x=selected_num_cols, points='all', title='選択した数値変数の可視化')
+        fig = eda_summary.box_figure(
+            [(num_col, df[num_col]) for num_col in selected_num_cols],
+            title='選択した数値変数の可視化',
+            value_title='value',
+            group_title='variable'
+        )
         st.plotly_chart(fig)
 
     st.subheader('選択した２変数の可視化')
@@ -155,7 +187,13 @@ if df is not None:
             else:
                 cat_var, num_var = var2, var1
             
-            fig = px.box(df, x=cat_var, y=num_var, title=f'箱ひげ図： 【{cat_var}】 × 【{num_var}】')
+            fig = eda_summary.box_figure(
+                list(df.groupby(cat_var, sort=False)[num_var]),
+                title=f'箱ひげ図： 【{cat_var}】 × 【{num_var}】',
+                value_title=num_var,
+                group_title=cat_var,
+                orientation='v'
+            )
             st.plotly_chart(fig)
     
     st.subheader('２つのカテゴリ変数と１つの数値変数による棒グラフ')
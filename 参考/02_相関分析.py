@@ -1,16 +1,15 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import japanize_matplotlib
 import seaborn as sns
 import plotly.express as px
-import plotly.graph_objects as go
 import plotly.figure_factory as ff
-from plotly.subplots import make_subplots
 from PIL import Image
 
 import common
+import correlation_engine
+import data_loader
+import scatter_matrix
 
 
 st.set_page_config(page_title='相関分析', layout='wide')
@@ -36,16 +35,12 @@ use_demo_data = st.checkbox('デモデータを使用')
 # データフレームの作成
 df = None
 if use_demo_data:
-    df = pd.read_excel('datasets/correlation_demo.xlsx', sheet_name=0)
+    df = data_loader.load_demo_data('datasets/correlation_demo.xlsx')
     st.write(df.head())
 else:
     if uploaded_file is not None:
-        if uploaded_file.type == 'text/csv':
-            df = pd.read_csv(uploaded_file)
-            st.write(df.head())
-        else:
-            df = pd.read_excel(uploaded_file)
-            st.write(df.head())
+        df = data_loader.load_uploaded_file(uploaded_file)
+        st.write(df.head())
 
 if df is not None:
     # 欠損値削除のチェックボックス
@@ -65,12 +60,17 @@ if df is not None:
     if len(selected_cols) < 2:
         st.write('少なくとも2つの変数を選択してください。')
     else:
-        # 相関マトリックスの計算
-        corr_matrix = df[selected_cols].corr()
+        # 相関マトリックス・p値・信頼区間をまとめて計算（欠損値はペアワイズ除外）
+        corr_result = correlation_engine.correlation_matrix(df, selected_cols)
+        corr_matrix = corr_result.r
         
         # 相関マトリックスの表示
         st.subheader('相関マトリックス')
         st.dataframe(corr_matrix)
+
+        # p値マトリックスの表示
+        st.subheader('p値マトリックス')
+        st.dataframe(corr_result.p.style.format('{:.3f}'))
         
         # ヒートマップの表示
         fig_heatmap = px.imshow(
@@ -100,58 +100,8 @@ if df is not None:
         # 散布図行列の作成
         st.subheader('散布図行列')
         
-        # Plotlyで散布図行列を作成
-        fig = make_subplots(
-            rows=len(selected_cols), 
-            cols=len(selected_cols),
-            subplot_titles=['' for _ in range(len(selected_cols) * len(selected_cols))]
-        )
-
-        # ヒストグラムと散布図の作成
-        for i, var1 in enumerate(selected_cols):
-            for j, var2 in enumerate(selected_cols):
-                row = i + 1
-                col = j + 1
-                
-                if i == j:  # 対角線上にヒストグラムを配置
-                    fig.add_trace(
-                        go.Histogram(x=df[var1], name=var1),
-                        row=row, col=col
-                    )
-                else:  # 散布図を配置
-                    fig.add_trace(
-                        go.Scatter(
-                            x=df[var2],
-                            y=df[var1],
-                            mode='markers',
-                            marker=dict(size=6),
-                            showlegend=False
-                        ),
-                        row=row, col=col
-                    )
-
-        # レイアウトの調整
-        fig.update_layout(
-            height=200 * len(selected_cols),
-            width=200 * len(selected_cols),
-            showlegend=False,
-            title='散布図行列とヒストグラム'
-        )
-        
-        # 軸ラベルの追加
-        for i, var1 in enumerate(selected_cols):
-            for j, var2 in enumerate(selected_cols):
-                # 横軸のラベルを最下の行のみに設定
-                if i == len(selected_cols) - 1:  
-                    fig.update_xaxes(title_text=var2, row=i+1, col=j+1)
-                else:
-                    fig.update_xaxes(title_text='', row=i+1, col=j+1)
-        
-                # 縦軸のラベルを最左の列のみに設定
-                if j == 0:  
-                    fig.update_yaxes(title_text=var1, row=i+1, col=j+1)
-                else:
-                    fig.update_yaxes(title_text='', row=i+1, col=j+1)
+        # 散布図行列を作成（データ件数に応じて SVG / WebGL / 格子集計を自動で切り替え）
+        fig = scatter_matrix.build_scatter_matrix(df, selected_cols)
 
         st.plotly_chart(fig)
         
@@ -192,17 +142,10 @@ if df is not None:
                     selected_pair_idx = pair_options.index(selected_pair_str)
                     var1, var2 = pairs[selected_pair_idx]
 
-                    # p値を計算（相関係数の有意性検定）
-                    from scipy import stats as scipy_stats
-                    n = len(df[[var1, var2]].dropna())
+                    # 相関係数の有意性検定（計算済みの p値マトリックスから取得）
+                    n = int(corr_result.n.loc[var1, var2])
                     r = corr_matrix.loc[var1, var2]
-
-                    # t統計量とp値の計算
-                    if abs(r) < 1:
-                        t_stat = r * np.sqrt(n - 2) / np.sqrt(1 - r**2)
-                        p_value = 2 * (1 - scipy_stats.t.cdf(abs(t_stat), n - 2))
-                    else:
-                        p_value = 0.0
+                    p_value = corr_result.p.loc[var1, var2]
 
                     # 結果をまとめる
                     correlation_results = {
@@ -9,6 +9,12 @@ import streamlit as st
 from PIL import Image
 
 import common
+import contingency_engine
+import data_loader
+
+
+# 水準が多い場合に一覧表示する有意なセルの数
+MAX_LISTED_CELLS = 100
 
 
 st.set_page_config(page_title="カイ２乗分析", layout="wide")
@@ -34,16 +40,12 @@ use_demo_data = st.checkbox('デモデータを使用')
 # データフレームの作成
 df = None
 if use_demo_data:
-    df = pd.read_excel('datasets/chi_square_demo.xlsx', sheet_name=0)
+    df = data_loader.load_demo_data('datasets/chi_square_demo.xlsx')
     st.write(df.head())
 else:
     if uploaded_file is not None:
-        if uploaded_file.type == 'text/csv':
-            df = pd.read_csv(uploaded_file)
-            st.write(df.head())
-        else:
-            df = pd.read_excel(uploaded_file)
-            st.write(df.head())
+        df = data_loader.load_uploaded_file(uploaded_file)
+        st.write(df.head())
 
 if df is not None:
     # 欠損値削除のチェックボックス
@@ -75,122 +77,177 @@ if df is not None:
             # 選択した変数の度数分布のバープロット
             st.subheader(f'【{selected_col1}】 と 【{selected_col2}】 の度数分布')
 
-            # クロス表の作成
+            # クロス表の作成（水準の組み合わせを疎行列で集計する）
             try:
-                crosstab = pd.crosstab(df[selected_col1], df[selected_col2])
+                table = contingency_engine.contingency_table(df[selected_col1], df[selected_col2])
+                n_levels1, n_levels2 = table.counts.shape
 
                 # クロス表が空でないかチェック
-                if crosstab.empty or crosstab.sum().sum() == 0:
+                if table.n == 0:
                     st.error('エラー: クロス表が空です。データに有効な値が含まれていることを確認してください。')
                 else:
-                    # クロス表を長い形式に変換
-                    crosstab_long = crosstab.reset_index().melt(id_vars=selected_col1, value_name='度数')
-
-                    # プロットの作成
-                    fig = px.bar(
-                        crosstab_long,
-                        x=selected_col2,
-                        y='度数',
-                        color=selected_col1,
-                        barmode='group',
-                        labels={selected_col1: selected_col1, selected_col2: selected_col2, '度数': '度数'},
-                        title=f'【{selected_col1}】 と 【{selected_col2}】 の度数分布'
-                    )
-
-                    # グラフの表示
-                    st.plotly_chart(fig)
+                    # 水準が多い場合は密なクロス表・グラフを作らない
+                    show_dense = n_levels1 * n_levels2 <= contingency_engine.MAX_DISPLAY_CELLS
+
+                    if show_dense:
+                        crosstab = contingency_engine.to_frame(table, selected_col1, selected_col2)
+
+                        # クロス表を長い形式に変換
+                        crosstab_long = crosstab.reset_index().melt(id_vars=selected_col1, value_name='度数')
+
+                        # プロットの作成
+                        fig = px.bar(
+                            crosstab_long,
+                            x=selected_col2,
+                            y='度数',
+                            color=selected_col1,
+                            barmode='group',
+                            labels={selected_col1: selected_col1, selected_col2: selected_col2, '度数': '度数'},
+                            title=f'【{selected_col1}】 と 【{selected_col2}】 の度数分布'
+                        )
+
+                        # グラフの表示
+                        st.plotly_chart(fig)
+                    else:
+                        st.info(f'水準の組み合わせが多いため（{n_levels1} × {n_levels2}）、グラフとクロス表の表示を省略し、有意なセルの一覧を表示します。')
 
                     # クロス表の作成と表示
                     st.subheader(f'【{selected_col1}】 と 【{selected_col2}】 のクロス表')
 
                     # カイ２乗検定の実行
                     try:
-                        chi2, p_value, dof, expected = stats.chi2_contingency(crosstab)
-
-                        # 期待度数のデータフレームの作成
-                        expected_df = pd.DataFrame(expected, columns=crosstab.columns, index=crosstab.index)
-                        expected_df = expected_df.round(2)  # 小数点第2位で四捨五入
-
-                        # (観測度数 - 期待度数)^2 / 期待度数 の計算
-                        chi_square_value_df = ((crosstab - expected) ** 2) / expected
-                        chi_square_value_df = chi_square_value_df.round(2)  # 小数点第2位で四捨五入
-
-                        # 有意差を確認するための残差の計算
-                        residuals = (crosstab - expected) / np.sqrt(expected)
-
-                        # 有意水準0.05でのz値の閾値
-                        threshold = stats.norm.ppf(1 - 0.05 / 2)
-
-                        # 有意に差が出ているセルのマスキング
-                        mask_significant = residuals.abs() > threshold
-
-                        # セルに色を付ける
-                        colors = mask_significant.applymap(lambda x: 'background-color: yellow' if x else '')
+                        result = contingency_engine.chi_square_test(table)
+                        chi2, p_value, dof = result.chi2, result.p, result.dof
+
+                        # 期待度数が小さいセルの注意
+                        expected_warning = contingency_engine.expected_count_warning(result)
+                        if expected_warning:
+                            st.warning(expected_warning)
+
+                        if show_dense:
+                            # 期待度数のデータフレームの作成
+                            expected = contingency_engine.expected_counts(table)
+                            expected_df = pd.DataFrame(expected, columns=crosstab.columns, index=crosstab.index)
+                            expected_df = expected_df.round(2)  # 小数点第2位で四捨五入
+
+                            # (観測度数 - 期待度数)^2 / 期待度数 の計算
+                            chi_square_value_df = ((crosstab - expected) ** 2) / expected
+                            chi_square_value_df = chi_square_value_df.round(2)  # 小数点第2位で四捨五入
+
+                            # 有意差を確認するための調整済み標準化残差の計算
+                            residuals = contingency_engine.adjusted_residuals(table)
+
+                            # 有意水準0.05でのz値の閾値
+                            threshold = stats.norm.ppf(1 - 0.05 / 2)
+
+                            # 有意に差が出ているセルに色を付ける
+                            colors = pd.DataFrame(
+                                np.where(np.abs(residuals) > threshold, 'background-color: yellow', ''),
+                                index=crosstab.index,
+                                columns=crosstab.columns
+                            )
 
-                        # データフレームを表示
-                        st.subheader('データフレームの表示')
+                            # データフレームを表示
+                            st.subheader('データフレームの表示')
 
-                        st.write('＜観測度数＞')
-                        # 合計の行と列を追加
-                        crosstab['合計'] = crosstab.sum(axis=1)  # 行の合計
-                        crosstab.loc['合計'] = crosstab.sum()  # 列の合計
-                        st.write(crosstab.style.apply(lambda x: colors, axis=None))
+                            st.write('＜観測度数＞')
+                            # 合計の行と列を追加
+                            crosstab['合計'] = crosstab.sum(axis=1)  # 行の合計
+                            crosstab.loc['合計'] = crosstab.sum()  # 列の合計
+                            st.write(crosstab.style.apply(lambda x: colors, axis=None))
 
-                        st.write('＜期待度数＞')
-                        st.write(expected_df.style.apply(lambda x: colors, axis=None).format("{:.2f}"))
+                            st.write('＜期待度数＞')
+                            st.write(expected_df.style.apply(lambda x: colors, axis=None).format("{:.2f}"))
 
-                        st.write('＜カイ二乗値＞')
-                        st.caption('(観測度数 - 期待度数)^2 / 期待度数')
-                        st.write(chi_square_value_df.style.apply(lambda x: colors, axis=None).format("{:.2f}"))
+                            st.write('＜カイ二乗値＞')
+                            st.caption('(観測度数 - 期待度数)^2 / 期待度数')
+                            st.write(chi_square_value_df.style.apply(lambda x: colors, axis=None).format("{:.2f}"))
 
-                        st.caption('有意に差が出ているセルは黄色で表示されます:')
+                            st.caption('調整済み残差が有意に大きい（または小さい）セルは黄色で表示されます:')
+                        else:
+                            # 観測度数が 0 でないセルのうち、調整済み残差が有意なもの
+                            cells = contingency_engine.significant_cells(
+                                table, row_name=selected_col1, col_name=selected_col2
+                            )
+                            n_empty = contingency_engine.count_significant_empty_cells(table)
+                            st.write(f'総度数: {table.n}　観測された組み合わせ: {table.counts.nnz}')
+                            st.write(f'調整済み残差が有意なセル: {len(cells)} 個（観測度数が 0 で有意に少ないセル: {n_empty} 個）')
+                            st.dataframe(cells.head(MAX_LISTED_CELLS).rename(columns={
+                                'observed': '観測度数',
+                                'expected': '期待度数',
+                                'adj_residual': '調整済み残差'
+                            }))
+                            if len(cells) > MAX_LISTED_CELLS:
+                                st.caption(f'残差の絶対値が大きい順に {MAX_LISTED_CELLS} 個まで表示しています。')
 
                         # カイ二乗検定の結果を表示
                         st.subheader('カイ二乗検定の結果')
                         st.write(f'カイ二乗統計量: {chi2:.2f}')
+                        st.write(f'自由度: {dof}')
                         st.write(f'P値: {p_value:.2f}')
+                        st.write(f"クラメールの連関係数 (Cramér's V): {result.cramers_v:.3f}")
 
-                        # ヒートマップの作成（合計を除く）
-                        fig_heatmap = px.imshow(
-                            crosstab.iloc[:-1, :-1],  # 合計の行と列を除外
-                            labels=dict(x=selected_col2, y=selected_col1, color='観測度数'),
-                            title=f'【{selected_col1}】 と 【{selected_col2}】 の観測度数ヒートマップ'
+                        # 期待度数が小さい場合は、正確検定・モンテカルロ法による P値 も求める
+                        use_exact = st.checkbox(
+                            '正確検定でP値を求める（2×2 の表は Fisher の正確確率検定、それ以外はモンテカルロ法）',
+                            value=expected_warning is not None,
+                            key='exact_test'
                         )
+                        if use_exact:
+                            exact = contingency_engine.exact_test(table, seed=0)
+                            if exact.method == 'fisher_exact':
+                                st.write(f'Fisherの正確確率検定のP値: {exact.p:.4f}')
+                            else:
+                                st.write(f'モンテカルロ法によるP値: {exact.p:.4f}')
+                                st.caption(
+                                    f'周辺度数を固定した表を {exact.n_resamples} 回生成して求めました'
+                                    f'（P値の{contingency_engine.MC_CONFIDENCE:.1%}信頼区間: {exact.ci_lower:.4f} 〜 {exact.ci_upper:.4f}）。'
+                                    + ('信頼区間が有意水準0.05をまたがなくなった時点で打ち切っています。' if exact.stopped_early else '')
+                                )
+
+                        if show_dense:
+                            # ヒートマップの作成（合計を除く）
+                            fig_heatmap = px.imshow(
+                                crosstab.iloc[:-1, :-1],  # 合計の行と列を除外
+                                labels=dict(x=selected_col2, y=selected_col1, color='観測度数'),
+                                title=f'【{selected_col1}】 と 【{selected_col2}】 の観測度数ヒートマップ'
+                            )
 
-                        # アノテーションの追加 (観測度数をセルに表示)
-                        annotations = []
-                        for i, row in enumerate(crosstab.iloc[:-1, :-1].values):
-                            for j, value in enumerate(row):
-                                annotations.append({
-                                    'x': j,
-                                    'y': i,
-                                    'xref': 'x',
-                                    'yref': 'y',
-                                    'text': f"{value:.0f}",
-                                    'showarrow': False,
-                                    'font': {
-                                        'color': 'black'
-                                    }
-                                })
-
-                        # ヒートマップに観測度数を表示
-                        fig_heatmap.update_layout(annotations=annotations)
-                        fig_heatmap.update_layout(scene=dict(aspectmode="manual", aspectratio=dict(x=1, y=1, z=0.05)))
-
-                        # ヒートマップの表示
-                        st.plotly_chart(fig_heatmap)
+                            # アノテーションの追加 (観測度数をセルに表示)
+                            annotations = []
+                            for i, row in enumerate(crosstab.iloc[:-1, :-1].values):
+                                for j, value in enumerate(row):
+                                    annotations.append({
+                                        'x': j,
+                                        'y': i,
+                                        'xref': 'x',
+                                        'yref': 'y',
+                                        'text': f"{value:.0f}",
+                                        'showarrow': False,
+                                        'font': {
+                                            'color': 'black'
+                                        }
+                                    })
+
+                            # ヒートマップに観測度数を表示
+                            fig_heatmap.update_layout(annotations=annotations)
+                            fig_heatmap.update_layout(scene=dict(aspectmode="manual", aspectratio=dict(x=1, y=1, z=0.05)))
+
+                            # ヒートマップの表示
+                            st.plotly_chart(fig_heatmap)
 
                         # AI解釈機能の追加
                         if gemini_api_key and enable_ai_interpretation:
-                            # 結果をまとめる
+                            # 結果をまとめる（水準が多い場合はクロス表の代わりに有意なセルの一覧を渡す）
                             chi_square_results = {
                                 'chi2': chi2,
                                 'p_value': p_value,
                                 'dof': dof,
+                                'cramers_v': result.cramers_v,
                                 'var1': selected_col1,
                                 'var2': selected_col2,
-                                'crosstab': crosstab.iloc[:-1, :-1],  # 合計行・列を除く
-                                'expected': expected_df
+                                'crosstab': crosstab.iloc[:-1, :-1] if show_dense else cells.head(MAX_LISTED_CELLS),  # 合計行・列を除く
+                                'expected': expected_df if show_dense else None
                             }
 
                             # AI解釈を表示
@@ -206,12 +263,39 @@ if df is not None:
                         st.error(f'エラー: カイ二乗検定の実行中にエラーが発生しました。\n詳細: {str(e)}\n\n期待度数が小さすぎる可能性があります（各セルの期待度数が5以上必要）。')
                     except Exception as e:
                         st.error(f'エラー: 予期しないエラーが発生しました。\n詳細: {str(e)}')
-
             except KeyError as e:
                 st.error(f'エラー: 選択された変数がデータに存在しません。\n詳細: {str(e)}')
             except Exception as e:
                 st.error(f'エラー: クロス表の作成中にエラーが発生しました。\n詳細: {str(e)}')
 
+        # 全ての組み合わせの一括検定（スクリーニング）
+        st.subheader('全てのカテゴリ変数の組み合わせの一括検定')
+        if st.checkbox('全ての組み合わせについてカイ二乗検定を行う', key='screen_all'):
+            use_fdr = st.checkbox('p値をFDR（Benjamini-Hochberg法）で補正する', value=True, key='screen_fdr')
+            screening = contingency_engine.pairwise_chi_square(
+                df, categorical_cols, p_adjust='fdr_bh' if use_fdr else None
+            )
+            st.write(f'{len(categorical_cols)} 個の変数の {len(screening)} 通りの組み合わせを、p値の小さい順に表示します。')
+            screening = screening.rename(columns={
+                'var1': '変数1',
+                'var2': '変数2',
+                'n': '度数',
+                'dof': '自由度',
+                'chi2': 'カイ二乗統計量',
+                'p': 'P値',
+                'p_adj': '補正後のP値' if use_fdr else 'P値（補正なし）',
+                'cramers_v': "Cramér's V",
+                'n_low_expected': '期待度数5未満のセル数'
+            })
+            if not use_fdr:
+                screening = screening.drop(columns='P値（補正なし）')
+            st.dataframe(screening.style.format({
+                'カイ二乗統計量': '{:.2f}',
+                'P値': '{:.4f}',
+                '補正後のP値': '{:.4f}',
+                "Cramér's V": '{:.3f}'
+            }))
+
 # フッター
 common.display_copyright()
 common.display_special_thanks()
@@ -3,11 +3,12 @@ from statistics import median, variance
 import streamlit as st
 import pandas as pd
 import numpy as np
-from scipy import stats
 from PIL import Image
 import plotly.graph_objects as go
 
 import common
+import data_loader
+import ttest_engine
 
 
 st.set_page_config(page_title='t検定(対応なし)', layout='wide')
@@ -33,16 +34,12 @@ use_demo_data = st.checkbox('デモデータを使用')
 # データフレームの作成
 df = None
 if use_demo_data:
-    df = pd.read_excel('datasets/ttest_demo.xlsx', sheet_name=0)
+    df = data_loader.load_demo_data('datasets/ttest_demo.xlsx')
     st.write(df.head())
 else:
     if uploaded_file is not None:
-        if uploaded_file.type == 'text/csv':
-            df = pd.read_csv(uploaded_file)
-            st.write(df.head())
-        else:
-            df = pd.read_excel(uploaded_file)
-            st.write(df.head())
+        df = data_loader.load_uploaded_file(uploaded_file)
+        st.write(df.head())
 
 if df is not None:
     # 欠損値削除のチェックボックス
@@ -131,62 +128,22 @@ if df is not None:
             st.write('【平均値の差の検定（対応なし）】')
             groups = df[cat_var].iloc[:, 0].unique().tolist()
 
-            # 結果を保存するデータフレームの初期化
-            columns = ['全体M', '全体S.D', f'{groups[0]}M', f'{groups[0]}S.D',
-                       f'{groups[1]}M', f'{groups[1]}S.D', 'df', 't', 'p', 'sign', 'd']
-            df_results = pd.DataFrame(columns=columns)
-
-            for var in num_vars:
-                series = df[var]
-                group0_data = df[df[cat_var[0]] == groups[0]][var]
-                group1_data = df[df[cat_var[0]] == groups[1]][var]
-
-                n1 = len(group0_data)
-                n2 = len(group1_data)
-                s1_sq = np.var(group0_data, ddof=1)
-                s2_sq = np.var(group1_data, ddof=1)
-
-                # Welch–Satterthwaiteの式で自由度を計算
-                df_numerator = (s1_sq / n1 + s2_sq / n2) ** 2
-                df_denominator = ((s1_sq / n1) ** 2) / (n1 - 1) + ((s2_sq / n2) ** 2) / (n2 - 1)
-                df_welch = df_numerator / df_denominator
-
-                ttest_result = stats.ttest_ind(group0_data, group1_data, equal_var=False)
-                overall_mean = series.mean()
-                overall_std = series.std(ddof=1)
-                g0_mean = group0_data.mean()
-                g0_std = group0_data.std(ddof=1)
-                g1_mean = group1_data.mean()
-                g1_std = group1_data.std(ddof=1)
-
-                # 効果量dの計算（プールされた標準偏差を使用）
-                pooled_std = np.sqrt(((n1 - 1) * s1_sq + (n2 - 1) * s2_sq) / (n1 + n2 - 2))
-                effect_size = abs((g0_mean - g1_mean) / pooled_std)
-
-                if ttest_result.pvalue < 0.01:
-                    significance = '**'
-                elif ttest_result.pvalue < 0.05:
-                    significance = '*'
-                elif ttest_result.pvalue < 0.1:
-                    significance = '†'
-                else:
-                    significance = 'n.s.'
-
-                results_row = {
-                    '全体M': overall_mean,
-                    '全体S.D': overall_std,
-                    f'{groups[0]}M': g0_mean,
-                    f'{groups[0]}S.D': g0_std,
-                    f'{groups[1]}M': g1_mean,
-                    f'{groups[1]}S.D': g1_std,
-                    'df': df_welch,
-                    't': abs(ttest_result.statistic),
-                    'p': ttest_result.pvalue,
-                    'sign': significance,
-                    'd': effect_size
-                }
-
-                df_results.loc[var] = results_row
+            # 全ての数値変数について t検定を一括で計算
+            batch = ttest_engine.welch_ttest(df, cat_var[0], num_vars, groups)
+
+            df_results = pd.DataFrame({
+                '全体M': batch['mean'],
+                '全体S.D': batch['sd'],
+                f'{groups[0]}M': batch['mean0'],
+                f'{groups[0]}S.D': batch['sd0'],
+                f'{groups[1]}M': batch['mean1'],
+                f'{groups[1]}S.D': batch['sd1'],
+                'df': batch['df'],
+                't': batch['t'].abs(),
+                'p': batch['p'],
+                'sign': ttest_engine.significance_marks(batch['p']),
+                'd': batch['d'],
+            })
 
             # 結果の表示
             # 数値型の列だけを選択
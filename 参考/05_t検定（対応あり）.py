@@ -1,13 +1,13 @@
 from statistics import median, variance
 
-import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 from PIL import Image
-from scipy import stats
 
 import common
+import data_loader
+import ttest_engine
 
 
 st.set_page_config(page_title="t検定(対応あり)", layout="wide")
@@ -33,16 +33,12 @@ use_demo_data = st.checkbox('デモデータを使用')
 # データフレームの作成
 df = None
 if use_demo_data:
-    df = pd.read_excel('datasets/ttest_rel_demo.xlsx', sheet_name=0)
+    df = data_loader.load_demo_data('datasets/ttest_rel_demo.xlsx')
     st.write(df.head())
 else:
     if uploaded_file is not None:
-        if uploaded_file.type == 'text/csv':
-            df = pd.read_csv(uploaded_file)
-            st.write(df.head())
-        else:
-            df = pd.read_excel(uploaded_file)
-            st.write(df.head())
+        df = data_loader.load_uploaded_file(uploaded_file)
+        st.write(df.head())
 
 # 変数設定の注意点
 if st.checkbox('注意点の表示（クリックで開きます）'):
@@ -118,55 +114,22 @@ if df is not None:
 
             st.write("【平均値の差の検定（対応あり）】")
             
+            # 全てのペアについて対応のあるt検定を一括で計算（表とグラフで共用）
+            paired_results = ttest_engine.paired_ttest(df, pre_vars, post_vars)
+            paired_variable_list = paired_results.index.tolist()
+
             # 検定結果のデータフレームを作成
-            resultColumns = ["観測値M", "観測値S.D",
-                            "測定値M", "測定値S.D",
-                            'df', 't', 'p', 'sign', 'd']
-            index = [f'{pre_var} → {post_var}' for pre_var, post_var in zip(pre_vars, post_vars)]
-            result_df = pd.DataFrame(index=index, columns=resultColumns)
-            paired_variable_list = [f'{pre_var} → {post_var}' for pre_var, post_var in zip(pre_vars, post_vars)]
-
-            for pre_var, post_var, idx in zip(pre_vars, post_vars, index):
-                x = df[pre_var]
-                y = df[post_var]
-                n = len(x)
-
-                # 対応のあるt検定
-                ttest = stats.ttest_rel(x, y)
-                t = ttest.statistic
-                p = ttest.pvalue
-                df_t = n - 1  # 自由度
-
-                # 平均値と標準偏差
-                x_mean = x.mean()
-                y_mean = y.mean()
-                x_std = x.std(ddof=1)
-                y_std = y.std(ddof=1)
-
-                # 効果量dの計算（対応のあるデータの標準偏差を使用）
-                diff = x - y
-                d = abs((x_mean - y_mean) / diff.std(ddof=1))
-
-                # p値の判定をsignに格納
-                if p < 0.01:
-                    sign = "**"
-                elif p < 0.05:
-                    sign = "*"
-                elif p < 0.1:
-                    sign = "†"
-                else:
-                    sign = "n.s."
-
-                # 結果をデータフレームに格納
-                result_df.at[idx, '観測値M'] = x_mean
-                result_df.at[idx, '観測値S.D'] = x_std
-                result_df.at[idx, '測定値M'] = y_mean
-                result_df.at[idx, '測定値S.D'] = y_std
-                result_df.at[idx, 'df'] = df_t
-                result_df.at[idx, 't'] = t
-                result_df.at[idx, 'p'] = p
-                result_df.at[idx, 'sign'] = sign
-                result_df.at[idx, 'd'] = d
+            result_df = pd.DataFrame({
+                '観測値M': paired_results['mean_pre'],
+                '観測値S.D': paired_results['sd_pre'],
+                '測定値M': paired_results['mean_post'],
+                '測定値S.D': paired_results['sd_post'],
+                'df': paired_results['df'],
+                't': paired_results['t'],
+                'p': paired_results['p'],
+                'sign': ttest_engine.significance_marks(paired_results['p']),
+                'd': paired_results['d'],
+            })
 
             # 結果のデータフレームを表示
             numeric_columns = result_df.select_dtypes(include=['float64', 'int64']).columns
@@ -265,14 +228,13 @@ if df is not None:
                 )
 
             # グラフ描画部分
-            for pre_var, post_var in zip(pre_vars, post_vars):
-                x = df[pre_var]
-                y = df[post_var]
-                n = len(x)
+            for _, row in paired_results.iterrows():
+                pre_var = row['pre']
+                post_var = row['post']
                 data = pd.DataFrame({
                     '群': [pre_var, post_var],
-                    '平均値': [x.mean(), y.mean()],
-                    '誤差': [x.std(ddof=1) / np.sqrt(n), y.std(ddof=1) / np.sqrt(n)]  # 標準誤差に修正
+                    '平均値': [row['mean_pre'], row['mean_post']],
+                    '誤差': [row['se_pre'], row['se_post']]  # 標準誤差
                 })
 
                 # カテゴリを数値にマッピング
@@ -297,15 +259,9 @@ if df is not None:
                 if show_graph_title:
                     fig.update_layout(title_text=f'平均値の比較： {pre_var} → {post_var}')
 
-                # 各統計量を取得
-                ttest_result = stats.ttest_rel(x, y)
-                t = ttest_result.statistic
-                p_value = ttest_result.pvalue
-                n = len(x)
-                df_t = n - 1  # 自由度
-
-                diff = x - y
-                d = abs((x.mean() - y.mean()) / diff.std(ddof=1))
+                # 各統計量を取得（表の計算結果を再利用）
+                p_value = row['p']
+                d = row['d']
 
                 if p_value < 0.01:
                     significance_text = "p < 0.01 **"
@@ -354,8 +310,8 @@ if df is not None:
                 st.markdown(href, unsafe_allow_html=True)
 
                 # キャプションの追加
-                st.caption(f"【観測値】 平均値 (SD): {x.mean():.2f} ({x.std(ddof=1):.2f}), "
-                           f"【測定値】 平均値 (SD): {y.mean():.2f} ({y.std(ddof=1):.2f}), "
+                st.caption(f"【観測値】 平均値 (SD): {row['mean_pre']:.2f} ({row['sd_pre']:.2f}), "
+                           f"【測定値】 平均値 (SD): {row['mean_post']:.2f} ({row['sd_post']:.2f}), "
                            f"【危険率】　p値: {p_value:.3f},【効果量】 d値: {d:.2f}")
 
 # フッター
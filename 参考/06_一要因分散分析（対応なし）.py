@@ -5,10 +5,13 @@ import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 from PIL import Image
-from scipy import stats
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
 
+import anova_engine
+import bracket_layout
 import common
+import data_loader
+import posthoc
+import ttest_engine
 
 
 st.set_page_config(page_title="一要因分散分析(対応なし)", layout="wide")
@@ -35,17 +38,14 @@ use_demo_data = st.checkbox('デモデータを使用')
 df = None
 if use_demo_data:
     try:
-        df = pd.read_excel('datasets/anova_demo.xlsx', sheet_name=0)
+        df = data_loader.load_demo_data('datasets/anova_demo.xlsx')
         st.write(df.head())
     except FileNotFoundError:
         st.error("デモデータファイルが見つかりません。ファイルパスを確認してください。")
 else:
     if uploaded_file is not None:
         try:
-            if uploaded_file.type == 'text/csv':
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            df = data_loader.load_uploaded_file(uploaded_file)
             st.write(df.head())
         except Exception as e:
             st.error(f"ファイルの読み込み中にエラーが発生しました: {e}")
@@ -121,49 +121,25 @@ if df is not None:
 
             st.write('【分散分析（対応なし）】')
 
-            # 結果を保存するデータフレームの初期化
+            # 群コードを一度だけ作成し、全ての数値変数について分散分析を一括で計算
             groups = df[cat_var_str].unique()
-            k = len(groups)
-            N = len(df)
-            columns = ['全体M', '全体S.D'] + \
-                [f'{group}M' for group in groups] + \
-                [f'{group}S.D' for group in groups] + \
-                ['群間自由度', '群内自由度', 'F', 'p', 'sign', 'η²', 'ω²']
-            df_results = pd.DataFrame(columns=columns, index=num_vars)
-
-            for num_var in num_vars:
-                group_data = [df[df[cat_var_str] == group][num_var] for group in groups]
-                overall_mean = df[num_var].mean()
-                overall_std = df[num_var].std(ddof=1)
-                fval, pval = stats.f_oneway(*group_data)
-
-                # 自由度の計算
-                df_between = k - 1  # 群間自由度
-                df_within = N - k     # 群内自由度
-
-                # 分散と効果量の計算
-                ss_between = sum([len(group) * (group.mean() - overall_mean)**2 for group in group_data])
-                ss_total = sum((df[num_var] - overall_mean)**2)
-                ss_within = ss_total - ss_between
-                ms_within = ss_within / df_within
-
-                eta_squared = ss_between / ss_total
-                omega_squared = (ss_between - (df_between * ms_within)) / (ss_total + ms_within)
-
-                means = [group.mean() for group in group_data]
-                stds = [group.std(ddof=1) for group in group_data]
-
-                if pval < 0.01:
-                    sign = '**'
-                elif pval < 0.05:
-                    sign = '*'
-                elif pval < 0.1:
-                    sign = '†'
-                else:
-                    sign = 'n.s.'
-
-                df_results.loc[num_var] = [overall_mean, overall_std] + means + stds + \
-                    [df_between, df_within, fval, pval, sign, eta_squared, omega_squared]
+            anova = anova_engine.oneway_anova(df, cat_var_str, num_vars, groups)
+            table = anova.table
+
+            df_results = pd.concat([
+                pd.DataFrame({'全体M': table['mean'], '全体S.D': table['sd']}),
+                anova.mean.rename(columns=lambda group: f'{group}M'),
+                anova.sd.rename(columns=lambda group: f'{group}S.D'),
+                pd.DataFrame({
+                    '群間自由度': table['df_between'],
+                    '群内自由度': table['df_within'],
+                    'F': table['F'],
+                    'p': table['p'],
+                    'sign': ttest_engine.significance_marks(table['p']),
+                    'η²': table['eta_squared'],
+                    'ω²': table['omega_squared'],
+                }),
+            ], axis=1)
 
             # 結果の表示
             numeric_columns = df_results.select_dtypes(include=['float64', 'int64']).columns
@@ -172,30 +148,28 @@ if df is not None:
 
             st.write("【多重比較の結果】")
 
+            # 分散分析で求めた群平均・群内平均平方から、TukeyのHSDテストを一括で実行
+            # （結果は表とグラフの両方で使う）
+            sorted_groups = sorted(groups)
+            tukey_results = posthoc.tukey_hsd_from_anova(anova, groups=sorted_groups)
+
             for num_var in num_vars:
-                # TukeyのHSDテストを実行
-                try:
-                    tukey_result = pairwise_tukeyhsd(df[num_var], df[cat_var_str])
-                    # 結果をデータフレームに変換
-                    tukey_df = pd.DataFrame(data=tukey_result._results_table.data[1:], 
-                                            columns=tukey_result._results_table.data[0])
-                    st.write(f'＜　　{num_var}　　に対する多重比較の結果＞')
-                    st.write(tukey_df)
-
-                    # sign_captionを初期化
-                    sign_caption = ''
-
-                    # 各記号に対するチェックを実行
-                    for p_adj in tukey_df['p-adj']:
-                        if p_adj < 0.01 and 'p<0.01**' not in sign_caption:
-                            sign_caption += 'p<0.01** '
-                        elif p_adj < 0.05 and 'p<0.05*' not in sign_caption:
-                            sign_caption += 'p<0.05* '
-                        elif p_adj < 0.1 and 'p<0.1†' not in sign_caption:
-                            sign_caption += 'p<0.1† '
-                    st.caption(sign_caption)
-                except Exception as e:
-                    st.error(f"TukeyのHSDテスト実行中にエラーが発生しました: {e}")
+                tukey_df = tukey_results[num_var]
+                st.write(f'＜　　{num_var}　　に対する多重比較の結果＞')
+                st.write(tukey_df)
+
+                # sign_captionを初期化
+                sign_caption = ''
+
+                # 各記号に対するチェックを実行
+                for p_adj in tukey_df['p-adj']:
+                    if p_adj < 0.01 and 'p<0.01**' not in sign_caption:
+                        sign_caption += 'p<0.01** '
+                    elif p_adj < 0.05 and 'p<0.05*' not in sign_caption:
+                        sign_caption += 'p<0.05* '
+                    elif p_adj < 0.1 and 'p<0.1†' not in sign_caption:
+                        sign_caption += 'p<0.1† '
+                st.caption(sign_caption)
 
             # サンプルサイズの表示
             st.write('＜サンプルサイズ＞')
@@ -243,122 +217,19 @@ if df is not None:
 
             st.subheader('【可視化】')
 
-            # ブラケット付きの棒グラフを描画する関数
-            def create_bracket_annotation(x0, x1, y, text):
-                return dict(
-                    xref='x',
-                    yref='y',
-                    x=(x0 + x1) / 2,
-                    y=y,
-                    text=text,
-                    showarrow=False,
-                    font=dict(color='black'),
-                    xanchor='center',
-                    yanchor='bottom'
-                )
-
-            def create_bracket_shape(x0, x1, y_vline_bottom, bracket_y):
-                return dict(
-                    type='path',
-                    path=f'M {x0},{y_vline_bottom} L{x0},{bracket_y} L{x1},{bracket_y} L{x1},{y_vline_bottom}',
-                    line=dict(color='black'),
-                    xref='x',
-                    yref='y'
-                )
-
-            # レベル割り当て関数（比較が重ならないようレベルを決定）
-            def assign_levels(comparisons, category_positions):
-                # カテゴリの位置を取得
-                cat_positions = category_positions
-                
-                # 各比較を位置でソート（左端の位置、次に幅）
-                sorted_comparisons = []
-                for comp in comparisons:
-                    pos1 = cat_positions[comp[0]]
-                    pos2 = cat_positions[comp[1]]
-                    left = min(pos1, pos2)
-                    right = max(pos1, pos2)
-                    sorted_comparisons.append((left, right, comp))
-                
-                # 幅の狭い順にソート（狭いものを下のレベルに配置）
-                sorted_comparisons.sort(key=lambda x: x[1] - x[0], reverse=False)
-                
-                # レベルを割り当て
-                levels = []
-                comparison_levels = []
-                
-                for left, right, comp in sorted_comparisons:
-                    # 利用可能な最も低いレベルを見つける
-                    assigned_level = None
-                    for level_idx, level_ranges in enumerate(levels):
-                        # このレベルで重なりがないかチェック
-                        can_place = True
-                        margin = 0.5  # ブラケット間のマージン（視覚的な分離を確保）
-                        for existing_left, existing_right in level_ranges:
-                            # ブラケットが重なるかチェック（マージンを考慮）
-                            # 完全に分離されている場合のみ配置可能
-                            if not (right + margin <= existing_left or left - margin >= existing_right):
-                                can_place = False
-                                break
-                        
-                        if can_place:
-                            level_ranges.append((left, right))
-                            assigned_level = level_idx
-                            break
-                    
-                    # 新しいレベルが必要な場合
-                    if assigned_level is None:
-                        levels.append([(left, right)])
-                        assigned_level = len(levels) - 1
-                    
-                    comparison_levels.append((comp, assigned_level))
-                
-                # 元の順序に戻す
-                result_levels = []
-                for comp in comparisons:
-                    for c, level in comparison_levels:
-                        if c == comp:
-                            result_levels.append(level)
-                            break
-                
-                return result_levels, len(levels)
-
             for num_var in num_vars:
-                # TukeyのHSDテストを実行
-                try:
-                    tukey_result = pairwise_tukeyhsd(df[num_var], df[cat_var_str])
-                    # 結果をデータフレームに変換
-                    tukey_df = pd.DataFrame(data=tukey_result._results_table.data[1:], 
-                                            columns=tukey_result._results_table.data[0])
-                except Exception as e:
-                    st.error(f"TukeyのHSDテスト実行中にエラーが発生しました: {e}")
-                    continue
-
-                # 有意な比較を抽出
-                significant_comparisons = []
-                for _, row in tukey_df.iterrows():
-                    group1 = row['group1']
-                    group2 = row['group2']
-                    p_value = row['p-adj']
-                    if p_value < 0.1:
-                        if p_value < 0.01:
-                            significance = '**'
-                        elif p_value < 0.05:
-                            significance = '*'
-                        else:
-                            significance = '†'
-                        significant_comparisons.append((group1, group2, p_value, significance))
-
-                # 群ごとの平均値と標準誤差を計算
-                group_means = df.groupby(cat_var_str)[num_var].mean()
-                group_errors = df.groupby(cat_var_str)[num_var].std(ddof=1) / np.sqrt(df.groupby(cat_var_str)[num_var].count())
+                # 有意な比較を抽出（多重比較の計算結果を再利用）
+                significant_comparisons = posthoc.significant_comparisons(tukey_results[num_var])
+
+                # 群ごとの平均値と標準誤差（分散分析で計算済みの値を使用）
+                group_means = anova.mean.loc[num_var, sorted_groups]
+                group_errors = anova.sd.loc[num_var, sorted_groups] / np.sqrt(anova.n.loc[num_var, sorted_groups])
 
                 # カテゴリを数値にマッピング
                 category_positions = {group: i for i, group in enumerate(group_means.index)}
                 
-                # レベルを割り当て
-                comparisons = [(comp[0], comp[1]) for comp in significant_comparisons]
-                comparison_levels, num_levels = assign_levels(comparisons, category_positions) if comparisons else ([], 0)
+                # ブラケットの段を割り当て
+                comparison_levels, num_levels = bracket_layout.assign_levels(significant_comparisons, category_positions)
                 x_values = [category_positions[group] for group in group_means.index]
 
                 fig = go.Figure()
@@ -382,43 +253,15 @@ if df is not None:
                 # y軸の最大値を計算（群の数とレベル数に応じて動的に調整）
                 base_y_max = max(group_means + group_errors) * 1.1 if not group_means.empty else 1
                 num_groups = len(group_means)
+                spacing = bracket_layout.bracket_spacing(base_y_max, num_groups, num_levels)
+                y_max = spacing.y_max
 
-                # オフセットとステップサイズを群数とレベル数に応じて調整
-                y_offset = base_y_max * max(0.06, 0.15 / num_groups)  # 群が多いほど相対的に小さく
-                step_size = base_y_max * max(0.10, 0.25 / num_groups)  # 群が多いほど相対的に小さく
-
-                # レベル数が多い場合はさらに調整
-                if num_levels > 3:
-                    step_size = step_size * (1 + (num_levels - 3) * 0.1)
-
-                # レベルごとに必要な余白を計算
-                additional_height = num_levels * step_size + y_offset * 2.5
-                y_max = base_y_max + additional_height
-
-                # アノテーション配置の調整係数（群数に応じて動的に調整）
-                vline_bottom_factor = max(0.3, 0.8 / num_groups)  # ブラケット下端の余白
-                bracket_offset_factor = max(0.2, 0.5 / num_groups)  # ブラケット上端の追加余白
-                annotation_offset_factor = max(0.3, 0.8 / num_groups)  # アノテーションの余白
-
-                # ブラケットとアノテーションを追加
-                for idx, (comp, level) in enumerate(zip(significant_comparisons, comparison_levels)):
-                    group1, group2, p_value, significance = comp
-                    x0 = category_positions[group1]
-                    x1 = category_positions[group2]
-
-                    # ブラケットの下端はエラーバーの上端 + 余白
-                    y_vline_bottom = max(group_means[group1] + group_errors[group1],
-                                         group_means[group2] + group_errors[group2]) + y_offset * vline_bottom_factor
-
-                    # ブラケットの上端はレベルに応じて設定
-                    bracket_y = y_vline_bottom + (level * step_size) + y_offset * bracket_offset_factor
-
-                    # ブラケットを追加
-                    fig.add_shape(create_bracket_shape(x0, x1, y_vline_bottom, bracket_y))
-
-                    # アノテーションを追加（ブラケットの上に十分な余白を確保）
-                    annotation_y = bracket_y + y_offset * annotation_offset_factor
-                    fig.add_annotation(create_bracket_annotation(x0, x1, annotation_y, f'p < {p_value:.2f} {significance}'))
+                # ブラケットとアノテーションをまとめて追加
+                shapes, annotations = bracket_layout.bracket_items(
+                    significant_comparisons, comparison_levels, category_positions,
+                    (group_means + group_errors).to_dict(), spacing, num_groups
+                )
+                bracket_layout.add_brackets(fig, shapes, annotations)
 
                 # y軸の範囲を設定（上部に余裕を持たせる）
                 fig.update_yaxes(range=[0, y_max * 1.05])
@@ -1,17 +1,16 @@
-from itertools import combinations
 from statistics import median, variance
 
-import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import statsmodels.api as sm
 import streamlit as st
 from PIL import Image
-from scipy import stats
-from statsmodels.stats.anova import AnovaRM
-from statsmodels.stats.multitest import multipletests
 
+import anova_engine
+import bracket_layout
 import common
+import data_loader
+import ttest_engine
 
 
 st.set_page_config(page_title="一要因分散分析（対応あり）", layout="wide")
@@ -42,7 +41,7 @@ use_demo_data = st.checkbox('デモデータを使用')
 df = None
 if use_demo_data:
     try:
-        df = pd.read_excel('datasets/anova_demo_rel.xlsx', sheet_name=0)
+        df = data_loader.load_demo_data('datasets/anova_demo_rel.xlsx')
         st.write("【デモデータ】")
         st.write(df.head())
     except FileNotFoundError:
@@ -50,12 +49,7 @@ if use_demo_data:
 else:
     if uploaded_file is not None:
         try:
-            if uploaded_file.type == 'text/plain':
-                df = pd.read_csv(uploaded_file, delim_whitespace=True)
-            elif uploaded_file.type == 'text/csv':
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            df = data_loader.load_uploaded_file(uploaded_file)
             st.write("【アップロードデータ】")
             st.write(df.head())
         except Exception as e:
@@ -76,30 +70,31 @@ if df is not None:
     selected_vars = st.multiselect('検定対象の数値変数を選択してください（３項目以上）', 
                                    options=numeric_options)
     
+    rm = None
     if len(selected_vars) < 3:
         st.error("３つ以上の変数を選択してください。")
     else:
-        # 被験者識別子を自動追加（各行を１被験者とする）
-        df = df.copy()
-        df.insert(0, '被験者識別子', np.arange(1, len(df)+1))
-        
-        # ワイド形式からロング形式に変換（※表示はしません）
-        df_long = pd.melt(df, id_vars=['被験者識別子'], value_vars=selected_vars, 
-                          var_name='条件', value_name='測定値')
-        
+        # 各行を１被験者、各列を１条件とする行列のまま計算する（ロング形式には変換しない）
+        try:
+            rm = anova_engine.rm_anova(df, selected_vars, method='bonferroni')
+        except Exception as e:
+            st.error(f"分散分析の実行中にエラーが発生しました: {e}")
+        # 欠損値のない被験者が 2 人未満だと誤差の自由度が 0 になり、F 値や t 値が求まらない
+        if rm is not None and (rm.n_subjects < 2 or rm.anova_table['Den DF'].iloc[0] < 1):
+            st.error(f"分散分析の実行中にエラーが発生しました: 欠損値のない被験者が不足しています（{rm.n_subjects} 人）。2 人以上必要です。")
+            rm = None
+
+    if rm is not None:
         # ----------------------------
         # 要約統計量の表示
         # ----------------------------
         st.subheader("【要約統計量】")
-        summary_df = df_long.groupby('条件')['測定値'].agg(
-            有効N = 'count',
-            平均値 = 'mean',
-            中央値 = 'median',
-            標準偏差 = lambda x: x.std(ddof=1),
-            分散 = lambda x: x.var(ddof=1),
-            最小値 = 'min',
-            最大値 = 'max'
-        ).reset_index()
+        summary_df = df[selected_vars].agg(
+            ['count', 'mean', 'median', 'std', 'var', 'min', 'max']
+        ).T
+        summary_df.columns = ['有効N', '平均値', '中央値', '標準偏差', '分散', '最小値', '最大値']
+        summary_df['有効N'] = summary_df['有効N'].astype(int)
+        summary_df = summary_df.rename_axis('条件').reset_index()
         st.write(summary_df.style.format({
             '平均値': "{:.2f}",
             '中央値': "{:.2f}",
@@ -113,63 +108,48 @@ if df is not None:
         # 繰り返し測定ANOVA（対応のある分散分析）の実行
         # ----------------------------
         st.subheader("【分散分析（対応あり）】")
-        try:
-            aovrm = AnovaRM(df_long, depvar='測定値', subject='被験者識別子', within=['条件'])
-            res = aovrm.fit()
-            # anova_tableをデータフレームとして表示
-            st.dataframe(res.anova_table.style.format("{:.2f}"))
-        except Exception as e:
-            st.error(f"分散分析の実行中にエラーが発生しました: {e}")
+        st.dataframe(rm.anova_table.style.format("{:.2f}"))
+
+        # 球面性の検定（Mauchly）と自由度の補正係数
+        sphericity = rm.sphericity
+        st.write("【球面性の検定（Mauchly）】")
+        st.write(pd.DataFrame({
+            'W': [sphericity['W']],
+            'χ²': [sphericity['chi2']],
+            '自由度': [sphericity['df']],
+            'p': [sphericity['p']],
+            'ε (Greenhouse-Geisser)': [sphericity['eps_gg']],
+            'ε (Huynh-Feldt)': [sphericity['eps_hf']],
+        }).style.format("{:.2f}"))
+        if sphericity['p'] < 0.05:
+            st.caption("球面性の仮定が満たされていないため、Greenhouse-Geisser 補正後の p 値（Pr > F (GG)）を参照してください。")
 
         # ----------------------------
         # 多重比較（各条件間の対応のある t 検定＋ボンフェローニ補正）
         # ----------------------------
         st.subheader("【多重比較の結果】")
-        try:
-            levels = df_long['条件'].unique()
-            pairwise_results = []
-            # 全組み合わせに対して対応のある t 検定を実施
-            for (level1, level2) in combinations(levels, 2):
-                data1 = df_long[df_long['条件'] == level1][['被験者識別子', '測定値']]
-                data2 = df_long[df_long['条件'] == level2][['被験者識別子', '測定値']]
-                merged = pd.merge(data1, data2, on='被験者識別子', suffixes=('_1', '_2'))
-                t_stat, p_val = stats.ttest_rel(merged['測定値_1'], merged['測定値_2'])
-                pairwise_results.append([level1, level2, t_stat, p_val])
-            
-            # ボンフェローニ補正
-            p_vals = [row[3] for row in pairwise_results]
-            reject, pvals_corrected, _, _ = multipletests(p_vals, method='bonferroni')
-            
+        # 条件の列同士の差から、全組み合わせの対応のある t 検定を一括で計算済み
+        pairwise_df = pd.DataFrame({
+            'Level1': rm.pairwise['level1'],
+            'Level2': rm.pairwise['level2'],
+            't-stat': rm.pairwise['t'],
+            'p-value': rm.pairwise['p'],
+            'p-value (補正後)': rm.pairwise['p_adj'],
             # 判定：p補正値 < 0.01 → "**", < 0.05 → "*", < 0.1 → "†", それ以外は "n.s."
-            for i, row in enumerate(pairwise_results):
-                row.append(pvals_corrected[i])
-                p_adj = pvals_corrected[i]
-                if p_adj < 0.01:
-                    judgement = '**'
-                elif p_adj < 0.05:
-                    judgement = '*'
-                elif p_adj < 0.1:
-                    judgement = '†'
-                else:
-                    judgement = 'n.s.'
-                row.append(judgement)
-            pairwise_df = pd.DataFrame(pairwise_results, 
-                                       columns=['Level1', 'Level2', 't-stat', 'p-value', 'p-value (補正後)', '判定'])
-            st.write(pairwise_df.style.format({
-                't-stat': "{:.2f}",
-                'p-value': "{:.2f}",
-                'p-value (補正後)': "{:.2f}"
-            }))
-        except Exception as e:
-            st.error(f"多重比較の実行中にエラーが発生しました: {e}")
+            '判定': ttest_engine.significance_marks(rm.pairwise['p_adj']),
+        })
+        st.write(pairwise_df.style.format({
+            't-stat': "{:.2f}",
+            'p-value': "{:.2f}",
+            'p-value (補正後)': "{:.2f}"
+        }))
 
         # ----------------------------
         # サンプルサイズの表示
         # ----------------------------
         st.subheader("【サンプルサイズ】")
         st.write(f"全体のデータ数（行数）： {len(df)}")
-        subjects = df['被験者識別子'].unique()
-        st.write(f"被験者数： {len(subjects)}")
+        st.write(f"被験者数： {rm.n_subjects}")
 
         # ----------------------------
         # 可視化（各条件ごとの平均値と標準誤差＋ブラケット・アノテーション付き）
@@ -177,7 +157,7 @@ if df is not None:
         st.subheader("【可視化】")
         show_graph_title = st.checkbox('グラフタイトルを表示する', value=True)
         
-        group_stats = df_long.groupby('条件')['測定値'].agg(['mean', 'sem']).reset_index()
+        group_stats = rm.condition_stats[['mean', 'sem']].rename_axis('条件').reset_index()
         categories = group_stats['条件'].tolist()
         category_positions = {cat: i for i, cat in enumerate(categories)}
         
@@ -194,94 +174,12 @@ if df is not None:
         )
         if show_graph_title:
             fig.update_layout(title_text="各条件ごとの平均値と標準誤差")
-        
-        # 補助関数（ブラケットとアノテーション）
-        def create_bracket_annotation(x0, x1, y, text):
-            return dict(
-                xref='x',
-                yref='y',
-                x=(x0 + x1) / 2,
-                y=y,
-                text=text,
-                showarrow=False,
-                font=dict(color='black'),
-                xanchor='center',
-                yanchor='bottom'
-            )
-
-        def create_bracket_shape(x0, x1, y_vline_bottom, bracket_y):
-            return dict(
-                type='path',
-                path=f'M {x0},{y_vline_bottom} L{x0},{bracket_y} L{x1},{bracket_y} L{x1},{y_vline_bottom}',
-                line=dict(color='black'),
-                xref='x',
-                yref='y'
-            )
 
-        def assign_levels(comparisons, category_positions):
-            # カテゴリの位置を取得
-            cat_positions = category_positions
-            
-            # 各比較を位置でソート（左端の位置、次に幅）
-            sorted_comparisons = []
-            for comp in comparisons:
-                pos1 = cat_positions[comp[0]]
-                pos2 = cat_positions[comp[1]]
-                left = min(pos1, pos2)
-                right = max(pos1, pos2)
-                sorted_comparisons.append((left, right, comp))
-            
-            # 幅の狭い順にソート（狭いものを下のレベルに配置）
-            sorted_comparisons.sort(key=lambda x: x[1] - x[0], reverse=False)
-            
-            # レベルを割り当て
-            levels = []
-            comparison_levels = []
-            
-            for left, right, comp in sorted_comparisons:
-                # 利用可能な最も低いレベルを見つける
-                assigned_level = None
-                for level_idx, level_ranges in enumerate(levels):
-                    # このレベルで重なりがないかチェック
-                    can_place = True
-                    margin = 0.5  # ブラケット間のマージン（視覚的な分離を確保）
-                    for existing_left, existing_right in level_ranges:
-                        # ブラケットが重なるかチェック（マージンを考慮）
-                        if not (right + margin <= existing_left or left - margin >= existing_right):
-                            can_place = False
-                            break
-                    
-                    if can_place:
-                        level_ranges.append((left, right))
-                        assigned_level = level_idx
-                        break
-                
-                # 新しいレベルが必要な場合
-                if assigned_level is None:
-                    levels.append([(left, right)])
-                    assigned_level = len(levels) - 1
-                
-                comparison_levels.append((comp, assigned_level))
-            
-            # 元の順序に戻す
-            result_levels = []
-            for comp in comparisons:
-                for c, level in comparison_levels:
-                    if c == comp:
-                        result_levels.append(level)
-                        break
-            
-            return result_levels, len(levels)
-        
         # 棒グラフの上限を計算（群の数とレベル数に応じて動的に調整）
         base_y_max = (group_stats['mean'] + group_stats['sem']).max() * 1.1
         num_groups = len(group_stats)
 
-        # オフセットとステップサイズを群数とレベル数に応じて調整
-        y_offset = base_y_max * max(0.06, 0.15 / num_groups)  # 群が多いほど相対的に小さく
-        step_size = base_y_max * max(0.10, 0.25 / num_groups)  # 群が多いほど相対的に小さく
-        
-        # 多重比較で有意な比較結果があれば、ブラケット描画のためレベルを割り当て
+        # 多重比較で有意な比較結果があれば、ブラケット描画のため段を割り当て
         if 'significant_comparisons' in locals() or 'pairwise_df' in locals():
             # ここでは、先ほど抽出した有意な比較結果（p補正値 < 0.1）を利用する
             significant_comparisons = []
@@ -290,37 +188,17 @@ if df is not None:
                     significant_comparisons.append((row['Level1'], row['Level2'], row['p-value (補正後)'], row['判定']))
         else:
             significant_comparisons = []
-        
-        if significant_comparisons:
-            comp_list = [(comp[0], comp[1]) for comp in significant_comparisons]
-            comparison_levels, num_levels = assign_levels(comp_list, category_positions)
 
-            # レベル数が多い場合はさらに調整
-            if num_levels > 3:
-                step_size = step_size * (1 + (num_levels - 3) * 0.1)
-        else:
-            comparison_levels, num_levels = ([], 0)
-        additional_height = num_levels * step_size + y_offset * 2.5
-        y_max = base_y_max + additional_height
-        
-        # アノテーション配置の調整係数（群数に応じて動的に調整）
-        vline_bottom_factor = max(0.3, 0.8 / num_groups)  # ブラケット下端の余白
-        bracket_offset_factor = max(0.2, 0.5 / num_groups)  # ブラケット上端の追加余白
-        annotation_offset_factor = max(0.3, 0.8 / num_groups)  # アノテーションの余白
+        comparison_levels, num_levels = bracket_layout.assign_levels(significant_comparisons, category_positions)
+        spacing = bracket_layout.bracket_spacing(base_y_max, num_groups, num_levels)
+        y_max = spacing.y_max
 
-        if significant_comparisons:
-            for idx, (group1, group2, p_value, sign) in enumerate(significant_comparisons):
-                x0 = category_positions[group1]
-                x1 = category_positions[group2]
-                y_vline_bottom = max(
-                    group_stats[group_stats['条件'] == group1]['mean'].values[0] + group_stats[group_stats['条件'] == group1]['sem'].values[0],
-                    group_stats[group_stats['条件'] == group2]['mean'].values[0] + group_stats[group_stats['条件'] == group2]['sem'].values[0]
-                ) + y_offset * vline_bottom_factor
-                level = comparison_levels[idx]
-                bracket_y = y_vline_bottom + (level * step_size) + y_offset * bracket_offset_factor
-                fig.add_shape(create_bracket_shape(x0, x1, y_vline_bottom, bracket_y))
-                annotation_y = bracket_y + y_offset * annotation_offset_factor
-                fig.add_annotation(create_bracket_annotation(x0, x1, annotation_y, f"p < {p_value:.2f} {sign}"))
+        # ブラケットとアノテーションをまとめて追加
+        tops = dict(zip(group_stats['条件'], group_stats['mean'] + group_stats['sem']))
+        shapes, annotations = bracket_layout.bracket_items(
+            significant_comparisons, comparison_levels, category_positions, tops, spacing, num_groups
+        )
+        bracket_layout.add_brackets(fig, shapes, annotations)
         
         fig.update_yaxes(range=[0, y_max * 1.05])
         fig.update_layout(font=dict(family="IPAexGothic"))
@@ -343,10 +221,10 @@ if df is not None:
         # ----------------------------
         st.subheader("【解釈の補助】")
         try:
-            p_value_overall = res.anova_table['Pr > F'][0]
-            f_value_overall = res.anova_table['F Value'][0]
-            df_num = res.anova_table['Num DF'][0]
-            df_den = res.anova_table['Den DF'][0]
+            p_value_overall = rm.anova_table['Pr > F'].iloc[0]
+            f_value_overall = rm.anova_table['F Value'].iloc[0]
+            df_num = rm.anova_table['Num DF'].iloc[0]
+            df_den = rm.anova_table['Den DF'].iloc[0]
 
             if p_value_overall < 0.01:
                 significance_overall = "有意な差が生まれる"
@@ -365,10 +243,7 @@ if df is not None:
             # AI解釈機能を追加
             if enable_ai_interpretation and gemini_api_key:
                 # 各条件の平均値を辞書形式で取得
-                group_means = {}
-                for cond in df_long['条件'].unique():
-                    cond_mean = df_long[df_long['条件'] == cond]['測定値'].mean()
-                    group_means[str(cond)] = cond_mean
+                group_means = {str(cond): cond_mean for cond, cond_mean in rm.condition_stats['mean'].items()}
 
                 anova_results = {
                     'f_statistic': f_value_overall,
@@ -376,7 +251,7 @@ if df is not None:
                     'df_between': df_num,
                     'df_within': df_den,
                     'group_means': group_means,
-                    'eta_squared': 0.0,  # 一要因対応ありの場合は効果量が別途計算される
+                    'eta_squared': rm.anova_table['partial eta2'].iloc[0],
                     'analysis_type': '一要因分散分析（対応あり）'
                 }
                 common.AIStatisticalInterpreter.display_ai_interpretation(
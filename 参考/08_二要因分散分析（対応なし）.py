@@ -1,13 +1,14 @@
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
 import streamlit as st
 from PIL import Image
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
 
+import anova_engine
+import bracket_layout
 import common
+import data_loader
+import posthoc
 
 
 st.set_page_config(page_title="二要因分散分析(対応なし)", layout="wide")
@@ -35,17 +36,14 @@ use_demo_data = st.checkbox('デモデータを使用')
 df = None
 if use_demo_data:
     try:
-        df = pd.read_excel('datasets/2way_anova_demo_mix.xlsx', sheet_name=0)
+        df = data_loader.load_demo_data('datasets/2way_anova_demo_mix.xlsx')
         st.write(df.head())
     except FileNotFoundError:
         st.error("デモデータファイルが見つかりません。パスを確認してください。")
 else:
     if uploaded_file is not None:
         try:
-            if uploaded_file.type == 'text/csv':
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            df = data_loader.load_uploaded_file(uploaded_file)
             st.write(df.head())
         except Exception as e:
             st.error(f"ファイル読み込み中にエラーが発生しました: {e}")
@@ -110,6 +108,15 @@ if df is not None:
                 else:
                     return "n.s."
             
+            # 因子の組み合わせ（Interaction）を群とする多重比較を、全従属変数について一括で計算
+            df['Interaction'] = df[factor1].astype(str) + "_" + df[factor2].astype(str)
+            interaction_groups = sorted(df['Interaction'].unique())
+            interaction_anova = anova_engine.oneway_anova(df, 'Interaction', dep_vars, interaction_groups)
+            tukey_results = posthoc.tukey_hsd_from_anova(interaction_anova)
+
+            # 二要因分散分析（Type II）も計画行列を一度だけ分解して全従属変数まとめて解く
+            twoway_tables = anova_engine.twoway_anova(df, factor1, factor2, dep_vars, typ=2)
+
             # 各従属変数について解析
             for dv in dep_vars:
                 st.markdown(f"## 従属変数: {dv}")
@@ -136,14 +143,8 @@ if df is not None:
                 
                 # ② 二要因分散分析の実行
                 st.write("【二要因分散分析の実行】")
-                try:
-                    formula = f'Q("{dv}") ~ C(Q("{factor1}")) * C(Q("{factor2}"))'
-                    model = smf.ols(formula, data=df).fit()
-                    anova_results = sm.stats.anova_lm(model, typ=2)
-                    st.write(anova_results.style.format("{:.2f}"))
-                except Exception as e:
-                    st.error(f"二要因分散分析実行中にエラーが発生しました: {e}")
-                    continue
+                anova_results = twoway_tables[dv]
+                st.write(anova_results.style.format("{:.2f}"))
                 
                 # ③ ANOVA結果から解釈の補助を表示
                 st.subheader("【解釈の補助】")
@@ -172,9 +173,9 @@ if df is not None:
 
                     # 主効果と交互作用のp値を取得
                     effect_names = {
-                        "factor1": f'C(Q("{factor1}"))',
-                        "factor2": f'C(Q("{factor2}"))',
-                        "interaction": f'C(Q("{factor1}")):C(Q("{factor2}"))'
+                        "factor1": factor1,
+                        "factor2": factor2,
+                        "interaction": f'{factor1}:{factor2}'
                     }
 
                     anova_ai_results = {
@@ -196,142 +197,39 @@ if df is not None:
                 
                 # ④ 多重比較：TukeyのHSDテスト
                 st.write("【多重比較（TukeyのHSDテスト）】")
-                # Interaction列を作成（因子の組み合わせ）
-                df['Interaction'] = df[factor1].astype(str) + "_" + df[factor2].astype(str)
-                try:
-                    tukey_result = pairwise_tukeyhsd(endog=df[dv], groups=df['Interaction'])
-                    tukey_df = pd.DataFrame(
-                        data=tukey_result._results_table.data[1:],
-                        columns=tukey_result._results_table.data[0]
-                    )
-                    st.write(tukey_df.style.format({
-                        'meandiff': '{:.2f}',
-                        'p-adj': '{:.2f}',
-                        'lower': '{:.2f}',
-                        'upper': '{:.2f}'
-                    }))
-                    # 有意性のキャプション
-                    sign_caption = ''
-                    for p_adj in tukey_df['p-adj']:
-                        if p_adj < 0.01 and 'p<0.01**' not in sign_caption:
-                            sign_caption += 'p<0.01** '
-                        elif p_adj < 0.05 and 'p<0.05*' not in sign_caption:
-                            sign_caption += 'p<0.05* '
-                        elif p_adj < 0.1 and 'p<0.1†' not in sign_caption:
-                            sign_caption += 'p<0.1† '
-                    st.caption(sign_caption)
-                except Exception as e:
-                    st.error(f"TukeyのHSDテスト実行中にエラーが発生しました: {e}")
+                tukey_df = tukey_results[dv]
+                st.write(tukey_df.style.format({
+                    'meandiff': '{:.2f}',
+                    'p-adj': '{:.2f}',
+                    'lower': '{:.2f}',
+                    'upper': '{:.2f}'
+                }))
+                # 有意性のキャプション
+                sign_caption = ''
+                for p_adj in tukey_df['p-adj']:
+                    if p_adj < 0.01 and 'p<0.01**' not in sign_caption:
+                        sign_caption += 'p<0.01** '
+                    elif p_adj < 0.05 and 'p<0.05*' not in sign_caption:
+                        sign_caption += 'p<0.05* '
+                    elif p_adj < 0.1 and 'p<0.1†' not in sign_caption:
+                        sign_caption += 'p<0.1† '
+                st.caption(sign_caption)
                 
                 # ⑤ 可視化：Interactionごとの棒グラフの作成
                 st.subheader("【可視化】")
 
-                # ブラケット付きの棒グラフを描画する関数
-                def create_bracket_annotation(x0, x1, y, text):
-                    return dict(
-                        xref='x',
-                        yref='y',
-                        x=(x0 + x1) / 2,
-                        y=y,
-                        text=text,
-                        showarrow=False,
-                        font=dict(color='black'),
-                        xanchor='center',
-                        yanchor='bottom'
-                    )
-
-                def create_bracket_shape(x0, x1, y_vline_bottom, bracket_y):
-                    return dict(
-                        type='path',
-                        path=f'M {x0},{y_vline_bottom} L{x0},{bracket_y} L{x1},{bracket_y} L{x1},{y_vline_bottom}',
-                        line=dict(color='black'),
-                        xref='x',
-                        yref='y'
-                    )
-
-                # レベル割り当て関数（比較が重ならないようレベルを決定）
-                def assign_levels(comparisons, category_positions):
-                    # カテゴリの位置を取得
-                    cat_positions = category_positions
-
-                    # 各比較を位置でソート（左端の位置、次に幅）
-                    sorted_comparisons = []
-                    for comp in comparisons:
-                        pos1 = cat_positions[comp[0]]
-                        pos2 = cat_positions[comp[1]]
-                        left = min(pos1, pos2)
-                        right = max(pos1, pos2)
-                        sorted_comparisons.append((left, right, comp))
-
-                    # 幅の狭い順にソート（狭いものを下のレベルに配置）
-                    sorted_comparisons.sort(key=lambda x: x[1] - x[0], reverse=False)
-
-                    # レベルを割り当て
-                    levels = []
-                    comparison_levels = []
-
-                    for left, right, comp in sorted_comparisons:
-                        # 利用可能な最も低いレベルを見つける
-                        assigned_level = None
-                        for level_idx, level_ranges in enumerate(levels):
-                            # このレベルで重なりがないかチェック
-                            can_place = True
-                            margin = 0.5  # ブラケット間のマージン（視覚的な分離を確保）
-                            for existing_left, existing_right in level_ranges:
-                                # ブラケットが重なるかチェック（マージンを考慮）
-                                # 完全に分離されている場合のみ配置可能
-                                if not (right + margin <= existing_left or left - margin >= existing_right):
-                                    can_place = False
-                                    break
-
-                            if can_place:
-                                level_ranges.append((left, right))
-                                assigned_level = level_idx
-                                break
-
-                        # 新しいレベルが必要な場合
-                        if assigned_level is None:
-                            levels.append([(left, right)])
-                            assigned_level = len(levels) - 1
-
-                        comparison_levels.append((comp, assigned_level))
-
-                    # 元の順序に戻す
-                    result_levels = []
-                    for comp in comparisons:
-                        for c, level in comparison_levels:
-                            if c == comp:
-                                result_levels.append(level)
-                                break
-
-                    return result_levels, len(levels)
-
-                # ※ここでは、単純に元のdfのコピーを用いてグループごとの平均・標準誤差を計算
-                df_long = df.copy()
-                group_means = df_long.groupby('Interaction')[dv].mean()
-                group_errors = df_long.groupby('Interaction')[dv].apply(lambda x: x.std(ddof=1) / np.sqrt(len(x)))
-                sorted_groups = sorted(group_means.index)
+                # グループごとの平均・標準誤差（多重比較で計算済みの値を使用）
+                sorted_groups = [grp for grp in interaction_groups if interaction_anova.n.at[dv, grp] > 0]
+                group_means = interaction_anova.mean.loc[dv, sorted_groups]
+                group_errors = interaction_anova.sd.loc[dv, sorted_groups] / np.sqrt(interaction_anova.n.loc[dv, sorted_groups])
                 category_positions = {grp: i for i, grp in enumerate(sorted_groups)}
                 x_values = [category_positions[grp] for grp in sorted_groups]
 
                 # 有意な比較を抽出
-                significant_comparisons = []
-                for _, row in tukey_df.iterrows():
-                    group1 = row['group1']
-                    group2 = row['group2']
-                    p_value = row['p-adj']
-                    if p_value < 0.1:
-                        if p_value < 0.01:
-                            significance = '**'
-                        elif p_value < 0.05:
-                            significance = '*'
-                        else:
-                            significance = '†'
-                        significant_comparisons.append((group1, group2, p_value, significance))
+                significant_comparisons = posthoc.significant_comparisons(tukey_df)
 
-                # レベルを割り当て
-                comparisons = [(comp[0], comp[1]) for comp in significant_comparisons]
-                comparison_levels, num_levels = assign_levels(comparisons, category_positions) if comparisons else ([], 0)
+                # ブラケットの段を割り当て
+                comparison_levels, num_levels = bracket_layout.assign_levels(significant_comparisons, category_positions)
 
                 fig = go.Figure()
                 fig.add_trace(go.Bar(
@@ -352,42 +250,15 @@ if df is not None:
                 base_y_max = max([group_means[grp] + group_errors[grp] for grp in sorted_groups]) * 1.1 if sorted_groups else 1
                 num_groups = len(sorted_groups)
 
-                # オフセットとステップサイズを群数とレベル数に応じて調整
-                y_offset = base_y_max * max(0.06, 0.15 / num_groups)  # 群が多いほど相対的に小さく
-                step_size = base_y_max * max(0.10, 0.25 / num_groups)  # 群が多いほど相対的に小さく
-
-                # レベル数が多い場合はさらに調整
-                if num_levels > 3:
-                    step_size = step_size * (1 + (num_levels - 3) * 0.1)
-
-                # レベルごとに必要な余白を計算
-                additional_height = num_levels * step_size + y_offset * 2.5
-                y_max = base_y_max + additional_height
+                spacing = bracket_layout.bracket_spacing(base_y_max, num_groups, num_levels)
+                y_max = spacing.y_max
 
-                # アノテーション配置の調整係数（群数に応じて動的に調整）
-                vline_bottom_factor = max(0.3, 0.8 / num_groups)  # ブラケット下端の余白
-                bracket_offset_factor = max(0.2, 0.5 / num_groups)  # ブラケット上端の追加余白
-                annotation_offset_factor = max(0.3, 0.8 / num_groups)  # アノテーションの余白
-
-                # ブラケットとアノテーションを追加
-                for idx, (comp, level) in enumerate(zip(significant_comparisons, comparison_levels)):
-                    group1, group2, p_value, significance = comp
-                    x0 = category_positions[group1]
-                    x1 = category_positions[group2]
-
-                    # ブラケットの下端はエラーバーの上端 + 余白
-                    y_vline_bottom = max(group_means[group1] + group_errors[group1],
-                                         group_means[group2] + group_errors[group2]) + y_offset * vline_bottom_factor
-
-                    # ブラケットの上端はレベルに応じて設定
-                    bracket_y = y_vline_bottom + (level * step_size) + y_offset * bracket_offset_factor
-
-                    # ブラケットを追加
-                    fig.add_shape(create_bracket_shape(x0, x1, y_vline_bottom, bracket_y))
-
-                    # アノテーションを追加（ブラケットの上に十分な余白を確保）
-                    annotation_y = bracket_y + y_offset * annotation_offset_factor
-                    fig.add_annotation(create_bracket_annotation(x0, x1, annotation_y, f'p < {p_value:.2f} {significance}'))
+                # ブラケットとアノテーションをまとめて追加
+                shapes, annotations = bracket_layout.bracket_items(
+                    significant_comparisons, comparison_levels, category_positions,
+                    (group_means + group_errors).to_dict(), spacing, num_groups
+                )
+                bracket_layout.add_brackets(fig, shapes, annotations)
 
                 # y軸の範囲を設定（上部に余裕を持たせる）
                 fig.update_yaxes(range=[0, y_max * 1.05])
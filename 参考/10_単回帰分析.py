@@ -5,6 +5,7 @@ import statsmodels.api as sm
 import streamlit as st
 
 import common
+import data_loader
 
 
 st.set_page_config(page_title="単回帰分析", layout="wide")
@@ -23,13 +24,10 @@ use_demo_data = st.checkbox('デモデータを使用')
 
 input_df = None
 if use_demo_data:
-    input_df = pd.read_excel('datasets/correlation_demo.xlsx', sheet_name=0)
+    input_df = data_loader.load_demo_data('datasets/correlation_demo.xlsx')
 else:
     if uploaded_file is not None:
-        if uploaded_file.type == 'text/csv':
-            input_df = pd.read_csv(uploaded_file)
-        else:
-            input_df = pd.read_excel(uploaded_file)
+        input_df = data_loader.load_uploaded_file(uploaded_file)
 
 feature_col = None
 target_col = None
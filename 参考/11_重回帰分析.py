@@ -10,13 +10,13 @@ import japanize_matplotlib
 import networkx as nx
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
 import streamlit as st
 from scipy import stats
 from sklearn.metrics import r2_score
-from sklearn.preprocessing import StandardScaler
 
 import common
+import data_loader
+import regression_engine
 
 st.set_page_config(page_title='重回帰分析', layout='wide')
 
@@ -257,12 +257,9 @@ use_demo_data = st.checkbox('デモデータを使用')
 
 input_df = None
 if use_demo_data:
-    input_df = pd.read_excel('datasets/multiple_regression_demo.xlsx', sheet_name=0)
+    input_df = data_loader.load_demo_data('datasets/multiple_regression_demo.xlsx')
 elif uploaded_file is not None:
-    if uploaded_file.type == 'text/csv':
-        input_df = pd.read_csv(uploaded_file)
-    else:
-        input_df = pd.read_excel(uploaded_file)
+    input_df = data_loader.load_uploaded_file(uploaded_file)
         
 if input_df is not None:
     st.subheader('元のデータ')
@@ -339,60 +336,27 @@ if input_df is not None:
             # 個別結果を保存するリストを初期化
             individual_results = []
 
-            for y_column in y_columns:
-                y = input_df[y_column]
-
-                # 欠損値を含む行を削除（説明変数と目的変数の両方を考慮）
-                data_for_analysis = pd.concat([X, y], axis=1).dropna()
-                X_clean = data_for_analysis[X.columns]
-                y_clean = data_for_analysis[y_column]
+            # 全ての目的変数の回帰分析を、計画行列の 1 回の分解でまとめて計算
+            # 標準化係数は、元の変数は標準化したデータの回帰（定数項なし）から、
+            # 交互作用項は β × (SD_X / SD_Y) から求める
+            regression_results = regression_engine.multi_ols(
+                X, input_df[y_columns], standardize_cols=X_columns
+            )
 
-                if len(X_clean) == 0:
+            for y_column in y_columns:
+                if y_column not in regression_results:
                     st.error(f"目的変数 {y_column} の分析でデータが不足しています。欠損値を確認してください。")
                     continue
+                model = regression_results[y_column]
 
-                # 元のデータで回帰分析（偏回帰係数用）
-                X_with_const = sm.add_constant(X_clean)
-                model = sm.OLS(y_clean, X_with_const).fit()
-
-                # 偏回帰係数の取得
-                unstandardized_coefs = model.params.values
-
-                # 標準化係数の計算（元の変数のみ）
-                # 方法: β_standardized = β × (SD_X / SD_Y)
-                # ただし、元の変数のみを標準化して回帰分析を行う
-                X_original_clean = X_clean[X_columns]
-
-                scaler_X = StandardScaler()
-                scaler_y = StandardScaler()
-
-                X_original_standardized = scaler_X.fit_transform(X_original_clean)
-                y_standardized = scaler_y.fit_transform(y_clean.values.reshape(-1, 1)).flatten()
-
-                # 標準化されたデータで回帰分析（定数項なし、元の変数のみ）
-                model_standardized = sm.OLS(y_standardized, X_original_standardized).fit()
-                standardized_coefs_original = model_standardized.params
-
-                # 交互作用項の標準化係数を計算（β × SD_X / SD_Y の方法）
-                standardized_coefs_list = list(standardized_coefs_original)
-                if interaction_terms:
-                    sd_y = y_clean.std()
-                    for interaction_name in interaction_terms:
-                        sd_x_interaction = X_clean[interaction_name].std()
-                        # 対応する偏回帰係数のインデックスを取得
-                        var_idx = list(X.columns).index(interaction_name)
-                        beta_unstd = model.params[var_idx + 1]  # +1 は定数項の分
-                        beta_std = beta_unstd * (sd_x_interaction / sd_y)
-                        standardized_coefs_list.append(beta_std)
-
-                # 偏回帰係数と標準化係数をデータフレームにまとめる
+                # 偏回帰係数と標準化係数をデータフレームにまとめる（定数項の標準化係数は nan）
                 coefficients = pd.DataFrame({
-                    "変数": X_with_const.columns,
-                    "偏回帰係数": unstandardized_coefs,
-                    "標準化係数": np.insert(standardized_coefs_list, 0, np.nan)  # 定数項にnanを挿入
+                    "変数": model.coefficients.index,
+                    "偏回帰係数": model.coefficients['coef'].values,
+                    "標準化係数": model.coefficients['std_coef'].values
                 })
 
-                coefficients['p値'] = model.pvalues.values
+                coefficients['p値'] = model.coefficients['p'].values
                 
                 # 有意判定の追加
                 def significance(p):
@@ -427,8 +391,8 @@ if input_df is not None:
                 st.dataframe(coefficients)
                 
                 # 決定係数、F値、自由度、p値を取得
-                r2 = model.rsquared
-                f_value = model.fvalue
+                r2 = model.r2
+                f_value = model.f_value
                 df_model = int(model.df_model)
                 df_resid = int(model.df_resid)
                 p_value = model.f_pvalue
@@ -443,9 +407,9 @@ if input_df is not None:
                 st.dataframe(summary_df)
                 
                 # 数理モデルの表示
-                intercept = model.params[0]
-                coefs = model.params[1:]
-                equation_terms = [f"{coef:.2f} × {var}" for coef, var in zip(coefs, X_with_const.columns[1:])]
+                intercept = model.coefficients['coef'].iloc[0]
+                coefs = model.coefficients['coef'].iloc[1:]
+                equation_terms = [f"{coef:.2f} × {var}" for coef, var in zip(coefs, X_all_columns)]
                 equation = f"{y_column} = {intercept:.2f} + " + " + ".join(equation_terms)
                 st.write("数理モデル：")
                 st.write(equation)
@@ -13,6 +13,7 @@ from factor_analyzer.factor_analyzer import calculate_kmo, calculate_bartlett_sp
 from scipy.stats import chi2
 
 import common
+import data_loader
 
 
 st.set_page_config(page_title="因子分析", layout="wide")
@@ -24,19 +25,16 @@ common.display_header()
 st.write("データから因子構造を抽出し、因子負荷量、適合度指標、信頼性係数、そして因子平均を算出・ダウンロードできます。")
 
 # --- データ読み込み処理の関数化 ---
-@st.cache_data
 def load_data(file):
     """
     アップロードされたファイルを読み込み、DataFrameを返す
+    （解析結果は data_loader でファイル内容ごとにキャッシュされる）
     """
     try:
-        if file.type == 'text/csv':
-            return pd.read_csv(file)
-        elif file.type in ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.ms-excel']:
-            return pd.read_excel(file)
-        else:
-            st.error("対応していないファイル形式です。")
-            return None
+        return data_loader.load_uploaded_file(file)
+    except data_loader.UnsupportedFileTypeError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"データの読み込み中にエラーが発生しました: {str(e)}")
         return None
@@ -48,7 +46,7 @@ use_demo_data = st.checkbox('デモデータを使用')
 df = None
 if use_demo_data:
     try:
-        df = pd.read_excel('datasets/factor_analysis_demo.xlsx', sheet_name=0)
+        df = data_loader.load_demo_data('datasets/factor_analysis_demo.xlsx')
     except Exception as e:
         st.error(f"デモデータの読み込みに失敗しました: {str(e)}")
 else:
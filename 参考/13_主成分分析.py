@@ -7,6 +7,7 @@ from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler
 
 import common
+import data_loader
 
 
 common.set_font()
@@ -27,23 +28,17 @@ st.write("")
 uploaded_file = st.file_uploader("CSVまたはExcelファイルを選択してください", type=["csv", "xlsx"])
 use_demo_data = st.checkbox("デモデータを使用")
 
-@st.cache_data
 def load_data(file):
     """
     アップロードされたファイルを読み込み、DataFrameとして返す関数
     ExcelまたはCSV形式に対応
+    （解析結果は data_loader でファイル内容ごとにキャッシュされる）
     """
     try:
-        if file.type == "text/csv":
-            return pd.read_csv(file)
-        elif file.type in [
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            "application/vnd.ms-excel",
-        ]:
-            return pd.read_excel(file)
-        else:
-            st.error("対応していないファイル形式です。")
-            return None
+        return data_loader.load_uploaded_file(file)
+    except data_loader.UnsupportedFileTypeError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"データの読み込み中にエラーが発生しました: {e}")
         return None
@@ -52,7 +47,7 @@ df = None
 if use_demo_data:
     try:
         # ※ デモデータのファイルパスは適宜変更してください
-        df = pd.read_excel("datasets/factor_analysis_demo.xlsx", sheet_name=0)
+        df = data_loader.load_demo_data("datasets/factor_analysis_demo.xlsx")
     except Exception as e:
         st.error(f"デモデータの読み込みに失敗しました: {e}")
 elif uploaded_file is not None:
@@ -0,0 +1,790 @@
+"""
+分散分析の一括計算エンジン
+
+群を表すカテゴリ変数を一度だけ整数コードに変換（factorize）し、
+群ごとの十分統計量（有効 N・合計・偏差平方和）を全ての従属変数について
+行列演算でまとめて求める。
+群ごと・変数ごとに DataFrame をブールマスクで切り出す処理を繰り返さないため、
+群数 × 変数数が大きいデータでも計算量は O(行数 × 変数数) で済む。
+欠損値（NaN）は変数ごとに除外して計算する。
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import linalg, sparse, stats
+
+
+GroupStats = namedtuple('GroupStats', ['n', 'mean', 'var'])
+OneWayAnovaResult = namedtuple('OneWayAnovaResult', ['table', 'n', 'mean', 'sd', 'ms_within'])
+
+
+def factorize_groups(group_values, groups=None):
+    """
+    群の値を 0..k-1 の整数コードに変換する
+
+    groups を省略した場合は出現順（Series.unique() と同じ順序）になる。
+    どの群にも属さない値（欠損値など）のコードは -1 になる。
+    """
+    if groups is None:
+        codes, uniques = pd.factorize(pd.Series(group_values))
+        return codes, list(uniques)
+    codes = pd.Categorical(group_values, categories=list(groups)).codes
+    return codes.astype(np.intp), list(groups)
+
+
+def group_indicator(codes, k):
+    """整数コードから (行数 × 群数) の疎な指示行列を作る（-1 の行は全て 0）"""
+    codes = np.asarray(codes)
+    rows = np.flatnonzero(codes >= 0)
+    data = np.ones(len(rows))
+    return sparse.csr_matrix((data, (rows, codes[rows])), shape=(len(codes), k))
+
+
+def group_sufficient_stats(values, codes, k):
+    """
+    群ごとの有効 N・平均・不偏分散を全変数まとめて求める
+
+    Parameters
+    ----------
+    values : ndarray, shape (n_rows, n_vars)
+    codes : ndarray of int, shape (n_rows,)
+        factorize_groups で得た群コード
+    k : int
+        群の数
+
+    Returns
+    -------
+    GroupStats
+        n, mean, var はいずれも shape (k, n_vars) の配列
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    indicator_t = group_indicator(codes, k).T.tocsr()
+
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    n = np.rint(indicator_t @ valid.astype(float)).astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.asarray(indicator_t @ filled) / n
+
+        # 群平均からの偏差で平方和を求める（桁落ち対策の 2 段階計算）
+        row_means = mean[np.clip(codes, 0, None)]
+        dev = np.where(valid, values - row_means, 0.0)
+        ss = np.asarray(indicator_t @ (dev ** 2))
+        var = ss / (n - 1)
+    return GroupStats(n=n, mean=mean, var=var)
+
+
+def oneway_anova_from_stats(group_stats):
+    """
+    群ごとの十分統計量から一要因分散分析（対応なし）の結果を計算する
+
+    Returns
+    -------
+    dict
+        各キーに長さ n_vars の配列を持つ辞書
+        （n, mean, var, df_between, df_within, ss_between, ss_within,
+        ss_total, ms_within, F, p, eta_squared, omega_squared）
+    """
+    n_g, mean_g, var_g = group_stats
+    present = n_g > 0
+    n = n_g.sum(axis=0)
+    k = present.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grand_mean = np.where(present, n_g * mean_g, 0.0).sum(axis=0) / n
+        ss_between = np.where(present, n_g * (mean_g - grand_mean) ** 2, 0.0).sum(axis=0)
+        ss_within = np.where(n_g > 1, (n_g - 1) * var_g, 0.0).sum(axis=0)
+        ss_total = ss_between + ss_within
+
+        df_between = k - 1
+        df_within = n - k
+        ms_between = ss_between / df_between
+        ms_within = ss_within / df_within
+        f_value = ms_between / ms_within
+        p_value = stats.f.sf(f_value, df_between, df_within)
+
+        eta_squared = ss_between / ss_total
+        omega_squared = (ss_between - df_between * ms_within) / (ss_total + ms_within)
+
+    return {
+        'n': n,
+        'mean': grand_mean,
+        'var': ss_total / (n - 1),
+        'df_between': df_between,
+        'df_within': df_within,
+        'ss_between': ss_between,
+        'ss_within': ss_within,
+        'ss_total': ss_total,
+        'ms_within': ms_within,
+        'F': f_value,
+        'p': p_value,
+        'eta_squared': eta_squared,
+        'omega_squared': omega_squared,
+    }
+
+
+def oneway_anova(df, group_col, value_cols, groups=None):
+    """
+    DataFrame の複数の数値列について、一要因分散分析（対応なし）をまとめて行う
+
+    Parameters
+    ----------
+    df : DataFrame
+    group_col : str
+        群を表すカテゴリ変数の列名
+    value_cols : list of str
+        従属変数の列名
+    groups : sequence, optional
+        群の並び順（省略時は出現順）
+
+    Returns
+    -------
+    OneWayAnovaResult
+        table : 従属変数ごとの全体平均・標準偏差、自由度、平方和、F 値、p 値、η²、ω²
+        n, mean, sd : 従属変数 × 群 の有効 N・平均値・標準偏差
+        ms_within : 従属変数ごとの群内平均平方（多重比較で使用）
+    """
+    value_cols = list(value_cols)
+    codes, groups = factorize_groups(df[group_col].to_numpy(), groups)
+    values = df[value_cols].to_numpy(dtype=float)
+
+    group_stats = group_sufficient_stats(values, codes, len(groups))
+    res = oneway_anova_from_stats(group_stats)
+
+    index = pd.Index(value_cols)
+    table = pd.DataFrame({
+        'n': res['n'],
+        'mean': res['mean'],
+        'sd': np.sqrt(res['var']),
+        'df_between': res['df_between'],
+        'df_within': res['df_within'],
+        'ss_between': res['ss_between'],
+        'ss_within': res['ss_within'],
+        'ss_total': res['ss_total'],
+        'F': res['F'],
+        'p': res['p'],
+        'eta_squared': res['eta_squared'],
+        'omega_squared': res['omega_squared'],
+    }, index=index)
+
+    def per_group(array):
+        return pd.DataFrame(array.T, index=index, columns=groups)
+
+    return OneWayAnovaResult(
+        table=table,
+        n=per_group(group_stats.n),
+        mean=per_group(group_stats.mean),
+        sd=per_group(np.sqrt(group_stats.var)),
+        ms_within=pd.Series(res['ms_within'], index=index),
+    )
+
+
+RepeatedMeasuresResult = namedtuple(
+    'RepeatedMeasuresResult', ['anova_table', 'sphericity', 'pairwise', 'condition_stats', 'n_subjects']
+)
+
+
+def _orthonormal_contrasts(k):
+    """k 条件の直交正規化された対比行列（k × (k-1)）"""
+    centered = np.eye(k) - 1.0 / k
+    q, _ = np.linalg.qr(centered[:, :k - 1])
+    return q
+
+
+def sphericity_from_cov(cov, n):
+    """
+    条件間の共分散行列から球面性の検定と自由度の補正係数を求める
+
+    Returns
+    -------
+    dict
+        Mauchly の W・χ²・自由度・p 値と、Greenhouse–Geisser / Huynh–Feldt の ε
+    """
+    k = cov.shape[0]
+    contrasts = _orthonormal_contrasts(k)
+    t = contrasts.T @ cov @ contrasts
+    p_dim = k - 1
+
+    eig = np.linalg.eigvalsh(t)
+    eps_gg = eig.sum() ** 2 / (p_dim * (eig ** 2).sum())
+    eps_hf = (n * p_dim * eps_gg - 2) / (p_dim * (n - 1 - p_dim * eps_gg))
+    eps_hf = min(1.0, eps_hf)
+
+    if p_dim > 1:
+        w = np.prod(eig) / (eig.mean() ** p_dim)
+        factor = (n - 1) - (2 * p_dim ** 2 + p_dim + 2) / (6 * p_dim)
+        chi_sq = -factor * np.log(w)
+        dof = p_dim * (p_dim + 1) / 2 - 1
+        p_value = stats.chi2.sf(chi_sq, dof)
+    else:
+        # 2 条件では球面性は常に成り立つ
+        w, chi_sq, dof, p_value = 1.0, 0.0, 0, 1.0
+
+    return {
+        'W': w, 'chi2': chi_sq, 'df': dof, 'p': p_value,
+        'eps_gg': eps_gg, 'eps_hf': eps_hf, 'eps_lb': 1.0 / p_dim,
+    }
+
+
+def paired_comparisons_from_cov(levels, mean, cov, n, method='bonferroni'):
+    """
+    条件の平均値と共分散行列から、全ての条件の組み合わせの対応のある t検定を行う
+
+    差得点の分散は Var(Yi - Yj) = Sii + Sjj - 2Sij で求まるため、
+    組み合わせごとに差の列を作らずに済む。
+
+    Parameters
+    ----------
+    method : {'bonferroni', 'holm'}
+        p 値の補正方法
+    """
+    levels = list(levels)
+    i, j = np.triu_indices(len(levels), 1)
+    mean_diff = mean[i] - mean[j]
+    var_diff = cov[i, i] + cov[j, j] - 2 * cov[i, j]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se = np.sqrt(var_diff / n)
+        t = mean_diff / se
+        dz = np.abs(mean_diff) / np.sqrt(var_diff)
+    df_t = n - 1
+    p = 2 * stats.t.sf(np.abs(t), df_t)
+
+    return pd.DataFrame({
+        'level1': [levels[a] for a in i],
+        'level2': [levels[b] for b in j],
+        'mean_diff': mean_diff,
+        'se': se,
+        't': t,
+        'df': df_t,
+        'p': p,
+        'p_adj': adjust_pvalues(p, method),
+        'dz': dz,
+    })
+
+
+def adjust_pvalues(p_values, method='bonferroni'):
+    """多重比較の p 値補正（Bonferroni 法、Holm 法、または Benjamini-Hochberg 法による FDR 補正 'fdr_bh'）"""
+    p_values = np.asarray(p_values, dtype=float)
+    m = len(p_values)
+    if method == 'bonferroni':
+        return np.minimum(p_values * m, 1.0)
+    if method == 'holm':
+        order = np.argsort(p_values)
+        stepped = np.maximum.accumulate(p_values[order] * (m - np.arange(m)))
+        adjusted = np.empty(m)
+        adjusted[order] = np.minimum(stepped, 1.0)
+        return adjusted
+    if method == 'fdr_bh':
+        order = np.argsort(p_values)[::-1]
+        stepped = np.minimum.accumulate(p_values[order] * m / (m - np.arange(m)))
+        adjusted = np.empty(m)
+        adjusted[order] = np.minimum(stepped, 1.0)
+        return adjusted
+    raise ValueError(f'未対応の補正方法です: {method}')
+
+
+def rm_anova_matrix(values, levels, method='bonferroni'):
+    """
+    被験者 × 条件 の行列に対する一要因分散分析（対応あり）
+
+    行平均・列平均から条件・被験者・誤差の平方和を直接求めるため、
+    ロング形式への変換は行わない（メモリは O(被験者数 × 条件数)）。
+    欠損値を含む被験者（行）は除外する。
+
+    Parameters
+    ----------
+    values : ndarray, shape (n_subjects, k)
+    levels : sequence
+        条件名（列の順）
+
+    Returns
+    -------
+    RepeatedMeasuresResult
+        anova_table : statsmodels の AnovaRM と同じ列（F Value, Num DF, Den DF, Pr > F）に、
+            平方和・球面性補正後の p 値・偏 η² を加えた表
+        sphericity : Mauchly の検定と ε（dict）
+        pairwise : 条件の全組み合わせの対応のある t検定
+        condition_stats : 条件ごとの N・平均値・標準偏差・標準誤差
+        n_subjects : 分析に使った被験者数
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values).any(axis=1)]
+    n, k = values.shape
+    levels = list(levels)
+
+    grand_mean = values.mean()
+    col_means = values.mean(axis=0)
+    row_means = values.mean(axis=1)
+
+    ss_total = ((values - grand_mean) ** 2).sum()
+    ss_cond = n * ((col_means - grand_mean) ** 2).sum()
+    ss_subj = k * ((row_means - grand_mean) ** 2).sum()
+    ss_error = ss_total - ss_cond - ss_subj
+
+    df_cond = k - 1
+    df_error = (n - 1) * (k - 1)
+    ms_cond = ss_cond / df_cond
+    ms_error = ss_error / df_error
+    f_value = ms_cond / ms_error
+    p_value = stats.f.sf(f_value, df_cond, df_error)
+
+    cov = np.cov(values, rowvar=False, ddof=1)
+    sphericity = sphericity_from_cov(cov, n)
+
+    def corrected_p(eps):
+        return stats.f.sf(f_value, df_cond * eps, df_error * eps)
+
+    anova_table = pd.DataFrame({
+        'SS': [ss_cond],
+        'MS': [ms_cond],
+        'F Value': [f_value],
+        'Num DF': [float(df_cond)],
+        'Den DF': [float(df_error)],
+        'Pr > F': [p_value],
+        'Pr > F (GG)': [corrected_p(sphericity['eps_gg'])],
+        'Pr > F (HF)': [corrected_p(sphericity['eps_hf'])],
+        'SS Error': [ss_error],
+        'partial eta2': [ss_cond / (ss_cond + ss_error)],
+        'generalized eta2': [ss_cond / (ss_cond + ss_subj + ss_error)],
+    }, index=['条件'])
+
+    sd = np.sqrt(np.diag(cov))
+    condition_stats = pd.DataFrame({
+        'n': n,
+        'mean': col_means,
+        'sd': sd,
+        'sem': sd / np.sqrt(n),
+    }, index=pd.Index(levels))
+
+    return RepeatedMeasuresResult(
+        anova_table=anova_table,
+        sphericity=sphericity,
+        pairwise=paired_comparisons_from_cov(levels, col_means, cov, n, method),
+        condition_stats=condition_stats,
+        n_subjects=n,
+    )
+
+
+def rm_anova(df, value_cols, method='bonferroni'):
+    """DataFrame の列（各列が 1 条件、各行が 1 被験者）に対する一要因分散分析（対応あり）"""
+    value_cols = list(value_cols)
+    return rm_anova_matrix(df[value_cols].to_numpy(dtype=float), value_cols, method)
+
+
+TWOWAY_COLUMNS = ['sum_sq', 'df', 'F', 'PR(>F)']
+
+
+def _factor_columns(codes, k, coding):
+    """
+    群コードから因子の対比列（行数 × (k-1)）を作る
+
+    coding='treatment' は最初の水準を基準とするダミー変数、
+    coding='sum' は最後の水準を -1 とする効果コーディング（Type III 用）。
+    """
+    indicator = np.zeros((len(codes), k))
+    indicator[np.arange(len(codes)), codes] = 1.0
+    if coding == 'sum':
+        return indicator[:, :k - 1] - indicator[:, [k - 1]]
+    return indicator[:, 1:]
+
+
+def _interaction_columns(a_cols, b_cols):
+    """2 つの因子の対比列の全ての積（交互作用の列）"""
+    return (a_cols[:, :, None] * b_cols[:, None, :]).reshape(len(a_cols), -1)
+
+
+def residual_ss(design, values):
+    """
+    計画行列を一度だけ QR 分解し、全ての従属変数の残差平方和をまとめて求める
+
+    列ピボット付きの QR 分解で数値的な階数を判定するため、
+    空のセルがあって計画行列が階数落ちしていても計算できる。
+
+    Parameters
+    ----------
+    design : ndarray, shape (n_rows, n_cols)
+    values : ndarray, shape (n_rows, n_vars)
+        右辺（従属変数を列に並べたもの）
+
+    Returns
+    -------
+    (ndarray, int)
+        従属変数ごとの残差平方和と計画行列の階数
+    """
+    if design.shape[1] == 0:
+        return (values ** 2).sum(axis=0), 0
+    q, r, _ = linalg.qr(design, mode='economic', pivoting=True)
+    diag = np.abs(np.diag(r))
+    tol = max(design.shape) * np.finfo(float).eps * diag[0]
+    rank = int((diag > tol).sum())
+    q = q[:, :rank]
+    resid = values - q @ (q.T @ values)
+    return (resid ** 2).sum(axis=0), rank
+
+
+def twoway_anova_arrays(values, codes_a, k_a, codes_b, k_b, typ=2):
+    """
+    欠損のない行について、二要因分散分析（対応なし）を全従属変数まとめて計算する
+
+    主効果・交互作用の平方和は、項を除いたモデルとの残差平方和の差として求める。
+    比較に必要なモデルは高々 4 つで、それぞれの計画行列を一度だけ分解し、
+    全ての従属変数を多列の右辺として同時に解く。
+
+    typ=2 : A = RSS(B) - RSS(A+B), B = RSS(A) - RSS(A+B), A:B = RSS(A+B) - RSS(full)
+    typ=3 : 効果コーディングで、各項 = RSS(full からその項を除く) - RSS(full)
+
+    Returns
+    -------
+    dict
+        項の名前（'Intercept'（typ=3 のみ）, 'A', 'B', 'A:B', 'Residual'）→
+        (平方和の配列, 自由度) のタプル
+    """
+    n_rows = len(values)
+    coding = 'sum' if typ == 3 else 'treatment'
+    terms = {
+        'Intercept': np.ones((n_rows, 1)),
+        'A': _factor_columns(codes_a, k_a, coding),
+        'B': _factor_columns(codes_b, k_b, coding),
+    }
+    terms['A:B'] = _interaction_columns(terms['A'], terms['B'])
+
+    fitted = {}
+
+    def fit(names):
+        key = tuple(names)
+        if key not in fitted:
+            design = np.hstack([terms[name] for name in names])
+            fitted[key] = residual_ss(design, values)
+        return fitted[key]
+
+    full = ('Intercept', 'A', 'B', 'A:B')
+    rss_full, rank_full = fit(full)
+    if typ == 2:
+        reduced = {
+            'A': (('Intercept', 'B'), ('Intercept', 'A', 'B')),
+            'B': (('Intercept', 'A'), ('Intercept', 'A', 'B')),
+            'A:B': (('Intercept', 'A', 'B'), full),
+        }
+    elif typ == 3:
+        reduced = {
+            name: (tuple(t for t in full if t != name), full)
+            for name in full
+        }
+    else:
+        raise ValueError('typ には 2 または 3 を指定してください。')
+
+    result = {}
+    for name, (smaller, larger) in reduced.items():
+        rss_small, rank_small = fit(smaller)
+        rss_large, rank_large = fit(larger)
+        result[name] = (rss_small - rss_large, rank_large - rank_small)
+    result['Residual'] = (rss_full, n_rows - rank_full)
+    return result
+
+
+def twoway_anova(df, factor_a, factor_b, value_cols, typ=2):
+    """
+    DataFrame の複数の数値列について、二要因分散分析（対応なし）をまとめて行う
+
+    statsmodels の ols + anova_lm を従属変数ごとに呼ぶ処理（式の解析と
+    計画行列の作成を毎回行う）の代わりに使う。
+    欠損値は従属変数ごとに除外するが、欠損の位置が同じ従属変数は
+    まとめて 1 回の行列演算で解く。
+
+    Parameters
+    ----------
+    df : DataFrame
+    factor_a, factor_b : str
+        因子（カテゴリ変数）の列名
+    value_cols : list of str
+        従属変数の列名
+    typ : {2, 3}
+        平方和のタイプ
+
+    Returns
+    -------
+    dict
+        従属変数名 → anova_lm と同じ列構成（sum_sq, df, F, PR(>F)）の分散分析表。
+        行は因子 A・因子 B・交互作用（「A:B」）・Residual（typ=3 では先頭に Intercept）
+    """
+    value_cols = list(value_cols)
+    codes_a, _ = factorize_groups(df[factor_a].to_numpy())
+    codes_b, _ = factorize_groups(df[factor_b].to_numpy())
+    values = df[value_cols].to_numpy(dtype=float)
+
+    labels = {
+        'Intercept': 'Intercept',
+        'A': factor_a,
+        'B': factor_b,
+        'A:B': f'{factor_a}:{factor_b}',
+        'Residual': 'Residual',
+    }
+    factor_ok = (codes_a >= 0) & (codes_b >= 0)
+    missing = np.isnan(values) | ~factor_ok[:, None]
+
+    tables = {}
+    for rows, cols in missing_patterns(missing):
+        sub_a, present_a = _recode(codes_a[rows])
+        sub_b, present_b = _recode(codes_b[rows])
+        res = twoway_anova_arrays(
+            values[np.ix_(rows, cols)], sub_a, len(present_a), sub_b, len(present_b), typ
+        )
+
+        ss_resid, df_resid = res['Residual']
+        for position, col in enumerate(cols):
+            sum_sq = np.array([ss[position] for ss, _ in res.values()])
+            dof = np.array([d for _, d in res.values()], dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                f_value = (sum_sq / dof) / (ss_resid[position] / df_resid)
+                p_value = stats.f.sf(f_value, dof, df_resid)
+            f_value[-1] = np.nan
+            p_value[-1] = np.nan
+            tables[value_cols[col]] = pd.DataFrame({
+                'sum_sq': sum_sq,
+                'df': dof,
+                'F': f_value,
+                'PR(>F)': p_value,
+            }, index=[labels[name] for name in res], columns=TWOWAY_COLUMNS)
+    return {col: tables[col] for col in value_cols}
+
+
+def missing_patterns(missing):
+    """
+    欠損の位置が同じ列をまとめる
+
+    Parameters
+    ----------
+    missing : ndarray of bool, shape (n_rows, n_cols)
+
+    Yields
+    ------
+    (ndarray of bool, ndarray of int)
+        計算に使う行（欠損のない行）のマスクと、そのパターンを持つ列の添字
+    """
+    patterns, pattern_ids = np.unique(missing.T, axis=0, return_inverse=True)
+    pattern_ids = np.ravel(pattern_ids)
+    for pattern_id, pattern in enumerate(patterns):
+        yield ~pattern, np.flatnonzero(pattern_ids == pattern_id)
+
+
+def _recode(codes):
+    """部分集合に現れない水準を詰めて 0..k-1 の整数コードに振り直す（元のコードも返す）"""
+    present, codes = np.unique(codes, return_inverse=True)
+    return codes.ravel(), present
+
+
+MIXED_COLUMNS = ['Source', 'SS', 'DF1', 'DF2', 'MS', 'F', 'p-unc', 'p-GG-corr', 'np2', 'eps']
+
+MixedAnovaResult = namedtuple('MixedAnovaResult', ['table', 'cell_stats', 'group_stats', 'n_subjects'])
+
+
+def mixed_anova_arrays(values, codes, k):
+    """
+    被験者 × 時点 の行列と群ベクトルから二要因混合分散分析をまとめて計算する
+
+    被験者間因子（群）・被験者内因子（時点）・交互作用の平方和を
+    群ごと・時点ごとの平均から直接求める。
+    最後の軸に複数の変数セット（前測・後測のペアなど）を並べれば、
+    全てのセットを一度の配列演算で計算する。
+
+    Parameters
+    ----------
+    values : ndarray, shape (n_subjects, n_times, n_sets)
+        欠損のない測定値
+    codes : ndarray of int, shape (n_subjects,)
+        0..k-1 の群コード（全ての群に 1 人以上いること）
+    k : int
+        群の数
+
+    Returns
+    -------
+    dict
+        平方和・自由度・ε は長さ n_sets の配列、
+        セルごとの n, mean, var, min, max は shape (k, n_times, n_sets) の配列
+    """
+    n, t, _ = values.shape
+    indicator = np.zeros((n, k))
+    indicator[np.arange(n), codes] = 1.0
+    n_g = indicator.sum(axis=0)
+
+    grand_mean = values.mean(axis=(0, 1))
+    subject_mean = values.mean(axis=1)
+    time_mean = values.mean(axis=0)
+    cell_mean = np.einsum('ng,ntm->gtm', indicator, values) / n_g[:, None, None]
+    group_mean = cell_mean.mean(axis=1)
+
+    ss_total = ((values - grand_mean) ** 2).sum(axis=(0, 1))
+    ss_between = t * (n_g[:, None] * (group_mean - grand_mean) ** 2).sum(axis=0)
+    ss_subjects = t * ((subject_mean - group_mean[codes]) ** 2).sum(axis=0)
+    ss_time = n * ((time_mean - grand_mean) ** 2).sum(axis=0)
+    ss_cells = (n_g[:, None, None] * (cell_mean - grand_mean) ** 2).sum(axis=(0, 1))
+    ss_interaction = ss_cells - ss_between - ss_time
+    ss_error = ss_total - ss_between - ss_subjects - ss_time - ss_interaction
+
+    # セルごとの分散と、群内でプールした時点間の共分散行列（ε の計算に使用）
+    dev = values - cell_mean[codes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cell_var = np.einsum('ng,ntm->gtm', indicator, dev ** 2) / (n_g[:, None, None] - 1)
+        pooled_cov = np.einsum('nsm,ntm->mst', dev, dev) / (n - k)
+        if t > 2:
+            contrasts = _orthonormal_contrasts(t)
+            projected = contrasts.T @ pooled_cov @ contrasts
+            trace = np.trace(projected, axis1=1, axis2=2)
+            eps = trace ** 2 / ((t - 1) * (projected ** 2).sum(axis=(1, 2)))
+        else:
+            eps = np.ones(values.shape[2])
+
+    cell_min = np.stack([values[codes == g].min(axis=0) for g in range(k)])
+    cell_max = np.stack([values[codes == g].max(axis=0) for g in range(k)])
+
+    return {
+        'ss_between': ss_between,
+        'ss_subjects': ss_subjects,
+        'ss_time': ss_time,
+        'ss_interaction': ss_interaction,
+        'ss_error': ss_error,
+        'df_between': k - 1,
+        'df_subjects': n - k,
+        'df_time': t - 1,
+        'df_interaction': (k - 1) * (t - 1),
+        'df_error': (n - k) * (t - 1),
+        'eps': eps,
+        'n': np.broadcast_to(n_g[:, None, None], cell_mean.shape),
+        'mean': cell_mean,
+        'var': cell_var,
+        'min': cell_min,
+        'max': cell_max,
+    }
+
+
+def mixed_anova(df, between_col, within_sets, within_labels, within_name='Time', correction=True):
+    """
+    ワイド形式の DataFrame に対して、二要因混合分散分析を変数セットごとにまとめて行う
+
+    各行が 1 被験者、within_sets の各要素が 1 つの変数セット（時点の順に並べた列名）。
+    ロング形式への変換は行わない。変数セットごとに、その列か群に欠損のある被験者を除外する
+    （欠損の位置が同じセットは 1 回の配列演算でまとめて計算する）。
+
+    Parameters
+    ----------
+    df : DataFrame
+    between_col : str
+        被験者間因子の列名
+    within_sets : list of list of str
+        変数セットのリスト（例: [[前測1, 後測1], [前測2, 後測2]]）
+    within_labels : sequence of str
+        時点の名前（例: ['前', '後']）
+    within_name : str
+        被験者内因子の名前（結果表の Source に使う）
+    correction : bool
+        被験者内の効果に Greenhouse-Geisser の補正を行った p 値を付けるかどうか
+
+    Returns
+    -------
+    list of MixedAnovaResult
+        within_sets と同じ順序。
+        table : pingouin の mixed_anova と同じ形式の分散分析表
+            （Source, SS, DF1, DF2, MS, F, p-unc, p-GG-corr, np2, eps）
+        cell_stats : 群 × 時点ごとの count, mean, std, min, max
+        group_stats : 群ごとの（全時点の測定値をまとめた）count, mean, std
+        n_subjects : 分析に使った被験者数
+    """
+    within_sets = [list(cols) for cols in within_sets]
+    within_labels = list(within_labels)
+    if any(len(cols) != len(within_labels) for cols in within_sets):
+        raise ValueError('変数セットの列数と時点の数が一致しません。')
+
+    codes, groups = factorize_groups(df[between_col].to_numpy())
+    groups = np.asarray(groups, dtype=object)
+    # 群の並びは群の値の昇順（ページの sorted・pingouin・groupby と同じ）。
+    # 数値と文字列が混ざるなど比較できない場合だけ文字列として並べる
+    try:
+        order = pd.Index(groups).argsort()
+    except TypeError:
+        order = np.argsort(groups.astype(str), kind='stable')
+    values = np.stack(
+        [df[cols].to_numpy(dtype=float) for cols in within_sets], axis=2
+    )
+    missing = np.isnan(values).any(axis=1) | (codes < 0)[:, None]
+
+    results = [None] * len(within_sets)
+    for rows, sets in missing_patterns(missing):
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        sub_codes, present = _recode(ranks[codes[rows]])
+        res = mixed_anova_arrays(values[np.ix_(rows, np.arange(len(within_labels)), sets)],
+                                 sub_codes, len(present))
+        labels = groups[order][present]
+        for position, set_idx in enumerate(sets):
+            results[set_idx] = _mixed_result(
+                res, position, labels, between_col, within_labels, within_name, correction
+            )
+    return results
+
+
+def _mixed_result(res, position, groups, between_col, within_labels, within_name, correction):
+    """mixed_anova_arrays の結果から 1 つの変数セットの結果表を作る"""
+    ss = np.array([res['ss_between'][position], res['ss_time'][position],
+                   res['ss_interaction'][position]])
+    df1 = np.array([res['df_between'], res['df_time'], res['df_interaction']], dtype=float)
+    df2 = np.array([res['df_subjects'], res['df_error'], res['df_error']], dtype=float)
+    errors = np.array([res['ss_subjects'][position], res['ss_error'][position],
+                       res['ss_error'][position]])
+    eps = res['eps'][position]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms = ss / df1
+        f_value = ms / (errors / df2)
+        p_value = stats.f.sf(f_value, df1, df2)
+        p_gg = np.full(3, np.nan)
+        if correction:
+            p_gg[1:] = stats.f.sf(f_value[1:], df1[1:] * eps, df2[1:] * eps)
+        np2 = ss / (ss + errors)
+
+    table = pd.DataFrame({
+        'Source': [between_col, within_name, 'Interaction'],
+        'SS': ss,
+        'DF1': df1,
+        'DF2': df2,
+        'MS': ms,
+        'F': f_value,
+        'p-unc': p_value,
+        'p-GG-corr': p_gg,
+        'np2': np2,
+        'eps': [np.nan, eps, np.nan],
+    }, columns=MIXED_COLUMNS)
+    if not correction:
+        table = table.drop(columns='p-GG-corr')
+
+    k, t = len(groups), len(within_labels)
+    cell_stats = pd.DataFrame({
+        between_col: np.repeat(groups, t),
+        within_name: np.tile(within_labels, k),
+        'count': res['n'][:, :, position].ravel().astype(np.int64),
+        'mean': res['mean'][:, :, position].ravel(),
+        'std': np.sqrt(res['var'][:, :, position]).ravel(),
+        'min': res['min'][:, :, position].ravel(),
+        'max': res['max'][:, :, position].ravel(),
+    })
+
+    # 全時点の測定値をまとめた群ごとの統計量（時点間の平均の差も分散に含める）
+    n_g = res['n'][:, 0, position]
+    mean_t = res['mean'][:, :, position]
+    group_mean = mean_t.mean(axis=1)
+    ss_group = ((n_g[:, None] - 1) * res['var'][:, :, position]).sum(axis=1) \
+        + n_g * ((mean_t - group_mean[:, None]) ** 2).sum(axis=1)
+    group_stats = pd.DataFrame({
+        'count': (n_g * t).astype(np.int64),
+        'mean': group_mean,
+        'std': np.sqrt(ss_group / (n_g * t - 1)),
+    }, index=pd.Index(groups, name=between_col))
+
+    return MixedAnovaResult(
+        table=table,
+        cell_stats=cell_stats,
+        group_stats=group_stats,
+        n_subjects=int(n_g.sum()),
+    )
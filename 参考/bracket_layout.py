@@ -0,0 +1,151 @@
+"""
+多重比較の結果を示すブラケット（有意な群の組み合わせを結ぶ線と p 値の注釈）の配置
+
+幅の狭い比較から順に、重ならない最も低い段（レベル）に置く。
+各段の占有範囲を群の位置ごとのビット列（Python の整数）で持ち、
+比較ごとの判定は 1 回の論理積で済ませる（段の中の区間を 1 つずつ調べない）。
+同じ段の 2 つのブラケットは、共有する群の位置があってはならない
+（以前の各ページの判定「余白 0.5 を空けて重ならない」と同じ結果になる）。
+
+図形と注釈は辞書のリストとしてまとめて作り、fig.update_layout で一度に追加する。
+fig.add_shape / fig.add_annotation を比較ごとに呼ぶと、有意な比較が数百あるときに遅い。
+"""
+from collections import namedtuple
+
+
+BRACKET_COLOR = 'black'
+
+# y_offset : ブラケットと棒の間の余白の基準
+# step_size : 段の間隔
+# y_max : 全ての段を収める縦軸の上限（目安）
+BracketSpacing = namedtuple('BracketSpacing', ['y_offset', 'step_size', 'y_max'])
+
+
+def assign_levels(comparisons, category_positions):
+    """
+    比較ごとにブラケットの段を決める
+
+    Parameters
+    ----------
+    comparisons : list of tuple
+        先頭の 2 要素が比較する群の名前
+    category_positions : dict
+        群の名前から横軸上の位置（0 から始まる整数）への対応
+
+    Returns
+    -------
+    (list, int)
+        comparisons と同じ順の段の番号（位置が分からない群を含む比較は None）と段の数
+    """
+    items = []
+    for idx, comp in enumerate(comparisons):
+        pos1 = category_positions.get(comp[0])
+        pos2 = category_positions.get(comp[1])
+        if pos1 is None or pos2 is None:
+            continue
+        left, right = sorted((int(pos1), int(pos2)))
+        items.append((right - left, idx, left, right))
+
+    # 幅の狭い順（同じ幅なら元の順）に、重ならない最も低い段に置く
+    items.sort()
+    level_masks = []
+    levels = [None] * len(comparisons)
+    for _, idx, left, right in items:
+        mask = ((1 << (right - left + 1)) - 1) << left
+        for level, occupied in enumerate(level_masks):
+            if not occupied & mask:
+                level_masks[level] = occupied | mask
+                break
+        else:
+            level = len(level_masks)
+            level_masks.append(mask)
+        levels[idx] = level
+    return levels, len(level_masks)
+
+
+def bracket_spacing(base_y_max, num_groups, num_levels):
+    """群の数と段の数から、ブラケットの余白・段の間隔・縦軸の上限を決める"""
+    # 群が多いほど相対的に小さく
+    y_offset = base_y_max * max(0.06, 0.15 / num_groups)
+    step_size = base_y_max * max(0.10, 0.25 / num_groups)
+    # 段の数が多い場合はさらに調整
+    if num_levels > 3:
+        step_size = step_size * (1 + (num_levels - 3) * 0.1)
+    y_max = base_y_max + num_levels * step_size + y_offset * 2.5
+    return BracketSpacing(y_offset=y_offset, step_size=step_size, y_max=y_max)
+
+
+def bracket_shape(x0, x1, y_vline_bottom, bracket_y):
+    return dict(
+        type='path',
+        path=f'M {x0},{y_vline_bottom} L{x0},{bracket_y} L{x1},{bracket_y} L{x1},{y_vline_bottom}',
+        line=dict(color=BRACKET_COLOR),
+        xref='x',
+        yref='y'
+    )
+
+
+def bracket_annotation(x0, x1, y, text):
+    return dict(
+        xref='x',
+        yref='y',
+        x=(x0 + x1) / 2,
+        y=y,
+        text=text,
+        showarrow=False,
+        font=dict(color=BRACKET_COLOR),
+        xanchor='center',
+        yanchor='bottom'
+    )
+
+
+def bracket_items(comparisons, levels, x_positions, tops, spacing, num_groups):
+    """
+    ブラケットの図形と注釈をまとめて作る
+
+    Parameters
+    ----------
+    comparisons : list of (group1, group2, p_value, significance)
+    levels : list of int or None
+        assign_levels で求めた段（None の比較は描かない）
+    x_positions : dict
+        群の名前から横軸上の位置（棒の中心）への対応
+    tops : dict
+        群の名前から棒の上端（平均値 + 誤差）への対応
+    spacing : BracketSpacing
+    num_groups : int
+
+    Returns
+    -------
+    (list of dict, list of dict)
+        図形と注釈
+    """
+    # 注釈の配置の調整係数（群数に応じて動的に調整）
+    vline_bottom = spacing.y_offset * max(0.3, 0.8 / num_groups)  # ブラケット下端の余白
+    bracket_offset = spacing.y_offset * max(0.2, 0.5 / num_groups)  # ブラケット上端の追加余白
+    annotation_offset = spacing.y_offset * max(0.3, 0.8 / num_groups)  # 注釈の余白
+
+    shapes = []
+    annotations = []
+    for (group1, group2, p_value, significance), level in zip(comparisons, levels):
+        if level is None:
+            continue
+        x0 = x_positions[group1]
+        x1 = x_positions[group2]
+        # ブラケットの下端は棒の上端 + 余白、上端は段に応じて設定
+        y_vline_bottom = max(tops[group1], tops[group2]) + vline_bottom
+        bracket_y = y_vline_bottom + level * spacing.step_size + bracket_offset
+        shapes.append(bracket_shape(x0, x1, y_vline_bottom, bracket_y))
+        annotations.append(bracket_annotation(
+            x0, x1, bracket_y + annotation_offset, f'p < {p_value:.2f} {significance}'
+        ))
+    return shapes, annotations
+
+
+def add_brackets(fig, shapes, annotations):
+    """図形と注釈を図に一度に追加する"""
+    fig.update_layout(
+        shapes=list(fig.layout.shapes) + shapes,
+        annotations=list(fig.layout.annotations) + annotations
+    )
+    return fig
@@ -0,0 +1,265 @@
+"""
+データクレンジングの処理
+
+外れ値（1.5 × IQR の外側）を含む行の削除、欠損値を含む行の削除と文字列の前後の空白の除去、
+値が入っていない列の削除を行う。
+
+文字列の空白除去は object / string 型の列だけに列単位の .str.strip() を使い、
+セルごとに Python の関数を呼ぶ applymap は使わない。
+
+大きな CSV はストリーミングで処理できる。
+1 回目の読み込みで全体の閾値（外れ値の上下限・値が入っていない列）を求め、
+2 回目の読み込みでチャンクごとに同じ規則を当てはめて、結果を CSV に逐次書き出す。
+1 回目の四分位数は列ごとの分位数スケッチ（streaming_summary.QuantileSketch）で近似するため、
+メモリ使用量はファイルの大きさによらずほぼ一定になる。
+チャンクごとの処理は行単位で完結するため、閾値が同じなら全体をメモリに載せた場合と同じ結果になる。
+ストリーミング処理の結果は gzip 圧縮した CSV として OUTPUT_DIR に保存する
+（st.download_button は渡したデータ全体をメモリに載せるため、結果をメモリ上に作らない）。
+"""
+import gzip
+import io
+import os
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import streaming_summary
+
+
+# ストリーミング処理のチャンク行数
+CHUNKSIZE = 100000
+# これ以上の大きさの CSV はストリーミングで処理する（バイト）
+STREAMING_BYTES = streaming_summary.STREAMING_BYTES
+# 箱の長さ（四分位範囲）に対する外れ値の判定幅
+IQR_FACTOR = 1.5
+# 1 回目の読み込みで使う分位数スケッチの精度パラメータ
+# （EDA の要約より大きくして、四分位数の順位の誤差を 0.2% 程度に抑える）
+SKETCH_K = 1000
+# ストリーミング処理の結果の保存先（環境変数で変更可能）
+OUTPUT_DIR = Path(os.environ.get(
+    'EASYSTAT_OUTPUT_DIR',
+    Path(tempfile.gettempdir()) / 'easy_stat_output',
+))
+# 保存する CSV の gzip の圧縮レベル（大きいほど小さくなるが遅い）
+GZIP_LEVEL = 6
+# 保存した結果をブラウザからダウンロードできる大きさ（圧縮後）の上限（バイト）
+# （ダウンロードでは保存したファイル全体をメモリに読み込むため）
+DOWNLOAD_MAX_BYTES = 200 * 1024 * 1024
+
+CleansingOptions = namedtuple(
+    'CleansingOptions', ['remove_outliers', 'drop_missing', 'drop_empty_columns']
+)
+
+# データ全体から求めた閾値
+# bounds : 数値列ごとの (下限, 上限) を行に持つ DataFrame（列 lower, upper）
+# empty_columns : 値が 1 つも入っていない列のリスト
+# approximate : 四分位数をスケッチで近似したかどうか
+Thresholds = namedtuple('Thresholds', ['bounds', 'empty_columns', 'approximate'])
+
+
+def use_streaming(file_name, size, streaming_bytes=STREAMING_BYTES):
+    """全体を読み込まずにストリーミングで処理するかどうか（大きな CSV のみ）"""
+    return streaming_summary.use_streaming(file_name, size, streaming_bytes)
+
+
+def strip_strings(df):
+    """文字列の列（object / string 型）だけ、値の前後の空白を列単位で取り除く"""
+    text_cols = df.select_dtypes(include=['object', 'string']).columns
+    if len(text_cols) == 0:
+        return df
+    df = df.copy()
+    for col in text_cols:
+        values = df[col]
+        stripped = values.str.strip()
+        # 文字列以外の値（数値の混在など）は .str で NaN になるため元の値を残す
+        df[col] = stripped.where(stripped.notna(), values)
+    return df
+
+
+def numeric_columns(df):
+    return df.select_dtypes(include=np.number).columns.tolist()
+
+
+def iqr_bounds(q1, q3, factor=IQR_FACTOR):
+    """第 1・第 3 四分位数から外れ値の下限・上限を求める"""
+    iqr = q3 - q1
+    return pd.DataFrame({'lower': q1 - factor * iqr, 'upper': q3 + factor * iqr})
+
+
+def compute_thresholds(df):
+    """メモリ上の DataFrame から閾値を求める"""
+    num_cols = numeric_columns(df)
+    bounds = iqr_bounds(df[num_cols].quantile(0.25), df[num_cols].quantile(0.75))
+    return Thresholds(
+        bounds=bounds, empty_columns=df.columns[df.isna().all()].tolist(), approximate=False
+    )
+
+
+def outlier_rows(df, bounds):
+    """いずれかの数値列が下限未満または上限超えの行（欠損値は外れ値とみなさない）"""
+    cols = [col for col in bounds.index if col in df.columns]
+    if not cols:
+        return np.zeros(len(df), dtype=bool)
+    values = df[cols].to_numpy(dtype=float)
+    lower = bounds.loc[cols, 'lower'].to_numpy()
+    upper = bounds.loc[cols, 'upper'].to_numpy()
+    return ((values < lower) | (values > upper)).any(axis=1)
+
+
+def apply_rules(df, thresholds, options):
+    """
+    閾値を使って 1 つのチャンク（または DataFrame 全体）にクレンジングの規則を当てはめる
+
+    処理の順序は 外れ値の削除 → 欠損値の削除と空白除去 → 値が入っていない列の削除。
+    """
+    if options.remove_outliers:
+        df = df[~outlier_rows(df, thresholds.bounds)]
+    if options.drop_missing:
+        df = strip_strings(df.dropna())
+    if options.drop_empty_columns:
+        df = df.drop(columns=[col for col in thresholds.empty_columns if col in df.columns])
+    return df
+
+
+def clean_frame(df, options):
+    """
+    メモリ上の DataFrame をクレンジングする
+
+    Returns
+    -------
+    (DataFrame, Thresholds)
+        処理後のデータと、使用した閾値
+    """
+    thresholds = compute_thresholds(df)
+    return apply_rules(df, thresholds, options), thresholds
+
+
+def scan_thresholds(chunks, sketch_k=SKETCH_K):
+    """
+    1 回目の読み込み：チャンクのイテレータから全体の閾値を求める
+
+    数値列ごとに分位数スケッチを更新し、第 1・第 3 四分位数を近似する
+    （行の値そのものは保持しない）。すべてのチャンクで数値型だった列を数値列とみなす。
+    """
+    sketches = {}
+    non_numeric = set()
+    has_value = {}
+    for chunk in chunks:
+        for col in chunk.columns:
+            has_value[col] = has_value.get(col, False) or bool(chunk[col].notna().any())
+        num_cols = numeric_columns(chunk)
+        non_numeric.update(set(chunk.columns) - set(num_cols))
+        for col in num_cols:
+            if col not in sketches:
+                sketches[col] = streaming_summary.QuantileSketch(k=sketch_k)
+            sketches[col].update(chunk[col].to_numpy(dtype=float))
+
+    num_cols = [col for col in sketches if col not in non_numeric]
+    quartiles = pd.DataFrame(
+        [sketches[col].quantile([0.25, 0.75]) for col in num_cols],
+        index=pd.Index(num_cols, dtype=object),
+        columns=['q1', 'q3'],
+        dtype=float
+    )
+    bounds = iqr_bounds(quartiles['q1'], quartiles['q3'])
+    empty_columns = [col for col, present in has_value.items() if not present]
+    return Thresholds(bounds=bounds, empty_columns=empty_columns, approximate=True)
+
+
+def clean_chunks(chunks, thresholds, options):
+    """2 回目の読み込み：チャンクごとにクレンジングした結果を順に返す"""
+    for chunk in chunks:
+        yield apply_rules(chunk, thresholds, options)
+
+
+def write_csv(chunks, output):
+    """
+    チャンクを CSV に逐次書き出す（ヘッダーは最初のチャンクのみ）
+
+    Returns
+    -------
+    int
+        書き出した行数
+    """
+    n_rows = 0
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(output, index=False, header=header)
+        header = False
+        n_rows += len(chunk)
+    return n_rows
+
+
+def clean_csv(read_chunks, output, options, sketch_k=SKETCH_K):
+    """
+    CSV を 2 回読み込んでストリーミングでクレンジングする
+
+    1 回目で列ごとの分位数スケッチから外れ値の上下限を求め、
+    2 回目で上下限の外側の値を含む行などを除きながら output に書き出す。
+
+    Parameters
+    ----------
+    read_chunks : callable
+        呼ぶたびに先頭から DataFrame のチャンクのイテレータを返す関数
+        （例: lambda: pd.read_csv(path, chunksize=CHUNKSIZE)）
+    output : str or file-like
+        書き出し先
+    options : CleansingOptions
+    sketch_k : int
+        分位数スケッチの精度パラメータ
+
+    Returns
+    -------
+    (int, Thresholds)
+        書き出した行数と、使用した閾値
+    """
+    thresholds = scan_thresholds(read_chunks(), sketch_k)
+    n_rows = write_csv(clean_chunks(read_chunks(), thresholds, options), output)
+    return n_rows, thresholds
+
+
+def output_path(file_name, output_dir=None):
+    """ストリーミング処理の結果の保存先のパス（gzip 圧縮した CSV）"""
+    return Path(output_dir or OUTPUT_DIR) / f'{file_name}.csv.gz'
+
+
+def clean_csv_to_file(read_chunks, file_name, options, output_dir=None, sketch_k=SKETCH_K):
+    """
+    CSV をストリーミングでクレンジングし、結果を gzip 圧縮した CSV として保存する
+
+    結果はメモリ上には作らず、圧縮しながら逐次書き出す。
+    書き終えるまでは一時ファイルに書き、完成してから output_path の名前に置き換える。
+
+    Parameters
+    ----------
+    read_chunks : callable
+        clean_csv と同じ
+    file_name : str
+        保存するファイルの名前（拡張子を除く）
+    options : CleansingOptions
+    output_dir : str or Path, optional
+        保存先のディレクトリ（省略時は OUTPUT_DIR）
+    sketch_k : int
+        分位数スケッチの精度パラメータ
+
+    Returns
+    -------
+    (Path, int, Thresholds)
+        保存したファイルのパス、書き出した行数、使用した閾値
+    """
+    path = output_path(file_name, output_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as sink:
+            with gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=GZIP_LEVEL) as compressed:
+                with io.TextIOWrapper(compressed, encoding='utf-8', newline='') as output:
+                    n_rows, thresholds = clean_csv(read_chunks, output, options, sketch_k)
+        os.replace(tmp_name, path)
+    except Exception:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return path, n_rows, thresholds
@@ -0,0 +1,124 @@
+"""
+解析済み Excel ブックの列指向ディスクキャッシュ
+
+pd.read_excel の結果を Arrow IPC（Feather v2）形式でファイル内容の
+ハッシュ名のファイルに一度だけ書き出し、以降はメモリマップで読み込む。
+pandas の dtype 情報は Arrow のスキーマメタデータとして保存されるため、
+読み戻した DataFrame の列型は元と同じになる。
+ワーカープロセスの再起動後や別プロセスで同じファイルを開いた場合も
+Excel の再解析が不要になる。
+
+pyarrow がインストールされていない環境では何もしない。
+"""
+import os
+import tempfile
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+    pa_ipc = None
+
+
+# キャッシュディレクトリ（環境変数で変更可能）
+CACHE_DIR = Path(os.environ.get(
+    'EASYSTAT_COLUMNAR_CACHE_DIR',
+    Path(tempfile.gettempdir()) / 'easy_stat_columnar_cache',
+))
+# ディスク上に保持するキャッシュの合計サイズの上限（バイト）
+DISK_BUDGET_BYTES = 2 * 1024 * 1024 * 1024
+
+SUFFIX = '.arrow'
+
+
+def is_available():
+    """列指向キャッシュが利用可能かどうか"""
+    return pa is not None
+
+
+def cache_path(digest, cache_dir=None):
+    """ファイル内容のハッシュに対応するキャッシュファイルのパス"""
+    return Path(cache_dir or CACHE_DIR) / f'{digest}{SUFFIX}'
+
+
+def read_cached(digest, cache_dir=None):
+    """
+    キャッシュ済みの DataFrame をメモリマップで読み込む
+
+    キャッシュが存在しない、または壊れている場合は None を返す。
+    """
+    if not is_available():
+        return None
+    path = cache_path(digest, cache_dir)
+    if not path.exists():
+        return None
+    try:
+        with pa.memory_map(str(path), 'r') as source:
+            table = pa_ipc.open_file(source).read_all()
+        df = table.to_pandas()
+    except (OSError, pa.ArrowException):
+        # 書き込み途中で中断されたファイルなどは破棄して作り直す
+        path.unlink(missing_ok=True)
+        return None
+    # 参照されたものを新しい扱いにする（容量超過時の削除順に使う）
+    try:
+        os.utime(path)
+    except OSError:
+        # 読み込んだ後に他のセッションやプロセスの prune で削除された場合も、データはそのまま返す
+        pass
+    return df
+
+
+def write_cached(digest, df, cache_dir=None):
+    """
+    DataFrame を Arrow IPC 形式で書き出す
+
+    Arrow に変換できない列（型が混在した object 列など）を含む場合や、
+    列名が文字列でない（読み戻すと文字列に変わってしまう）場合は
+    書き出さずに False を返す。
+    """
+    if not is_available():
+        return False
+    if not all(isinstance(col, str) for col in df.columns):
+        return False
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowException, TypeError, ValueError):
+        return False
+
+    path = cache_path(digest, cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 他のプロセスが読みかけのファイルを見ないよう、一時ファイルに書いてから置き換える
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as sink:
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_name, path)
+    except (OSError, pa.ArrowException):
+        Path(tmp_name).unlink(missing_ok=True)
+        return False
+
+    prune(cache_dir)
+    return True
+
+
+def prune(cache_dir=None, budget=DISK_BUDGET_BYTES):
+    """合計サイズが上限を超えた場合、最も古く参照されたファイルから削除する"""
+    directory = Path(cache_dir or CACHE_DIR)
+    entries = []
+    for path in directory.glob(f'*{SUFFIX}'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
@@ -0,0 +1,519 @@
+"""
+分割表（クロス表）の疎行列エンジン
+
+2 つのカテゴリ変数を整数コードに変換（factorize）し、観測度数を
+疎行列（COO → CSR）で集計する。学校コード × 回答コードのように
+水準が数千ある変数でも、メモリと計算量は 観測された組み合わせの数 に比例する。
+
+カイ二乗統計量は Σ O² / E − N（0 のセルは O² / E = 0）で求め、
+期待度数の行列は作らない。期待度数が 5 未満のセルの数や、
+観測度数 0 のセルのうち残差が有意になるものの数は、
+行・列の合計を並べ替えて二分探索で数える。
+
+全てのカテゴリ変数の組み合わせを一括で検定する場合（pairwise_chi_square）は、
+各列を一度だけ整数コードに変換し、そのコードを使い回して全ての組み合わせの分割表を作る。
+組み合わせはプロセスプールに分けて並列に検定する。
+
+期待度数が小さい表では、周辺度数を固定した表の再標本化（モンテカルロ法）で p 値を求められる
+（exact_test）。セル数が総度数以下の表は Patefield 法で表を直接生成し、
+疎な表は片方の変数のコードを並べ替えて生成する（どちらも同じ超幾何分布に従う）。
+再標本化はまとめて行い、p 値の信頼区間が有意水準をまたがなくなった時点で打ち切る。
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+import anova_engine
+
+
+# 期待度数の下限の目安（Cochran の基準）
+MIN_EXPECTED = 5
+# 期待度数が MIN_EXPECTED 未満のセルの割合の上限
+LOW_EXPECTED_RATIO = 0.2
+# クロス表・ヒートマップを密な表として表示するセル数の上限
+MAX_DISPLAY_CELLS = 2500
+# 一括検定をプロセスプールで行う最小の作業量（行数 × 組み合わせの数）
+PARALLEL_MIN_WORK = 2000000
+# モンテカルロ法の再標本化の回数の上限と、1 回にまとめて生成する表の数の上限
+MC_MAX_RESAMPLES = 100000
+MC_BATCH = 1000
+# 1 回にまとめて生成する表の要素数（セル数または総度数 × 表の数）の上限
+MC_MAX_BATCH_ELEMENTS = 10000000
+# 打ち切りの判定に使う p 値の信頼区間の信頼係数
+# （繰り返し判定するため、通常の 95% より厳しくする）
+MC_CONFIDENCE = 0.999
+
+# counts : 観測度数の疎行列（行の水準 × 列の水準）
+# row_labels, col_labels : 水準の並び（pd.crosstab と同じく並べ替え済み）
+# row_totals, col_totals : 行・列の合計
+ContingencyTable = namedtuple(
+    'ContingencyTable', ['counts', 'row_labels', 'col_labels', 'row_totals', 'col_totals', 'n']
+)
+ChiSquareResult = namedtuple(
+    'ChiSquareResult',
+    ['chi2', 'p', 'dof', 'cramers_v', 'n_cells', 'n_low_expected', 'min_expected']
+)
+# method : 'fisher_exact'（2 × 2 の表）または 'monte_carlo'
+# ci_lower, ci_upper : p 値の信頼区間（Fisher の正確確率検定では p と同じ）
+ExactTestResult = namedtuple(
+    'ExactTestResult', ['p', 'ci_lower', 'ci_upper', 'n_resamples', 'stopped_early', 'method']
+)
+SIGNIFICANT_COLUMNS = ['observed', 'expected', 'adj_residual']
+PAIRWISE_COLUMNS = ['var1', 'var2', 'n', 'dof', 'chi2', 'p', 'p_adj', 'cramers_v', 'n_low_expected']
+
+
+def factorize_column(values):
+    """カテゴリ変数を並べ替えた水準の整数コードに変換する（欠損値は -1）"""
+    codes, labels = pd.factorize(pd.Series(np.asarray(values, dtype=object)), sort=True)
+    return codes, list(labels)
+
+
+def table_from_codes(row_codes, row_labels, col_codes, col_labels):
+    """
+    整数コードから分割表を作る
+
+    どちらかが欠損値（-1）の行は除き、その結果度数が 0 になった水準も除く
+    （pd.crosstab と同じ）。
+    """
+    valid = (row_codes >= 0) & (col_codes >= 0)
+    rows = row_codes[valid]
+    cols = col_codes[valid]
+
+    # 同じ組み合わせの 1 は CSR への変換で足し合わされる
+    counts = sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, cols)),
+        shape=(len(row_labels), len(col_labels))
+    ).tocsr()
+    counts.sum_duplicates()
+
+    row_totals = np.asarray(counts.sum(axis=1)).ravel()
+    col_totals = np.asarray(counts.sum(axis=0)).ravel()
+    keep_rows = np.flatnonzero(row_totals)
+    keep_cols = np.flatnonzero(col_totals)
+    if len(keep_rows) < len(row_totals) or len(keep_cols) < len(col_totals):
+        counts = counts[keep_rows][:, keep_cols]
+    return ContingencyTable(
+        counts=counts,
+        row_labels=[row_labels[i] for i in keep_rows],
+        col_labels=[col_labels[j] for j in keep_cols],
+        row_totals=row_totals[keep_rows],
+        col_totals=col_totals[keep_cols],
+        n=int(row_totals.sum()),
+    )
+
+
+def contingency_table(x, y):
+    """
+    2 つのカテゴリ変数から分割表を作る
+
+    どちらかが欠損値の行は除く（pd.crosstab と同じ）。
+    """
+    return table_from_codes(*factorize_column(x), *factorize_column(y))
+
+
+def to_frame(table, row_name=None, col_name=None):
+    """観測度数を DataFrame（密）にする（表示用。水準が少ない場合のみ使う）"""
+    return pd.DataFrame(
+        table.counts.toarray(),
+        index=pd.Index(table.row_labels, name=row_name),
+        columns=pd.Index(table.col_labels, name=col_name),
+    )
+
+
+def expected_counts(table):
+    """期待度数（密な配列。表示用）"""
+    return np.outer(table.row_totals, table.col_totals) / table.n
+
+
+def _count_products_below(row_values, col_values, bound):
+    """row_values[i] * col_values[j] < bound を満たす (i, j) の組の数"""
+    col_sorted = np.sort(col_values)
+    with np.errstate(divide='ignore'):
+        limits = bound / row_values
+    return int(np.searchsorted(col_sorted, limits, side='left').sum())
+
+
+def _observed_cells(table):
+    """観測度数が 0 でないセルの行番号・列番号・度数"""
+    counts = table.counts
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    return rows, counts.indices, counts.data.astype(float)
+
+
+def _residual_scale(table):
+    """調整済み残差の分母に使う 1 − 行の割合、1 − 列の割合"""
+    return 1 - table.row_totals / table.n, 1 - table.col_totals / table.n
+
+
+def observed_residuals(table):
+    """
+    観測度数が 0 でないセルの調整済み標準化残差
+
+    (O − E) / √(E (1 − 行合計/N)(1 − 列合計/N))
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        counts と同じ位置に残差を持つ疎行列
+    """
+    rows, cols, observed = _observed_cells(table)
+    expected = table.row_totals[rows] * table.col_totals[cols] / table.n
+    row_scale, col_scale = _residual_scale(table)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residuals = (observed - expected) / np.sqrt(expected * row_scale[rows] * col_scale[cols])
+    return sparse.csr_matrix(
+        (residuals, table.counts.indices, table.counts.indptr), shape=table.counts.shape
+    )
+
+
+def adjusted_residuals(table):
+    """調整済み標準化残差（密な配列。表示用）"""
+    expected = expected_counts(table)
+    row_scale, col_scale = _residual_scale(table)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (table.counts.toarray() - expected) / np.sqrt(
+            expected * np.outer(row_scale, col_scale)
+        )
+
+
+def chi_square_test(table, correction=True):
+    """
+    カイ二乗検定（独立性の検定）
+
+    scipy.stats.chi2_contingency と同じく、自由度 1 のときは correction=True で
+    Yates の連続性補正を行う。Cramér の V は補正なしの統計量から求める。
+
+    Returns
+    -------
+    ChiSquareResult
+        n_low_expected は期待度数が MIN_EXPECTED 未満のセルの数、
+        min_expected は期待度数の最小値
+    """
+    n_rows, n_cols = table.counts.shape
+    if table.n == 0:
+        raise ValueError('分割表の度数がすべて 0 です。')
+    dof = (n_rows - 1) * (n_cols - 1)
+    n = table.n
+
+    rows, cols, observed = _observed_cells(table)
+    expected = table.row_totals[rows] * table.col_totals[cols] / n
+    # Σ (O − E)² / E = Σ O² / E − N（O = 0 のセルは和に寄与しない）
+    chi2 = max(float(np.sum(observed ** 2 / expected)) - n, 0.0)
+
+    if dof == 0:
+        statistic, p = 0.0, 1.0
+    elif dof == 1 and correction:
+        # 2 × 2 の表のみなので密に計算する
+        observed_dense = table.counts.toarray().astype(float)
+        expected_dense = expected_counts(table)
+        diff = expected_dense - observed_dense
+        adjusted = observed_dense + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+        statistic = float(np.sum((adjusted - expected_dense) ** 2 / expected_dense))
+        p = float(stats.chi2.sf(statistic, dof))
+    else:
+        statistic = chi2
+        p = float(stats.chi2.sf(statistic, dof))
+
+    k = min(n_rows, n_cols)
+    cramers_v = np.sqrt(chi2 / (n * (k - 1))) if k > 1 else np.nan
+
+    return ChiSquareResult(
+        chi2=statistic,
+        p=p,
+        dof=dof,
+        cramers_v=float(cramers_v),
+        n_cells=n_rows * n_cols,
+        n_low_expected=_count_products_below(
+            table.row_totals.astype(float), table.col_totals.astype(float), MIN_EXPECTED * n
+        ),
+        min_expected=float(table.row_totals.min() * table.col_totals.min() / n),
+    )
+
+
+def _pearson_statistic(counts, row_totals, col_totals, n):
+    """観測度数が 0 でないセルの度数から、補正なしのカイ二乗統計量 N Σ O² / (行合計 × 列合計) − N を求める"""
+    return n * np.sum(counts ** 2 / (row_totals * col_totals)) - n
+
+
+def _statistic_sampler(table):
+    """
+    周辺度数を固定した表を生成し、カイ二乗統計量を返す関数と 1 回の生成数を返す
+
+    セル数が総度数以下なら Patefield 法（scipy.stats.random_table）で密な表を生成する。
+    セル数が総度数より多い疎な表では、行のコードを固定して列のコードを並べ替え、
+    (表の番号, セル) ごとの度数を np.unique で数える（密な表は作らない）。
+    """
+    n_rows, n_cols = table.counts.shape
+    n_cells = n_rows * n_cols
+    n = table.n
+
+    if n_cells <= n:
+        distribution = stats.random_table(table.row_totals, table.col_totals)
+        expected = expected_counts(table)
+
+        def sample(size, rng):
+            tables = distribution.rvs(size, method='patefield', random_state=rng)
+            return np.sum(tables ** 2 / expected, axis=(1, 2)) - n
+
+        return sample, max(1, min(MC_BATCH, MC_MAX_BATCH_ELEMENTS // n_cells))
+
+    rows, cols, observed = _observed_cells(table)
+    repeats = observed.astype(np.int64)
+    row_codes = np.repeat(rows, repeats).astype(np.int64)
+    col_codes = np.repeat(cols, repeats).astype(np.int64)
+    row_totals = table.row_totals.astype(float)
+    col_totals = table.col_totals.astype(float)
+
+    def sample(size, rng):
+        shuffled = rng.permuted(np.broadcast_to(col_codes, (size, n)), axis=1)
+        keys = np.arange(size)[:, None] * n_cells + row_codes * n_cols + shuffled
+        keys, counts = np.unique(keys.ravel(), return_counts=True)
+        sample_ids, cells = np.divmod(keys, n_cells)
+        cell_rows, cell_cols = np.divmod(cells, n_cols)
+        weights = counts.astype(float) ** 2 / (row_totals[cell_rows] * col_totals[cell_cols])
+        return n * np.bincount(sample_ids, weights=weights, minlength=size) - n
+
+    return sample, max(1, min(MC_BATCH, MC_MAX_BATCH_ELEMENTS // n))
+
+
+def _proportion_interval(successes, trials, confidence):
+    """二項分布の割合の Clopper-Pearson 信頼区間"""
+    tail = (1 - confidence) / 2
+    lower = stats.beta.ppf(tail, successes, trials - successes + 1) if successes > 0 else 0.0
+    upper = stats.beta.ppf(1 - tail, successes + 1, trials - successes) if successes < trials else 1.0
+    return float(lower), float(upper)
+
+
+def exact_test(table, alpha=0.05, max_resamples=MC_MAX_RESAMPLES, confidence=MC_CONFIDENCE, seed=None):
+    """
+    期待度数が小さい表向けの正確検定・モンテカルロ検定
+
+    2 × 2 の表は Fisher の正確確率検定を行う。それ以外は周辺度数を固定した表を
+    まとめて生成し、補正なしのカイ二乗統計量が観測値以上になる割合から p 値を
+    (超えた回数 + 1) / (生成した回数 + 1) で推定する。
+    まとめて生成するたびに p 値の Clopper-Pearson 信頼区間（信頼係数 confidence）を求め、
+    区間全体が alpha より小さく（または大きく）なった時点で打ち切る。
+
+    Parameters
+    ----------
+    table : ContingencyTable
+    alpha : float
+        打ち切りの判定に使う有意水準
+    max_resamples : int
+        生成する表の数の上限
+    confidence : float
+        打ち切りの判定に使う信頼区間の信頼係数
+    seed : int, optional
+        乱数のシード
+
+    Returns
+    -------
+    ExactTestResult
+    """
+    n_rows, n_cols = table.counts.shape
+    if table.n == 0:
+        raise ValueError('分割表の度数がすべて 0 です。')
+    if n_rows < 2 or n_cols < 2:
+        return ExactTestResult(1.0, 1.0, 1.0, 0, False, 'monte_carlo')
+    if (n_rows, n_cols) == (2, 2):
+        p = float(stats.fisher_exact(table.counts.toarray()).pvalue)
+        return ExactTestResult(p, p, p, 0, False, 'fisher_exact')
+
+    rows, cols, observed = _observed_cells(table)
+    statistic = _pearson_statistic(
+        observed, table.row_totals[rows].astype(float), table.col_totals[cols].astype(float), table.n
+    )
+    # 浮動小数点の誤差で同じ値の表を取りこぼさないよう、わずかに小さい値と比べる
+    threshold = statistic - 1e-7 * max(1.0, abs(statistic))
+
+    rng = np.random.default_rng(seed)
+    sample, batch_size = _statistic_sampler(table)
+    n_resamples = 0
+    n_extreme = 0
+    stopped_early = False
+    while n_resamples < max_resamples:
+        size = min(batch_size, max_resamples - n_resamples)
+        n_extreme += int(np.sum(sample(size, rng) >= threshold))
+        n_resamples += size
+        lower, upper = _proportion_interval(n_extreme, n_resamples, confidence)
+        if upper < alpha or lower > alpha:
+            stopped_early = n_resamples < max_resamples
+            break
+
+    lower, upper = _proportion_interval(n_extreme, n_resamples, confidence)
+    return ExactTestResult(
+        p=(n_extreme + 1) / (n_resamples + 1),
+        ci_lower=lower,
+        ci_upper=upper,
+        n_resamples=n_resamples,
+        stopped_early=stopped_early,
+        method='monte_carlo',
+    )
+
+
+def expected_count_warning(result, min_expected=MIN_EXPECTED, ratio=LOW_EXPECTED_RATIO):
+    """
+    期待度数が小さいセルについての注意（問題がなければ None）
+
+    期待度数 1 未満のセルがある、または min_expected 未満のセルが ratio を超える場合に返す。
+    """
+    low_ratio = result.n_low_expected / result.n_cells
+    if result.min_expected < 1 or low_ratio > ratio:
+        return (
+            f'期待度数が{min_expected}未満のセルが {result.n_low_expected} 個（{low_ratio:.1%}）、'
+            f'期待度数の最小値は {result.min_expected:.2f} です。'
+            'カイ二乗近似の精度が低い可能性があります。'
+        )
+    return None
+
+
+def significant_cells(table, alpha=0.05, row_name='row', col_name='col'):
+    """
+    観測度数が 0 でないセルのうち、調整済み残差の絶対値が有意水準の z 値を超えるもの
+
+    Returns
+    -------
+    DataFrame
+        row_name, col_name と SIGNIFICANT_COLUMNS の列。残差の絶対値の大きい順
+    """
+    threshold = stats.norm.ppf(1 - alpha / 2)
+    rows, cols, observed = _observed_cells(table)
+    residuals = observed_residuals(table).data
+    with np.errstate(invalid='ignore'):
+        keep = np.abs(residuals) > threshold
+    order = np.argsort(-np.abs(residuals[keep]), kind='stable')
+    rows, cols = rows[keep][order], cols[keep][order]
+    row_labels = np.asarray(table.row_labels, dtype=object)
+    col_labels = np.asarray(table.col_labels, dtype=object)
+    return pd.DataFrame({
+        row_name: row_labels[rows],
+        col_name: col_labels[cols],
+        'observed': observed[keep][order].astype(np.int64),
+        'expected': table.row_totals[rows] * table.col_totals[cols] / table.n,
+        'adj_residual': residuals[keep][order],
+    })
+
+
+def count_significant_empty_cells(table, alpha=0.05):
+    """
+    観測度数が 0 のセルのうち、調整済み残差（負）が有意になるものの数
+
+    O = 0 のセルの残差の絶対値は √(g(行合計) g(列合計) / N)、g(t) = t / (1 − t/N) なので、
+    g(行合計) g(列合計) > z² N となる組の数から、観測度数が 0 でない組を除いて数える。
+    """
+    threshold = stats.norm.ppf(1 - alpha / 2)
+    n = table.n
+    row_scale, col_scale = _residual_scale(table)
+    with np.errstate(divide='ignore'):
+        g_row = table.row_totals / row_scale
+        g_col = table.col_totals / col_scale
+    bound = threshold ** 2 * n
+    n_pairs = table.counts.shape[0] * table.counts.shape[1]
+    above = n_pairs - _count_products_below(g_row, g_col, bound)
+    rows, cols, _ = _observed_cells(table)
+    observed_above = int(np.sum(g_row[rows] * g_col[cols] >= bound))
+    return above - observed_above
+
+
+# プロセスプールの各ワーカーが保持する全ての列の整数コード
+_worker_codes = None
+
+
+def _init_worker(codes):
+    global _worker_codes
+    _worker_codes = codes
+
+
+def _test_pairs(pairs, codes=None):
+    """列番号の組ごとにカイ二乗検定を行い、(n, dof, chi2, p, cramers_v, n_low_expected) を返す"""
+    if codes is None:
+        codes = _worker_codes
+    results = []
+    for i, j in pairs:
+        (row_codes, n_row_levels), (col_codes, n_col_levels) = codes[i], codes[j]
+        table = table_from_codes(
+            row_codes, range(n_row_levels), col_codes, range(n_col_levels)
+        )
+        if table.n == 0:
+            results.append((0, 0, np.nan, np.nan, np.nan, 0))
+            continue
+        result = chi_square_test(table)
+        results.append(
+            (table.n, result.dof, result.chi2, result.p, result.cramers_v, result.n_low_expected)
+        )
+    return results
+
+
+def pairwise_chi_square(df, columns, p_adjust='fdr_bh', max_workers=None,
+                        parallel_min_work=PARALLEL_MIN_WORK):
+    """
+    カテゴリ変数の全ての組み合わせについてカイ二乗検定を行う
+
+    各列は一度だけ整数コードに変換し、全ての組み合わせで使い回す。
+    作業量（行数 × 組み合わせの数）が parallel_min_work 以上のときは、
+    コードをワーカーに一度だけ渡したプロセスプールで組み合わせを分担して検定する。
+
+    Parameters
+    ----------
+    df : DataFrame
+    columns : list of str
+        カテゴリ変数の列名
+    p_adjust : {'fdr_bh', 'holm', 'bonferroni'} or None
+        p 値の補正方法（anova_engine.adjust_pvalues）。None なら補正しない（p_adj は p と同じ）
+    max_workers : int, optional
+        プロセス数（省略時は CPU 数）。1 ならプロセスプールを使わない
+
+    Returns
+    -------
+    DataFrame
+        PAIRWISE_COLUMNS の列を持ち、p 値の小さい順（同じなら Cramér の V の大きい順）に並べた表
+    """
+    columns = list(columns)
+    codes = []
+    for col in columns:
+        col_codes, labels = factorize_column(df[col])
+        codes.append((col_codes, len(labels)))
+    pairs = [(i, j) for i in range(len(columns)) for j in range(i + 1, len(columns))]
+    if not pairs:
+        return pd.DataFrame(columns=PAIRWISE_COLUMNS)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(pairs))
+    if max_workers > 1 and len(df) * len(pairs) >= parallel_min_work:
+        # ワーカーごとに数回に分けて渡し、処理時間のばらつきをならす
+        n_batches = max_workers * 4
+        batches = [pairs[start::n_batches] for start in range(n_batches)]
+        batches = [batch for batch in batches if batch]
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(codes,)) as pool:
+            batch_results = list(pool.map(_test_pairs, batches))
+        results = [None] * len(pairs)
+        for start, batch_result in enumerate(batch_results):
+            results[start::n_batches] = batch_result
+    else:
+        results = _test_pairs(pairs, codes)
+
+    n, dof, chi2, p, cramers_v, n_low_expected = (np.array(values) for values in zip(*results))
+    if p_adjust is None:
+        p_adj = p
+    else:
+        p_adj = np.full(len(p), np.nan)
+        tested = ~np.isnan(p)
+        p_adj[tested] = anova_engine.adjust_pvalues(p[tested], p_adjust)
+
+    table = pd.DataFrame({
+        'var1': [columns[i] for i, _ in pairs],
+        'var2': [columns[j] for _, j in pairs],
+        'n': n.astype(np.int64),
+        'dof': dof.astype(np.int64),
+        'chi2': chi2,
+        'p': p,
+        'p_adj': p_adj,
+        'cramers_v': cramers_v,
+        'n_low_expected': n_low_expected.astype(np.int64),
+    })
+    return table.sort_values(['p', 'cramers_v'], ascending=[True, False], kind='stable').reset_index(drop=True)
@@ -0,0 +1,194 @@
+"""
+文書 × 単語行列と共起ネットワーク
+
+単語を整数 ID に変換して文書 × 単語の疎行列（出現回数）を 1 つだけ作り、
+単語の度数は列の和、共起（同じ文書に両方が現れる文書数）は
+出現の有無を表す行列 X の XᵀX の上三角で求める。
+ストップワードは行列を作り直さずに列の選択で除く。
+辺の重みは共起文書数、Jaccard 係数、Dice 係数から選べ、
+上位 N 本の辺は全体を並べ替えずに np.argpartition で選ぶ。
+結果は単語をノードとする networkx のグラフとして返す。
+
+文書ごとに単語の組み合わせを列挙する方法と違い、計算量とメモリは
+文書数 × 組み合わせ数 ではなく 行列の非ゼロ要素の数 に比例する。
+
+カテゴリ別の集計は全体の行列の行を切り出すだけで済む（partition）。
+度数も共起数も行ごとの和なので、カテゴリ別の結果を足し合わせると全体の結果になる。
+"""
+from collections import namedtuple
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# matrix : 文書 × 単語の疎行列（CSR、出現回数）
+# terms : 列に対応する単語（初めて現れた順）
+DocumentTermMatrix = namedtuple('DocumentTermMatrix', ['matrix', 'terms'])
+EDGE_COLUMNS = ['source', 'target', 'count', 'weight']
+MEASURES = ('jaccard', 'dice', 'count')
+
+
+def document_term_matrix(token_lists):
+    """単語のリストの並びから、文書 × 単語の疎行列（出現回数）を作る"""
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    for tokens in token_lists:
+        indices.extend(vocabulary.setdefault(word, len(vocabulary)) for word in tokens)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int64), np.asarray(indices, dtype=np.int64),
+         np.asarray(indptr, dtype=np.int64)),
+        shape=(len(indptr) - 1, len(vocabulary))
+    )
+    matrix.sum_duplicates()
+    return DocumentTermMatrix(matrix=matrix, terms=list(vocabulary))
+
+
+def subset(dtm, rows):
+    """行（文書）を切り出す。列（単語）は全体と共通のまま"""
+    return DocumentTermMatrix(matrix=dtm.matrix[rows], terms=dtm.terms)
+
+
+def partition(dtm, labels):
+    """
+    カテゴリごとに行を切り出す
+
+    Parameters
+    ----------
+    dtm : DocumentTermMatrix
+    labels : array-like
+        文書ごとのカテゴリ（欠損値の文書はどのカテゴリにも含めない）
+
+    Yields
+    ------
+    (label, DocumentTermMatrix)
+        DataFrame.groupby と同じくカテゴリの昇順
+    """
+    positions = pd.Series(np.arange(len(labels)))
+    for label, rows in positions.groupby(np.asarray(labels)):
+        yield label, subset(dtm, rows.to_numpy())
+
+
+def term_frequencies(dtm):
+    """単語ごとの出現回数"""
+    return np.asarray(dtm.matrix.sum(axis=0)).ravel()
+
+
+def word_frequencies(dtm, stopwords=(), min_length=1):
+    """
+    出現した単語と出現回数の辞書（ストップワードと min_length 文字未満の語を除く）
+    """
+    stopwords = set(stopwords)
+    return {
+        word: int(freq)
+        for word, freq in zip(dtm.terms, term_frequencies(dtm))
+        if freq > 0 and len(word) >= min_length and word not in stopwords
+    }
+
+
+def frequent_words(dtm, top_n=10, min_freq=0):
+    """
+    出現回数の多い上位 top_n 語と、出現回数が min_freq 以下の語（ストップワードの候補）
+
+    nlplot の NLPlot.get_stopword と同じ規則（同じ回数なら先に現れた語を優先）。
+    """
+    freq = term_frequencies(dtm)
+    present = np.flatnonzero(freq > 0)
+    order = present[np.argsort(-freq[present], kind='stable')]
+    common = {dtm.terms[i] for i in order[:top_n]}
+    rare = {dtm.terms[i] for i in present[freq[present] <= min_freq]}
+    return sorted(common | rare)
+
+
+def presence_matrix(dtm, stopwords=()):
+    """
+    出現の有無（0/1）の行列と、その列に対応する単語の番号（ストップワードの列は除く）
+    """
+    stopwords = set(stopwords)
+    columns = np.array([i for i, word in enumerate(dtm.terms) if word not in stopwords], dtype=np.int64)
+    matrix = dtm.matrix[:, columns]
+    matrix.data = np.ones_like(matrix.data)
+    return matrix, columns
+
+
+def cooccurrence_edges(dtm, stopwords=(), measure='jaccard', min_edge_frequency=1, top_n=None):
+    """
+    単語の組ごとの共起文書数と辺の重み
+
+    Parameters
+    ----------
+    dtm : DocumentTermMatrix
+    stopwords : iterable of str
+        除く単語
+    measure : {'jaccard', 'dice', 'count'}
+        jaccard : 共起数 / (出現数 a + 出現数 b − 共起数)
+        dice : 2 × 共起数 / (出現数 a + 出現数 b)
+        count : 共起数
+    min_edge_frequency : int
+        この共起数未満の組は除く
+    top_n : int, optional
+        重みの大きい上位 top_n 本だけを返す
+
+    Returns
+    -------
+    DataFrame
+        EDGE_COLUMNS の列を持ち、重みの大きい順（同じなら共起数の多い順）に並べた表
+    """
+    if measure not in MEASURES:
+        raise ValueError(f'未対応の指標です: {measure}')
+    matrix, columns = presence_matrix(dtm, stopwords)
+    doc_freq = np.asarray(matrix.sum(axis=0)).ravel()
+    cooc = sparse.triu(matrix.T @ matrix, k=1).tocoo()
+    keep = cooc.data >= min_edge_frequency
+    rows = cooc.row[keep]
+    cols = cooc.col[keep]
+    counts = cooc.data[keep]
+
+    df_a = doc_freq[rows]
+    df_b = doc_freq[cols]
+    if measure == 'jaccard':
+        weights = counts / (df_a + df_b - counts)
+    elif measure == 'dice':
+        weights = 2 * counts / (df_a + df_b)
+    else:
+        weights = counts.astype(float)
+
+    if top_n is not None and top_n < len(weights):
+        selected = np.argpartition(-weights, top_n - 1)[:top_n]
+        rows, cols, counts, weights = rows[selected], cols[selected], counts[selected], weights[selected]
+    order = np.lexsort((-counts, -weights))
+
+    terms = np.asarray(dtm.terms, dtype=object)[columns]
+    return pd.DataFrame({
+        'source': terms[rows[order]],
+        'target': terms[cols[order]],
+        'count': counts[order].astype(np.int64),
+        'weight': weights[order].astype(float),
+    }, columns=EDGE_COLUMNS)
+
+
+def to_graph(edges, dtm=None):
+    """
+    辺の表から networkx のグラフを作る
+
+    ノードは単語そのもの。dtm を渡すとノードに出現回数（frequency）を付ける。
+    """
+    graph = nx.Graph()
+    graph.add_weighted_edges_from(edges[['source', 'target', 'weight']].itertuples(index=False))
+    nx.set_edge_attributes(
+        graph, {(u, v): int(c) for u, v, c in edges[['source', 'target', 'count']].itertuples(index=False)}, 'count'
+    )
+    if dtm is not None:
+        freq = dict(zip(dtm.terms, term_frequencies(dtm).tolist()))
+        nx.set_node_attributes(graph, {node: freq[node] for node in graph.nodes}, 'frequency')
+    return graph
+
+
+def build_graph(dtm, stopwords=(), measure='jaccard', min_edge_frequency=1, top_n_edges=None):
+    """文書 × 単語行列から共起ネットワーク（networkx.Graph）を作る"""
+    edges = cooccurrence_edges(dtm, stopwords, measure, min_edge_frequency, top_n_edges)
+    return to_graph(edges, dtm)
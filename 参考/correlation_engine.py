@@ -0,0 +1,195 @@
+"""
+相関行列の一括計算エンジン
+
+相関係数の計算に必要な積和（有効 N・合計・平方和・積和）を列ブロックごとに
+行列積でまとめて求め、行方向のチャンクごとに足し合わせる。
+DataFrame 全体ではなく pd.read_csv(chunksize=...) のようなチャンクの
+イテレータも受け取れるため、数千項目のアンケートでも
+メモリには (チャンク行数 × ブロック列数) の配列と 変数数 × 変数数 の集計行列だけを持てばよい。
+
+欠損値の扱いは pandas の DataFrame.corr と同じペアワイズ除外（既定）と、
+1 つでも欠損のある行を除くリストワイズ除外を選べる。
+相関係数の検定（t 分布）と Fisher の z 変換による信頼区間も配列演算で求める。
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+# 一度に行列積を取る列の数
+BLOCK_SIZE = 256
+
+CorrelationResult = namedtuple('CorrelationResult', ['r', 'p', 'n', 'ci_lower', 'ci_upper'])
+
+
+class _MomentAccumulator:
+    """
+    列の全ての組み合わせについて、ペアワイズの積和をチャンクごとに足し合わせる
+
+    n[a, b]  : a, b がともに欠損でない行数
+    s[a, b]  : b が欠損でない行での a の合計
+    q[a, b]  : b が欠損でない行での a の平方和
+    c[a, b]  : a と b の積和
+
+    桁落ちを防ぐため、値は最初のチャンクの列平均を引いてから集計する
+    （相関係数は定数のずらしに対して不変）。
+    """
+
+    def __init__(self, n_cols, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.shift = None
+        self.n = np.zeros((n_cols, n_cols))
+        self.s = np.zeros((n_cols, n_cols))
+        self.q = np.zeros((n_cols, n_cols))
+        self.c = np.zeros((n_cols, n_cols))
+
+    def update(self, values):
+        if self.shift is None:
+            with np.errstate(invalid='ignore'):
+                shift = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+            self.shift = np.nan_to_num(shift)
+        valid = ~np.isnan(values)
+        mask = valid.astype(float)
+        filled = np.where(valid, values - self.shift, 0.0)
+        squared = filled ** 2
+
+        n_cols = values.shape[1]
+        starts = range(0, n_cols, self.block_size)
+        for i in starts:
+            bi = slice(i, i + self.block_size)
+            for j in starts:
+                bj = slice(j, j + self.block_size)
+                self.s[bi, bj] += filled[:, bi].T @ mask[:, bj]
+                self.q[bi, bj] += squared[:, bi].T @ mask[:, bj]
+                if j >= i:
+                    self.n[bi, bj] += mask[:, bi].T @ mask[:, bj]
+                    self.c[bi, bj] += filled[:, bi].T @ filled[:, bj]
+
+    def correlation(self):
+        """集計済みの積和から相関係数行列と有効 N の行列を求める"""
+        n = np.triu(self.n) + np.triu(self.n, 1).T
+        c = np.triu(self.c) + np.triu(self.c, 1).T
+        s = self.s
+        q = self.q
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = n * c - s * s.T
+            var_a = n * q - s ** 2
+            var_b = var_a.T
+            r = cov / np.sqrt(var_a * var_b)
+        r = np.clip(r, -1.0, 1.0)
+        r[n < 2] = np.nan
+        np.fill_diagonal(r, np.where(np.diag(var_a) > 0, 1.0, np.nan))
+        return r, n
+
+
+def _iter_chunks(data):
+    """DataFrame はそのまま 1 チャンクとして、それ以外はチャンクのイテレータとして扱う"""
+    if isinstance(data, pd.DataFrame):
+        yield data
+    else:
+        yield from data
+
+
+def _rank_columns(values, block_size):
+    """列ごとに平均順位を付ける（欠損値は欠損のまま）"""
+    ranked = np.empty_like(values)
+    for i in range(0, values.shape[1], block_size):
+        block = slice(i, i + block_size)
+        ranked[:, block] = pd.DataFrame(values[:, block]).rank().to_numpy()
+    return ranked
+
+
+def correlation_significance(r, n, alpha=0.05):
+    """
+    相関係数の行列と有効 N の行列から、p 値と Fisher の z 変換による信頼区間を求める
+
+    p 値は t = r √(n-2) / √(1-r²)（自由度 n-2）の両側検定。
+
+    Returns
+    -------
+    (ndarray, ndarray, ndarray)
+        p 値、信頼区間の下限、上限
+    """
+    r = np.asarray(r, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df = n - 2
+        t = r * np.sqrt(df / (1 - r ** 2))
+        p = 2 * stats.t.sf(np.abs(t), df)
+        p = np.where(np.abs(r) >= 1, 0.0, p)
+
+        z = np.arctanh(np.clip(r, -1 + 1e-15, 1 - 1e-15))
+        half_width = stats.norm.ppf(1 - alpha / 2) / np.sqrt(n - 3)
+        lower = np.tanh(z - half_width)
+        upper = np.tanh(z + half_width)
+    exact = np.abs(r) >= 1
+    lower = np.where(exact, r, lower)
+    upper = np.where(exact, r, upper)
+    return p, lower, upper
+
+
+def correlation_matrix(data, columns=None, method='pearson', missing='pairwise',
+                       alpha=0.05, block_size=BLOCK_SIZE):
+    """
+    相関行列・p 値行列・信頼区間をまとめて求める
+
+    Parameters
+    ----------
+    data : DataFrame or iterable of DataFrame
+        データ、または行方向のチャンク（pd.read_csv(chunksize=...) など）のイテレータ
+    columns : list of str, optional
+        対象の列（省略時は最初のチャンクの数値列）
+    method : {'pearson', 'spearman'}
+        spearman は列全体の順位が必要なため DataFrame のみ受け付ける。
+        ペアワイズ除外で欠損がある場合、順位は列ごとに欠損でない値の中で付ける。
+    missing : {'pairwise', 'listwise'}
+        欠損値の扱い
+    alpha : float
+        信頼区間の有意水準
+    block_size : int
+        一度に行列積を取る列の数
+
+    Returns
+    -------
+    CorrelationResult
+        r, p, n, ci_lower, ci_upper はいずれも 変数 × 変数 の DataFrame
+    """
+    if method not in ('pearson', 'spearman'):
+        raise ValueError("method には 'pearson' または 'spearman' を指定してください。")
+    if missing not in ('pairwise', 'listwise'):
+        raise ValueError("missing には 'pairwise' または 'listwise' を指定してください。")
+    if method == 'spearman' and not isinstance(data, pd.DataFrame):
+        raise ValueError('順位相関（spearman）は DataFrame でのみ計算できます。')
+
+    accumulator = None
+    for chunk in _iter_chunks(data):
+        if columns is None:
+            columns = chunk.select_dtypes(include=[np.number]).columns.tolist()
+        columns = list(columns)
+        if accumulator is None:
+            accumulator = _MomentAccumulator(len(columns), block_size)
+        values = chunk[columns].to_numpy(dtype=float)
+        if missing == 'listwise':
+            values = values[~np.isnan(values).any(axis=1)]
+        if method == 'spearman':
+            values = _rank_columns(values, block_size)
+        accumulator.update(values)
+
+    if accumulator is None:
+        raise ValueError('データがありません。')
+
+    r, n = accumulator.correlation()
+    p, lower, upper = correlation_significance(r, n, alpha)
+
+    def frame(array):
+        return pd.DataFrame(array, index=columns, columns=columns)
+
+    return CorrelationResult(
+        r=frame(r),
+        p=frame(p),
+        n=frame(n.astype(np.int64)),
+        ci_lower=frame(lower),
+        ci_upper=frame(upper),
+    )
@@ -0,0 +1,171 @@
+"""
+アップロードファイル読み込みの共通モジュール
+
+各ページで重複していた CSV / Excel の読み込み処理をまとめ、
+アップロードされたバイト列のハッシュをキーにして解析済みの DataFrame を
+メモリ上限付きの LRU キャッシュに保持する。
+Streamlit の再実行（ウィジェット操作）やページ移動のたびに
+同じファイルを解析し直さないようにするためのもの。
+
+解析に時間のかかる Excel ブックは columnar_cache によって
+ディスク上にも保存され、プロセスをまたいで再利用される。
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import columnar_cache
+
+
+# キャッシュ全体で保持する DataFrame の上限（バイト）
+MEMORY_BUDGET_BYTES = 512 * 1024 * 1024
+
+CSV_TYPES = ('text/csv', 'application/csv')
+TEXT_TYPES = ('text/plain',)
+EXCEL_TYPES = (
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.ms-excel',
+)
+
+
+class UnsupportedFileTypeError(ValueError):
+    """読み込みに対応していないファイル形式"""
+
+
+class DataFrameCache:
+    """
+    メモリ使用量の上限付き LRU キャッシュ
+
+    キーはファイル内容のハッシュ、値は解析済みの DataFrame。
+    上限を超えた場合は最も古く参照されたものから破棄する。
+    """
+
+    def __init__(self, memory_budget=MEMORY_BUDGET_BYTES):
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            # 単体で上限を超えるものは保持しない
+            if size > self.memory_budget:
+                return
+            self._entries[key] = (df, size)
+            self._total_bytes += size
+            while self._total_bytes > self.memory_budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+# サーバープロセス内で全セッション・全ページが共有するキャッシュ
+_cache = DataFrameCache()
+
+
+def file_digest(data):
+    """ファイル内容（bytes）のハッシュ値を返す"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def detect_file_kind(file_type, file_name=''):
+    """MIME タイプ（不明な場合は拡張子）から 'csv' / 'text' / 'excel' を判定する"""
+    if file_type in CSV_TYPES:
+        return 'csv'
+    if file_type in TEXT_TYPES:
+        return 'text'
+    if file_type in EXCEL_TYPES:
+        return 'excel'
+    suffix = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    if suffix == 'csv':
+        return 'csv'
+    if suffix == 'txt':
+        return 'text'
+    if suffix in ('xlsx', 'xls'):
+        return 'excel'
+    raise UnsupportedFileTypeError('対応していないファイル形式です。')
+
+
+def parse_bytes(data, kind):
+    """ファイル内容を種類に応じて DataFrame に変換する"""
+    buffer = io.BytesIO(data)
+    if kind == 'csv':
+        return pd.read_csv(buffer)
+    if kind == 'text':
+        return pd.read_csv(buffer, sep=r'\s+')
+    if kind == 'excel':
+        return pd.read_excel(buffer)
+    raise UnsupportedFileTypeError('対応していないファイル形式です。')
+
+
+def load_bytes(data, kind):
+    """
+    バイト列を解析して DataFrame を返す（キャッシュ付き）
+
+    呼び出し側で列の追加などを行っても共有キャッシュが
+    書き換わらないよう、常にコピーを返す。
+    """
+    digest = file_digest(data)
+    key = f'{kind}:{digest}'
+    df = _cache.get(key)
+    if df is None:
+        df = _load_columnar_or_parse(data, kind, digest)
+        _cache.put(key, df)
+    return df.copy()
+
+
+def _load_columnar_or_parse(data, kind, digest):
+    """Excel はディスク上の列指向キャッシュを優先し、無ければ解析して書き出す"""
+    if kind != 'excel':
+        return parse_bytes(data, kind)
+    df = columnar_cache.read_cached(digest)
+    if df is None:
+        df = parse_bytes(data, kind)
+        columnar_cache.write_cached(digest, df)
+    return df
+
+
+def load_uploaded_file(uploaded_file):
+    """st.file_uploader で受け取ったファイルを DataFrame として読み込む"""
+    kind = detect_file_kind(uploaded_file.type, uploaded_file.name)
+    return load_bytes(uploaded_file.getvalue(), kind)
+
+
+def load_demo_data(path):
+    """デモデータ（ローカルファイル）を DataFrame として読み込む"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_bytes(data, detect_file_kind('', str(path)))
+
+
+def clear_cache():
+    """キャッシュを全て破棄する"""
+    _cache.clear()
@@ -0,0 +1,143 @@
+"""
+EDA のグラフ用の要約統計量
+
+px.histogram / px.box に列をそのまま渡すと、全ての値がページに埋め込まれる
+（列ごとに 2 回）。ここではビンの区切りと度数、箱ひげ図の五数要約と
+外れ値（件数に上限あり）を NumPy で先に計算し、集計済みの値だけを持つ
+go.Bar / go.Box を作る。ページの大きさは 行数 × 列数 ではなく
+ビン数 × 列数 に比例する。
+"""
+import numpy as np
+import plotly.graph_objects as go
+
+
+# ヒストグラムのビン数の上限
+MAX_BINS = 50
+# 箱ひげ図に描く外れ値の件数の上限（群ごと）
+MAX_OUTLIERS = 200
+# 箱の長さ（四分位範囲）に対するひげの長さ
+WHISKER = 1.5
+# plotly express の既定の色
+DEFAULT_COLOR = '#636efa'
+
+
+def bin_edges(values, max_bins=MAX_BINS):
+    """
+    ヒストグラムのビンの区切り
+
+    numpy の 'auto' 規則で決め、max_bins を超える場合は等間隔に減らす。
+    欠損値は除いて計算する。
+    """
+    values = np.asarray(values, dtype=float)
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return np.array([0.0, 1.0])
+    edges = np.histogram_bin_edges(finite, bins='auto')
+    if len(edges) - 1 > max_bins:
+        edges = np.linspace(edges[0], edges[-1], max_bins + 1)
+    return edges
+
+
+def histogram_counts(values, max_bins=MAX_BINS):
+    """ビンの区切りと度数を返す"""
+    values = np.asarray(values, dtype=float)
+    edges = bin_edges(values, max_bins)
+    counts, _ = np.histogram(values[np.isfinite(values)], bins=edges)
+    return edges, counts
+
+
+def box_summary(values, whisker=WHISKER, max_outliers=MAX_OUTLIERS):
+    """
+    箱ひげ図の要約（四分位数・ひげの端・平均・外れ値）
+
+    四分位数は plotly の既定（quartilemethod='linear'）と同じく線形補間で求め、
+    ひげの端は 箱 ± whisker × 四分位範囲 の内側にある最も外側の値とする。
+    外れ値は外側にあるものから max_outliers 件までを返し、全件数も n_outliers に入れる。
+    欠損値しかない場合は None を返す。
+    """
+    values = np.asarray(values, dtype=float)
+    values = np.sort(values[np.isfinite(values)])
+    if len(values) == 0:
+        return None
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - whisker * iqr) & (values <= q3 + whisker * iqr)]
+    outliers = values[(values < inside[0]) | (values > inside[-1])]
+    n_outliers = len(outliers)
+    if n_outliers > max_outliers:
+        # 中央値から遠いものを優先して残す
+        farthest = np.argsort(-np.abs(outliers - median), kind='stable')[:max_outliers]
+        outliers = np.sort(outliers[farthest])
+    return {
+        'n': len(values),
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': inside[0],
+        'upperfence': inside[-1],
+        'mean': values.mean(),
+        'outliers': outliers,
+        'n_outliers': n_outliers,
+    }
+
+
+def histogram_figure(values, title, x_title):
+    """集計済みの度数から棒グラフでヒストグラムを作る"""
+    edges, counts = histogram_counts(values)
+    fig = go.Figure(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=np.diff(edges),
+        marker_color=DEFAULT_COLOR,
+        customdata=np.column_stack([edges[:-1], edges[1:]]),
+        hovertemplate='%{customdata[0]:.4g} - %{customdata[1]:.4g}<br>count=%{y}<extra></extra>',
+    ))
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title='count', bargap=0.2)
+    return fig
+
+
+def box_figure(groups, title, value_title=None, group_title=None, orientation='h'):
+    """
+    要約済みの統計量から箱ひげ図を作る
+
+    Parameters
+    ----------
+    groups : list of (label, array-like)
+        箱ごとのラベルと値
+    orientation : {'h', 'v'}
+        'h' は値を横軸に、'v' は値を縦軸に取る
+    """
+    fig = go.Figure()
+    for label, values in groups:
+        summary = box_summary(values)
+        if summary is None:
+            continue
+        position = {'y' if orientation == 'h' else 'x': [label]}
+        fig.add_trace(go.Box(
+            q1=[summary['q1']],
+            median=[summary['median']],
+            q3=[summary['q3']],
+            lowerfence=[summary['lowerfence']],
+            upperfence=[summary['upperfence']],
+            mean=[summary['mean']],
+            orientation=orientation,
+            name=str(label),
+            marker_color=DEFAULT_COLOR,
+            showlegend=False,
+            **position,
+        ))
+        if len(summary['outliers']):
+            outliers = summary['outliers']
+            labels = [label] * len(outliers)
+            fig.add_trace(go.Scatter(
+                x=outliers if orientation == 'h' else labels,
+                y=labels if orientation == 'h' else outliers,
+                mode='markers',
+                marker=dict(color=DEFAULT_COLOR, size=5),
+                name=str(label),
+                showlegend=False,
+            ))
+
+    value_axis, group_axis = ('xaxis_title', 'yaxis_title') if orientation == 'h' else ('yaxis_title', 'xaxis_title')
+    fig.update_layout(title=title, **{value_axis: value_title, group_axis: group_title})
+    return fig
@@ -0,0 +1,310 @@
+"""
+共起ネットワークの配置（レイアウト）・グループ分け（コミュニティ検出）と Plotly による描画
+
+配置とグループ分けは辺の集合（と重み）のハッシュ値をキーにしてモジュール内にキャッシュする
+（Streamlit の再実行でも使い回される）。表示する辺の数や配色を変えても、
+配置を求めたグラフが同じであれば再計算しない。
+
+ノード数が LARGE_GRAPH_NODES 以下のグラフは、KH Coder と同じく
+Fruchterman-Reingold 法（nx.spring_layout）で配置する。
+それより大きなグラフは全ノード対の計算が重いため、sparse stress 法で配置する:
+ピボットとする少数のノードからの最短経路長だけを使って Pivot MDS で初期配置を求め、
+辺で結ばれたノード対とノード・ピボット間の対についてのストレス（Ortmann らの sparse stress）を
+数回のストレス優勢化（majorization）の反復で小さくする。
+計算量は（辺の数 + ノード数 × ピボット数）× 反復回数 に比例する。
+グループ分けも大きなグラフでは貪欲法の代わりに Louvain 法を使う。
+"""
+import hashlib
+from collections import OrderedDict, namedtuple
+
+import networkx as nx
+import numpy as np
+import plotly.graph_objects as go
+from plotly import colors
+from scipy.sparse import csgraph
+
+
+# これより多いノードのグラフは sparse stress 法で配置する
+LARGE_GRAPH_NODES = 300
+# sparse stress 法のピボットの数と反復回数
+N_PIVOTS = 50
+STRESS_ITERATIONS = 50
+# 配置の乱数の種（同じグラフなら同じ配置）
+LAYOUT_SEED = 42
+# キャッシュするグラフの数の上限（古いものから捨てる）
+CACHE_SIZE = 64
+
+# 配色（表示名 → plotly.colors.qualitative のパレット名）
+PALETTES = {'Set3': 'Set3', 'Pastel': 'Pastel', 'Plotly': 'Plotly', 'Bold': 'Bold'}
+# ノードの大きさ（直径、px）の最小値と、次数が最大のノードでの増分
+NODE_SIZE_MIN = 20
+NODE_SIZE_RANGE = 35
+# 辺の太さ（px）の最小値と、重みが最大の辺での増分、太さの段階数
+EDGE_WIDTH_MIN = 1.0
+EDGE_WIDTH_RANGE = 4.0
+EDGE_WIDTH_BINS = 5
+EDGE_COLOR = '#888888'
+
+# positions : ノード → (x, y)
+# communities : ノード → グループの番号（大きいグループから 0, 1, ...）
+NetworkLayout = namedtuple('NetworkLayout', ['positions', 'communities'])
+
+# グラフのハッシュ値 → NetworkLayout
+_cache = OrderedDict()
+
+
+def graph_key(graph):
+    """辺の集合と重みのハッシュ値（キャッシュのキー）"""
+    edges = sorted(
+        tuple(sorted((str(u), str(v)))) + (repr(float(data.get('weight', 1))),)
+        for u, v, data in graph.edges(data=True)
+    )
+    digest = hashlib.blake2b(digest_size=16)
+    for edge in edges:
+        digest.update('\x1f'.join(edge).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def detect_communities(graph, large_graph_nodes=LARGE_GRAPH_NODES, seed=LAYOUT_SEED):
+    """
+    モジュラリティを最大化するグループ分け（辺のないグラフは 1 グループ）
+
+    小さなグラフは貪欲法、大きなグラフはより速い Louvain 法を使う。
+    """
+    if graph.number_of_edges() == 0:
+        return {node: 0 for node in graph.nodes}
+    if graph.number_of_nodes() > large_graph_nodes:
+        groups = nx.community.louvain_communities(graph, seed=seed)
+    else:
+        groups = nx.community.greedy_modularity_communities(graph)
+    groups = sorted(groups, key=len, reverse=True)
+    return {node: idx for idx, group in enumerate(groups) for node in group}
+
+
+def spring_positions(graph, seed=LAYOUT_SEED):
+    """Fruchterman-Reingold 法（KH Coder の標準）による配置"""
+    try:
+        return nx.spring_layout(graph, k=2.0, iterations=100, seed=seed)
+    except Exception:
+        return nx.kamada_kawai_layout(graph, scale=2.0)
+
+
+def _pivot_distances(adjacency, n_pivots, rng):
+    """
+    max-min 法でピボットを選び、ピボットから各ノードへの最短経路長（辺の数）を求める
+
+    到達できないノード（別の連結成分）への距離は、有限の最大値 + 1 とする。
+    """
+    n = adjacency.shape[0]
+    pivots = [int(rng.integers(n))]
+    rows = [csgraph.shortest_path(adjacency, unweighted=True, directed=False, indices=pivots[0])]
+    nearest = rows[0].copy()
+    while len(pivots) < n_pivots:
+        candidate = int(np.argmax(nearest))
+        if nearest[candidate] == 0:
+            break
+        pivots.append(candidate)
+        rows.append(csgraph.shortest_path(adjacency, unweighted=True, directed=False, indices=candidate))
+        nearest = np.minimum(nearest, rows[-1])
+
+    dist = np.vstack(rows)
+    finite = np.isfinite(dist)
+    dist[~finite] = dist[finite].max() + 1
+    return np.asarray(pivots), dist
+
+
+def _pivot_mds(dist):
+    """Pivot MDS: ピボットとの距離だけを使った古典的多次元尺度法による初期配置"""
+    sq = dist.T ** 2
+    centered = -0.5 * (sq - sq.mean(axis=0) - sq.mean(axis=1)[:, None] + sq.mean())
+    u, s, _ = np.linalg.svd(centered, full_matrices=False)
+    pos = u[:, :2] * s[:2]
+    if pos.shape[1] < 2:
+        pos = np.hstack([pos, np.zeros((len(pos), 2 - pos.shape[1]))])
+    return pos
+
+
+def _pivot_region_weights(pivots, dist):
+    """
+    ノード・ピボット間の項の重みの係数（Ortmann ら の sparse stress）
+
+    各ノードを最も近いピボットの領域に割り当て、ノード i とピボット p の項は、
+    p の領域のうち p からの距離が d(i, p) / 2 以下のノードの数だけ重くする
+    （ピボットが領域内の近いノードの代わりを務める）。
+    """
+    nearest = np.argmin(dist, axis=0)
+    counts = np.empty_like(dist)
+    for idx in range(len(pivots)):
+        region = np.sort(dist[idx, nearest == idx])
+        counts[idx] = np.searchsorted(region, dist[idx] / 2, side='right')
+    return counts
+
+
+def _sparse_stress(pos, i, j, d, w):
+    """ストレスの項（i, j, 目標距離 d, 重み w）の合計"""
+    return float((w * (np.linalg.norm(pos[i] - pos[j], axis=1) - d) ** 2).sum())
+
+
+def sparse_stress_positions(graph, n_pivots=N_PIVOTS, iterations=STRESS_ITERATIONS, seed=LAYOUT_SEED):
+    """
+    sparse stress 法による配置（大きなグラフ向け、Ortmann, Klimenta, Brandes 2016）
+
+    ストレスの項は、辺で結ばれたノード対（目標距離 1、重み 1）と、
+    各ノードと辺で結ばれていない各ピボットの対（目標距離は最短経路長）だけに限る。
+    ピボットとの項は、そのノードだけを動かし（ピボットは自身の項で動く）、
+    重みは ピボットの領域のうちの近いノードの数 / 目標距離² とする。
+    反復後のストレスが初期配置より大きい場合は初期配置を使う。
+    """
+    nodes = list(graph.nodes)
+    n = len(nodes)
+    if n < 3:
+        return spring_positions(graph, seed)
+    adjacency = nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=None, format='csr')
+    rng = np.random.default_rng(seed)
+    pivots, dist = _pivot_distances(adjacency, min(n_pivots, n), rng)
+    pos = _pivot_mds(dist)
+    # 対称な配置（全ノードが同じ位置など）から動けるよう、ごく小さなゆらぎを加える
+    pos = pos + rng.normal(scale=1e-6 * (np.abs(pos).max() + 1), size=pos.shape)
+
+    # 辺の項は両端をそれぞれ動かすため、向きを変えて 2 回入れる
+    edge_i, edge_j = adjacency.nonzero()
+    keep = edge_i != edge_j
+    edge_i, edge_j = edge_i[keep], edge_j[keep]
+    # ピボットとの項（i がノード、j がピボット）。辺で結ばれた対（距離 1）は辺の項に含まれる
+    pivot_i = np.tile(np.arange(n), len(pivots))
+    pivot_j = np.repeat(pivots, n)
+    pivot_d = dist.ravel()
+    pivot_w = _pivot_region_weights(pivots, dist).ravel()
+    keep = pivot_d > 1
+    i = np.concatenate([edge_i, pivot_i[keep]])
+    j = np.concatenate([edge_j, pivot_j[keep]])
+    d = np.concatenate([np.ones(len(edge_i)), pivot_d[keep]])
+    w = np.concatenate([np.ones(len(edge_i)), pivot_w[keep]]) / d ** 2
+
+    # 初期配置の大きさを目標距離に合わせる（ストレスを最小にする拡大率）
+    norm = np.linalg.norm(pos[i] - pos[j], axis=1)
+    pos = pos * (w * d * norm).sum() / max((w * norm ** 2).sum(), 1e-12)
+    initial = pos
+
+    # 各ノードを、項の相手から目標距離だけ離れた位置の重み付き平均へ動かす（全ノードを同時に更新）
+    # 項を持たないノードは動かさない
+    den = np.bincount(i, w, n)
+    fixed = den == 0
+    den[fixed] = 1
+    for _ in range(iterations):
+        delta = pos[i] - pos[j]
+        norm = np.linalg.norm(delta, axis=1)
+        norm[norm == 0] = 1e-12
+        target = pos[j] + (d / norm)[:, None] * delta
+        num = np.column_stack([np.bincount(i, w * target[:, axis], n) for axis in range(2)])
+        pos = np.where(fixed[:, None], pos, num / den[:, None])
+    if _sparse_stress(pos, i, j, d, w) > _sparse_stress(initial, i, j, d, w):
+        pos = initial
+    return dict(zip(nodes, nx.rescale_layout(pos)))
+
+
+def compute_layout(graph, large_graph_nodes=LARGE_GRAPH_NODES, seed=LAYOUT_SEED):
+    """配置とグループ分けを求める（キャッシュしない）"""
+    if graph.number_of_nodes() > large_graph_nodes:
+        positions = sparse_stress_positions(graph, seed=seed)
+    else:
+        positions = spring_positions(graph, seed)
+    positions = {node: (float(x), float(y)) for node, (x, y) in positions.items()}
+    return NetworkLayout(positions=positions, communities=detect_communities(graph, large_graph_nodes, seed))
+
+
+def cached_layout(graph, **kwargs):
+    """配置とグループ分けを求める（同じ辺の集合のグラフはキャッシュを使う）"""
+    key = graph_key(graph)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    layout = compute_layout(graph, **kwargs)
+    _cache[key] = layout
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return layout
+
+
+def top_edges(graph, top_n):
+    """重みの大きい上位 top_n 本の辺からなる部分グラフ（同じ重みなら元の順）"""
+    edges = sorted(graph.edges(data=True), key=lambda edge: edge[2].get('weight', 1), reverse=True)
+    return graph.edge_subgraph((u, v) for u, v, _ in edges[:top_n])
+
+
+def _edge_traces(graph, positions):
+    """辺の太さを段階に分け、段階ごとに 1 つの線のトレースにまとめる"""
+    edges = list(graph.edges(data=True))
+    weights = np.array([data.get('weight', 1) for _, _, data in edges], dtype=float)
+    max_weight = weights.max() if len(weights) and weights.max() > 0 else 1
+    bins = np.minimum((weights / max_weight * EDGE_WIDTH_BINS).astype(int), EDGE_WIDTH_BINS - 1)
+
+    traces = []
+    for level in np.unique(bins):
+        xs, ys = [], []
+        for idx in np.flatnonzero(bins == level):
+            u, v, _ = edges[idx]
+            xs.extend([positions[u][0], positions[v][0], None])
+            ys.extend([positions[u][1], positions[v][1], None])
+        traces.append(go.Scatter(
+            x=xs, y=ys, mode='lines', hoverinfo='skip', opacity=0.5,
+            line=dict(width=EDGE_WIDTH_MIN + (level + 1) / EDGE_WIDTH_BINS * EDGE_WIDTH_RANGE, color=EDGE_COLOR)
+        ))
+    return traces
+
+
+def network_figure(graph, layout, title='共起ネットワーク', palette='Set3'):
+    """
+    求めておいた配置で共起ネットワークを Plotly の図にする
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        表示するグラフ（layout を求めたグラフの部分グラフでよい）
+    layout : NetworkLayout
+    title : str
+    palette : str
+        plotly.colors.qualitative のパレット名（グループごとの色）
+
+    Returns
+    -------
+    plotly.graph_objects.Figure
+    """
+    nodes = list(graph.nodes)
+    degrees = dict(graph.degree())
+    max_degree = max(degrees.values()) if degrees else 1
+    colorway = getattr(colors.qualitative, palette)
+    node_colors = [colorway[layout.communities.get(node, 0) % len(colorway)] for node in nodes]
+    hover = [
+        f'{node}<br>出現回数: {graph.nodes[node].get("frequency", "-")}<br>次数: {degrees[node]}'
+        for node in nodes
+    ]
+
+    fig = go.Figure(_edge_traces(graph, layout.positions))
+    fig.add_trace(go.Scatter(
+        x=[layout.positions[node][0] for node in nodes],
+        y=[layout.positions[node][1] for node in nodes],
+        mode='markers+text',
+        text=[str(node) for node in nodes],
+        textposition='middle center',
+        textfont=dict(size=12, color='black'),
+        hovertext=hover,
+        hoverinfo='text',
+        marker=dict(
+            size=[NODE_SIZE_MIN + degrees[node] / max_degree * NODE_SIZE_RANGE for node in nodes],
+            color=node_colors,
+            line=dict(width=2, color='white'),
+            opacity=0.9
+        )
+    ))
+    fig.update_layout(
+        title=title,
+        showlegend=False,
+        plot_bgcolor='white',
+        height=700,
+        margin=dict(l=20, r=20, t=60, b=20),
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False, scaleanchor='x', scaleratio=1)
+    )
+    return fig
@@ -0,0 +1,255 @@
+"""
+多重比較（Tukey の HSD 法・Games-Howell 法）
+
+群ごとの平均値・有効 N・分散（または群内平均平方）から、全ての群の組み合わせの
+差・標準誤差・スチューデント化範囲統計量を配列演算でまとめて計算する。
+statsmodels の pairwise_tukeyhsd を従属変数ごとに呼び出して結果表を
+文字列から DataFrame に変換し直す処理の代わりに使う。
+
+スチューデント化範囲分布の上側確率は数値積分のため 1 点あたりの計算が重い。
+そこで (群数 k, 自由度 df) ごとに確率表を一度だけ作ってキャッシュし、
+以降は補間で求める（誤差は 1e-5 程度以下）。
+臨界値（信頼区間用）も (k, df, α) ごとにキャッシュする。
+
+結果の列構成は pairwise_tukeyhsd の結果表
+（group1, group2, meandiff, p-adj, lower, upper, reject）に合わせている。
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import interpolate, stats
+
+
+# 確率表を作る q の範囲と点数（log(1 + q) について等間隔に取る）
+Q_GRID_MAX = 50.0
+Q_GRID_SIZE = 81
+# これ未満の上側確率は 0 とみなす
+P_FLOOR = 1e-15
+# 確率表に使う自由度の上限（これを超える自由度は正規近似とみなせる）
+DF_LIMIT = 10000
+
+TUKEY_COLUMNS = ['group1', 'group2', 'meandiff', 'p-adj', 'lower', 'upper', 'reject']
+
+
+def _normalize_df(df):
+    return float(min(df, DF_LIMIT))
+
+
+@lru_cache(maxsize=64)
+def _sf_table(k, df):
+    """
+    (k, df) に対するスチューデント化範囲分布の上側確率の補間関数
+
+    x = log(1 + q) に対する log(上側確率) を 3 次スプラインで補間する。
+    自由度が小さく裾が重い場合も、この変換でほぼ直線になり精度が保てる。
+    上側確率が P_FLOOR 未満になる範囲は表に含めない。
+    """
+    x_grid = np.linspace(0.0, np.log1p(Q_GRID_MAX), Q_GRID_SIZE)
+    sf = stats.studentized_range.sf(np.expm1(x_grid), k, df)
+    usable = sf > P_FLOOR
+    return interpolate.CubicSpline(x_grid[usable], np.log(sf[usable]), extrapolate=False)
+
+
+@lru_cache(maxsize=256)
+def studentized_range_critical(k, df, alpha=0.05):
+    """スチューデント化範囲分布の上側 α 点（臨界値）"""
+    return float(stats.studentized_range.ppf(1 - alpha, k, _normalize_df(df)))
+
+
+def studentized_range_sf(q, k, df):
+    """
+    スチューデント化範囲分布の上側確率（p 値）を求める
+
+    q は配列で受け取り、(k, df) ごとにキャッシュした確率表から補間する。
+    上側確率が P_FLOOR 未満になる範囲の q には 0 を返し、
+    表の上端（Q_GRID_MAX）を超える q だけは直接計算する。
+    """
+    q = np.abs(np.asarray(q, dtype=float))
+    k = int(k)
+    df = _normalize_df(df)
+    table = _sf_table(k, df)
+    x = np.log1p(q)
+    p = np.exp(table(x))
+
+    beyond = x > table.x[-1]
+    if table.x[-1] < np.log1p(Q_GRID_MAX):
+        p = np.where(beyond, 0.0, p)
+    elif beyond.any():
+        p[beyond] = stats.studentized_range.sf(q[beyond], k, df)
+    return np.clip(p, 0.0, 1.0)
+
+
+def pair_indices(k):
+    """k 群の全ての組み合わせ (i < j) の添字"""
+    return np.triu_indices(k, 1)
+
+
+def tukey_hsd_from_stats(groups, mean, n, ms_within, df_within, alpha=0.05):
+    """
+    群ごとの平均値・有効 N と群内平均平方から Tukey-Kramer 法の多重比較を行う
+
+    Parameters
+    ----------
+    groups : sequence
+        群の名前（mean, n と同じ順序）
+    mean, n : array-like, shape (k,)
+    ms_within : float
+        分散分析の群内平均平方（MSE）
+    df_within : float
+        群内自由度
+
+    Returns
+    -------
+    DataFrame
+        pairwise_tukeyhsd と同じ列構成の結果表
+    """
+    groups = list(groups)
+    mean = np.asarray(mean, dtype=float)
+    n = np.asarray(n, dtype=float)
+    k = len(groups)
+    i, j = pair_indices(k)
+
+    meandiff = mean[j] - mean[i]
+    se = np.sqrt(ms_within / 2 * (1 / n[i] + 1 / n[j]))
+    q = np.abs(meandiff) / se
+    p_adj = studentized_range_sf(q, k, df_within)
+
+    q_crit = studentized_range_critical(k, df_within, alpha)
+    half_width = q_crit * se
+
+    return pd.DataFrame({
+        'group1': [groups[a] for a in i],
+        'group2': [groups[b] for b in j],
+        'meandiff': meandiff,
+        'p-adj': p_adj,
+        'lower': meandiff - half_width,
+        'upper': meandiff + half_width,
+        'reject': p_adj < alpha,
+    }, columns=TUKEY_COLUMNS)
+
+
+def games_howell_from_stats(groups, mean, n, var, alpha=0.05):
+    """
+    群ごとの平均値・有効 N・不偏分散から Games-Howell 法の多重比較を行う
+
+    等分散を仮定しないため、組み合わせごとに Welch の自由度を用いる。
+    自由度が組ごとに異なり確率表を共有できないので、p 値は直接計算する。
+    """
+    groups = list(groups)
+    mean = np.asarray(mean, dtype=float)
+    n = np.asarray(n, dtype=float)
+    var = np.asarray(var, dtype=float)
+    k = len(groups)
+    i, j = pair_indices(k)
+
+    meandiff = mean[j] - mean[i]
+    se_i = var[i] / n[i]
+    se_j = var[j] / n[j]
+    se = np.sqrt((se_i + se_j) / 2)
+    df_pair = (se_i + se_j) ** 2 / (se_i ** 2 / (n[i] - 1) + se_j ** 2 / (n[j] - 1))
+    q = np.abs(meandiff) / se
+    p_adj = np.clip(stats.studentized_range.sf(q, k, np.minimum(df_pair, DF_LIMIT)), 0.0, 1.0)
+
+    q_crit = np.array([studentized_range_critical(k, d, alpha) for d in df_pair])
+    half_width = q_crit * se
+
+    return pd.DataFrame({
+        'group1': [groups[a] for a in i],
+        'group2': [groups[b] for b in j],
+        'meandiff': meandiff,
+        'p-adj': p_adj,
+        'lower': meandiff - half_width,
+        'upper': meandiff + half_width,
+        'reject': p_adj < alpha,
+    }, columns=TUKEY_COLUMNS)
+
+
+def tukey_hsd_from_anova(anova_result, alpha=0.05, groups=None):
+    """
+    anova_engine.oneway_anova の結果から、全従属変数の Tukey 法をまとめて行う
+
+    群ごとの平均値・有効 N・群内平均平方は分散分析で計算済みのものを使うため、
+    データを読み直す必要がない。
+
+    Returns
+    -------
+    dict
+        従属変数名 → 結果表（DataFrame）
+    """
+    groups = list(anova_result.mean.columns) if groups is None else list(groups)
+    results = {}
+    for var in anova_result.table.index:
+        n = anova_result.n.loc[var, groups]
+        present = n.to_numpy() > 0
+        results[var] = tukey_hsd_from_stats(
+            [g for g, keep in zip(groups, present) if keep],
+            anova_result.mean.loc[var, groups].to_numpy()[present],
+            n.to_numpy()[present],
+            anova_result.ms_within[var],
+            anova_result.table.at[var, 'df_within'],
+            alpha=alpha,
+        )
+    return results
+
+
+def _group_stats(df, value_col, group_col, groups):
+    grouped = df.groupby(group_col, observed=True)[value_col]
+    stats_df = grouped.agg(['count', 'mean', 'var'])
+    if groups is None:
+        groups = sorted(stats_df.index)
+    return stats_df.reindex(groups)
+
+
+def tukey_hsd_from_summary(groups, mean, n, var, alpha=0.05):
+    """
+    群ごとの平均値・有効 N・不偏分散から Tukey 法の多重比較を行う
+
+    群内平均平方は各群の分散をプールして求める。
+    """
+    n = np.asarray(n, dtype=float)
+    var = np.asarray(var, dtype=float)
+    df_within = n.sum() - len(n)
+    ms_within = ((n - 1) * var).sum() / df_within
+    return tukey_hsd_from_stats(groups, mean, n, ms_within, df_within, alpha)
+
+
+def tukey_hsd(df, value_col, group_col, groups=None, alpha=0.05):
+    """
+    DataFrame の 1 つの従属変数について Tukey 法の多重比較を行う
+
+    groups を省略した場合は pairwise_tukeyhsd と同じく群名の昇順に並べる。
+    """
+    stats_df = _group_stats(df, value_col, group_col, groups)
+    return tukey_hsd_from_summary(
+        stats_df.index, stats_df['mean'], stats_df['count'], stats_df['var'], alpha
+    )
+
+
+def games_howell(df, value_col, group_col, groups=None, alpha=0.05):
+    """DataFrame の 1 つの従属変数について Games-Howell 法の多重比較を行う"""
+    stats_df = _group_stats(df, value_col, group_col, groups)
+    return games_howell_from_stats(
+        stats_df.index, stats_df['mean'], stats_df['count'], stats_df['var'], alpha
+    )
+
+
+def significant_comparisons(posthoc_df, threshold=0.1):
+    """
+    ブラケット描画用に、p 値が threshold 未満の組み合わせを取り出す
+
+    Returns
+    -------
+    list of tuple
+        (group1, group2, p 値, 記号) のリスト
+    """
+    rows = posthoc_df[posthoc_df['p-adj'] < threshold]
+    marks = np.select(
+        [rows['p-adj'] < 0.01, rows['p-adj'] < 0.05],
+        ['**', '*'],
+        default='†',
+    )
+    return [
+        (group1, group2, p_value, mark)
+        for group1, group2, p_value, mark in zip(rows['group1'], rows['group2'], rows['p-adj'], marks)
+    ]
@@ -0,0 +1,175 @@
+"""
+重回帰分析の一括計算エンジン
+
+同じ説明変数で複数の目的変数を予測する場合に、計画行列を一度だけ QR 分解し、
+全ての目的変数を多列の右辺としてまとめて解く。
+目的変数ごとに statsmodels の OLS を当てはめ直す処理（標準化係数のための
+2 回目の当てはめを含む）の代わりに使う。
+
+欠損値を含む行は目的変数ごとに除外する（statsmodels の missing='drop' と同じ扱い）。
+欠損の位置が同じ目的変数はまとめて 1 回の分解で解き、位置が異なる目的変数だけ
+別の分解になる。
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import linalg, stats
+
+import anova_engine
+
+
+RegressionResult = namedtuple(
+    'RegressionResult',
+    ['coefficients', 'n', 'r2', 'adj_r2', 'f_value', 'f_pvalue', 'df_model', 'df_resid'],
+)
+
+COEFFICIENT_COLUMNS = ['coef', 'std_coef', 'se', 't', 'p']
+
+
+def _least_squares(design, values):
+    """
+    計画行列を QR 分解して全ての右辺の係数と (X'X)^-1 の対角成分を求める
+
+    計画行列が階数落ちしている場合は statsmodels と同じく疑似逆行列を使う。
+
+    Returns
+    -------
+    (ndarray, ndarray, int)
+        係数 (n_cols, n_targets)、(X'X)^-1 の対角成分 (n_cols,)、計画行列の階数
+    """
+    q, r = np.linalg.qr(design)
+    diag = np.abs(np.diag(r))
+    tol = max(design.shape) * np.finfo(float).eps * diag.max(initial=0.0)
+    if len(diag) and diag.min() > tol:
+        r_inv = linalg.solve_triangular(r, np.eye(len(r)))
+        coef = r_inv @ (q.T @ values)
+        return coef, (r_inv ** 2).sum(axis=1), design.shape[1]
+    pinv = np.linalg.pinv(design)
+    return pinv @ values, (pinv ** 2).sum(axis=1), np.linalg.matrix_rank(design)
+
+
+def _standardize(values):
+    """列ごとに平均 0・標準偏差 1（母標準偏差、StandardScaler と同じ）に変換する"""
+    return (values - values.mean(axis=0)) / values.std(axis=0)
+
+
+def ols_arrays(x, y, standardize_idx=None):
+    """
+    欠損のない行について、定数項付きの重回帰分析を全目的変数まとめて計算する
+
+    Parameters
+    ----------
+    x : ndarray, shape (n_rows, n_features)
+    y : ndarray, shape (n_rows, n_targets)
+    standardize_idx : sequence of int, optional
+        標準化係数を「標準化したデータによる定数項なしの回帰」で求める説明変数の列番号。
+        それ以外の列（交互作用項など）の標準化係数は 偏回帰係数 × SD_X / SD_Y で求める。
+        省略時は全ての列を後者の方法で求める（交互作用項がなければ両者は一致する）。
+
+    Returns
+    -------
+    dict
+        coef, std_coef, se, t, p は shape (n_features + 1, n_targets) の配列
+        （1 行目が定数項）、r2, adj_r2, f_value, f_pvalue は長さ n_targets の配列
+    """
+    n, n_features = x.shape
+    design = np.hstack([np.ones((n, 1)), x])
+    coef, xtx_inv_diag, rank = _least_squares(design, y)
+
+    resid = y - design @ coef
+    ssr = (resid ** 2).sum(axis=0)
+    centered_tss = ((y - y.mean(axis=0)) ** 2).sum(axis=0)
+    df_model = rank - 1
+    df_resid = n - rank
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = ssr / df_resid
+        se = np.sqrt(np.outer(xtx_inv_diag, scale))
+        t = coef / se
+        p = 2 * stats.t.sf(np.abs(t), df_resid)
+
+        r2 = 1 - ssr / centered_tss
+        adj_r2 = 1 - (n - 1) / df_resid * (1 - r2)
+        f_value = ((centered_tss - ssr) / df_model) / scale
+        f_pvalue = stats.f.sf(f_value, df_model, df_resid)
+
+        # 標準化係数
+        std_coef = np.full_like(coef, np.nan)
+        sd_x = x.std(axis=0, ddof=1)
+        sd_y = y.std(axis=0, ddof=1)
+        std_coef[1:] = coef[1:] * sd_x[:, None] / sd_y
+        if standardize_idx is not None and len(standardize_idx):
+            standardize_idx = np.asarray(standardize_idx)
+            z_coef, _, _ = _least_squares(_standardize(x[:, standardize_idx]), _standardize(y))
+            std_coef[standardize_idx + 1] = z_coef
+
+    return {
+        'coef': coef,
+        'std_coef': std_coef,
+        'se': se,
+        't': t,
+        'p': p,
+        'r2': r2,
+        'adj_r2': adj_r2,
+        'f_value': f_value,
+        'f_pvalue': f_pvalue,
+        'df_model': df_model,
+        'df_resid': df_resid,
+    }
+
+
+def multi_ols(x_df, y_df, standardize_cols=None):
+    """
+    DataFrame の説明変数で、複数の目的変数の重回帰分析をまとめて行う
+
+    Parameters
+    ----------
+    x_df : DataFrame
+        説明変数（交互作用項などを含めた列）
+    y_df : DataFrame
+        目的変数
+    standardize_cols : list of str, optional
+        標準化したデータの回帰で標準化係数を求める説明変数（ols_arrays を参照）
+
+    Returns
+    -------
+    dict
+        目的変数名 → RegressionResult。
+        coefficients は 'const' と説明変数を行に持ち、
+        偏回帰係数・標準化係数・標準誤差・t 値・p 値を列に持つ DataFrame。
+        欠損のない行がない目的変数は含まない。
+    """
+    x_cols = list(x_df.columns)
+    y_cols = list(y_df.columns)
+    x = x_df.to_numpy(dtype=float)
+    y = y_df.to_numpy(dtype=float)
+    standardize_idx = None
+    if standardize_cols is not None:
+        standardize_idx = [x_cols.index(col) for col in standardize_cols]
+
+    missing = np.isnan(y) | np.isnan(x).any(axis=1)[:, None]
+    index = pd.Index(['const'] + x_cols)
+
+    results = {}
+    for rows, cols in anova_engine.missing_patterns(missing):
+        n = int(rows.sum())
+        if n == 0:
+            continue
+        res = ols_arrays(x[rows], y[np.ix_(rows, cols)], standardize_idx)
+        for position, col in enumerate(cols):
+            coefficients = pd.DataFrame(
+                {name: res[name][:, position] for name in COEFFICIENT_COLUMNS},
+                index=index, columns=COEFFICIENT_COLUMNS,
+            )
+            results[y_cols[col]] = RegressionResult(
+                coefficients=coefficients,
+                n=n,
+                r2=res['r2'][position],
+                adj_r2=res['adj_r2'][position],
+                f_value=res['f_value'][position],
+                f_pvalue=res['f_pvalue'][position],
+                df_model=res['df_model'],
+                df_resid=res['df_resid'],
+            )
+    return {col: results[col] for col in y_cols if col in results}
@@ -0,0 +1,161 @@
+"""
+散布図行列（Plotly）の作成
+
+変数の数 × データの件数が大きいと、全ての点を SVG の go.Scatter で描く
+散布図行列はブラウザが固まってしまう。そこで図全体の点数
+（件数 × 散布図のセル数）に応じて描画方法を切り替える。
+
+- POINTS_WEBGL 未満      : go.Scatter（SVG、従来どおり）
+- POINTS_DENSITY 未満    : go.Scattergl（WebGL）
+- それ以上               : 2 次元の格子で集計した度数をヒートマップとして描く
+
+対角のヒストグラムは np.histogram で集計済みの度数を棒グラフで描くため、
+生データを図に埋め込まない。
+変数ごとのビンの区切りと各値のビン番号は一度だけ計算し、
+ヒストグラムと全ての組み合わせの 2 次元集計で共有する。
+図のデータ量は点数ではなくビン数で頭打ちになる。
+"""
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+import eda_summary
+
+
+# 描画方法を切り替える図全体の点数
+POINTS_WEBGL = 20000
+POINTS_DENSITY = 500000
+# ヒストグラム・2 次元集計のビン数の上限
+MAX_BINS = 50
+DENSITY_BINS = 40
+
+
+def render_mode(n_points, points_webgl=POINTS_WEBGL, points_density=POINTS_DENSITY):
+    """図全体の点数から描画方法（'svg' / 'webgl' / 'density'）を決める"""
+    if n_points >= points_density:
+        return 'density'
+    if n_points >= points_webgl:
+        return 'webgl'
+    return 'svg'
+
+
+def _binned(values, max_bins):
+    """
+    1 変数のビンの区切りと各値のビン番号（欠損値は -1）
+
+    区切りは eda_summary.bin_edges（EDA のヒストグラムと同じ規則）で決める。
+    """
+    edges = eda_summary.bin_edges(values, max_bins)
+    codes = np.searchsorted(edges, values, side='right') - 1
+    # 最大値は最後のビンに含める（np.histogram と同じ）
+    codes[values == edges[-1]] = len(edges) - 2
+    codes[~np.isfinite(values)] = -1
+    return edges, codes
+
+
+def _centers(edges):
+    return (edges[:-1] + edges[1:]) / 2
+
+
+def histogram_trace(edges, codes, name):
+    """集計済みの度数から対角のヒストグラム（棒グラフ）を作る"""
+    counts = np.bincount(codes[codes >= 0], minlength=len(edges) - 1)
+    return go.Bar(
+        x=_centers(edges),
+        y=counts,
+        width=np.diff(edges),
+        name=name,
+        showlegend=False,
+    )
+
+
+def density_trace(x_edges, x_codes, y_edges, y_codes):
+    """2 変数の度数を格子で集計してヒートマップを作る（度数 0 の格子は空白）"""
+    valid = (x_codes >= 0) & (y_codes >= 0)
+    n_x = len(x_edges) - 1
+    n_y = len(y_edges) - 1
+    counts = np.bincount(
+        y_codes[valid] * n_x + x_codes[valid], minlength=n_x * n_y
+    ).reshape(n_y, n_x).astype(float)
+    counts[counts == 0] = np.nan
+    return go.Heatmap(
+        x=_centers(x_edges),
+        y=_centers(y_edges),
+        z=counts,
+        colorscale='Blues',
+        showscale=False,
+        hovertemplate='x=%{x}<br>y=%{y}<br>件数=%{z}<extra></extra>',
+    )
+
+
+def scatter_trace(x, y, mode):
+    """生データの散布図（SVG または WebGL）"""
+    trace_class = go.Scattergl if mode == 'webgl' else go.Scatter
+    valid = np.isfinite(x) & np.isfinite(y)
+    return trace_class(
+        x=x[valid],
+        y=y[valid],
+        mode='markers',
+        marker=dict(size=6 if mode == 'svg' else 3),
+        showlegend=False,
+    )
+
+
+def build_scatter_matrix(df, columns, title='散布図行列とヒストグラム',
+                         points_webgl=POINTS_WEBGL, points_density=POINTS_DENSITY,
+                         max_bins=MAX_BINS, density_bins=DENSITY_BINS):
+    """
+    散布図行列（対角はヒストグラム）の図を作る
+
+    Parameters
+    ----------
+    df : DataFrame
+    columns : list of str
+        対象の数値列
+    points_webgl, points_density : int
+        WebGL・格子集計に切り替える図全体の点数
+
+    Returns
+    -------
+    plotly.graph_objects.Figure
+    """
+    columns = list(columns)
+    k = len(columns)
+    values = {col: df[col].to_numpy(dtype=float) for col in columns}
+    mode = render_mode(len(df) * k * (k - 1), points_webgl, points_density)
+
+    hist_bins = {col: _binned(values[col], max_bins) for col in columns}
+    if mode == 'density':
+        grid_bins = {col: _binned(values[col], density_bins) for col in columns}
+
+    traces, rows, cols = [], [], []
+    axis_titles = {}
+    for i, var1 in enumerate(columns):
+        for j, var2 in enumerate(columns):
+            if i == j:
+                trace = histogram_trace(*hist_bins[var1], name=var1)
+            elif mode == 'density':
+                trace = density_trace(*grid_bins[var2], *grid_bins[var1])
+            else:
+                trace = scatter_trace(values[var2], values[var1], mode)
+            traces.append(trace)
+            rows.append(i + 1)
+            cols.append(j + 1)
+
+            # 横軸のラベルは最下の行のみ、縦軸のラベルは最左の列のみに設定
+            axis = '' if i == 0 and j == 0 else str(i * k + j + 1)
+            axis_titles[f'xaxis{axis}'] = dict(title_text=var2 if i == k - 1 else '')
+            axis_titles[f'yaxis{axis}'] = dict(title_text=var1 if j == 0 else '')
+
+    # セルごとに add_trace / update_xaxes を呼ぶと変数が多いときに遅いため、まとめて追加する
+    fig = make_subplots(rows=k, cols=k)
+    fig.add_traces(traces, rows=rows, cols=cols)
+    fig.update_layout(
+        height=200 * k,
+        width=200 * k,
+        showlegend=False,
+        bargap=0,
+        title=title,
+        **axis_titles,
+    )
+    return fig
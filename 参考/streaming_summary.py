@@ -0,0 +1,515 @@
+"""
+チャンク単位で更新できる要約統計量（スケッチ）
+
+df.describe(include='all') や四分位数の計算は列全体をメモリに載せて並べ替える必要がある。
+ここでは全体を読み込むには大きすぎる CSV をチャンクごとに読み込みながら、
+以下の併合可能な要約だけを保持する。メモリ使用量はデータの行数によらずほぼ一定になる。
+（すでにメモリ上にある DataFrame には df.describe を使う。スケッチより速く、厳密である。）
+
+- 分位数   : KLL スケッチ（近似、相対順位の誤差はおおよそ 1% 以下）
+- 平均など : 中心モーメント（平均・分散・歪度・尖度）をチャンクごとに併合（厳密）
+- 異なり数 : 少ないうちはハッシュ値の集合で厳密に数え、多くなったら HyperLogLog（近似）
+- 最頻値   : Misra-Gries 法で上位の値の候補を絞り、summarize_csv では 2 回目の読み込みで
+             候補の度数を厳密に数え直す（度数が全件数の 1/TOP_K_CAPACITY を超える値は必ず候補に残る）
+
+各スケッチは merge で併合できるため、複数のファイルやプロセスで集計した結果をまとめられる。
+cached_summary はファイル内容のハッシュ値ごとに結果をモジュール内にキャッシュし、
+Streamlit の再実行のたびにファイルを読み直さないようにする。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# 既定のチャンク行数
+CHUNKSIZE = 100000
+# これ以上の大きさの CSV は全体を読み込まずにストリーミングで処理する（バイト）
+STREAMING_BYTES = 100 * 1024 * 1024
+# KLL スケッチの精度パラメータ（大きいほど正確でメモリを使う）
+KLL_K = 200
+# HyperLogLog のレジスタ数（2 の HLL_P 乗）
+HLL_P = 14
+# 異なり数を厳密に数える上限
+EXACT_DISTINCT_LIMIT = 10000
+# 最頻値の候補として保持する値の数
+TOP_K_CAPACITY = 1000
+# キャッシュする要約の数の上限（古いものから捨てる）
+CACHE_SIZE = 8
+
+# ファイル内容のハッシュ値 → StreamingSummary
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+DESCRIBE_COLUMNS = ['count', 'unique', 'top', 'freq', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+
+class QuantileSketch:
+    """
+    KLL スケッチによる分位数の近似
+
+    レベル h の値は 2^h 個分の重みを持つ。レベルの容量を超えたら並べ替えて
+    1 つおきに上のレベルへ送る（圧縮）。上のレベルほど容量が大きく、
+    下のレベルは 2/3 倍ずつ小さくなる。最小値・最大値は厳密に保持する。
+    """
+
+    def __init__(self, k=KLL_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # 奇数個のときは 1 つ残す
+                keep = items[:1] if len(items) % 2 else items[:0]
+                pairs = items[len(keep):]
+                offset = int(self._rng.integers(2))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], pairs[offset::2]])
+                self.levels[level] = keep
+                # 上のレベルが増えると下のレベルの容量が変わるため最初から確認し直す
+                level = 0
+                continue
+            level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """分位数（q は 0〜1 のスカラーまたは配列）を重み付きの順位から線形補間で求める"""
+        q = np.asarray(q, dtype=float)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(self.levels)
+        ])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        weights = weights[order]
+        # 各値が代表する順位の中心（0 〜 n-1 の尺度。重みの合計は常に n に等しい）
+        centers = np.cumsum(weights) - weights / 2 - 0.5
+        ranks = np.concatenate([[0.0], centers, [self.n - 1.0]])
+        points = np.concatenate([[self.min], items, [self.max]])
+        return np.interp(q * (self.n - 1), ranks, points)
+
+    @property
+    def size(self):
+        """保持している値の数"""
+        return sum(len(items) for items in self.levels)
+
+
+class Moments:
+    """
+    平均・分散・歪度・尖度のための中心モーメント（チャンクごとに厳密に併合）
+
+    2 つの集計の併合は Pébay (2008) の式による（Welford の逐次更新を一般化したもの）。
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        other = Moments()
+        other.n = len(values)
+        other.mean = values.mean()
+        dev = values - other.mean
+        other.m2 = (dev ** 2).sum()
+        other.m3 = (dev ** 3).sum()
+        other.m4 = (dev ** 4).sum()
+        self.merge(other)
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.m2, self.m3, self.m4 = other.n, other.mean, other.m2, other.m3, other.m4
+            return self
+        n_a, n_b = self.n, other.n
+        n = n_a + n_b
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta ** 2 * n_a * n_b / n
+        m3 = (self.m3 + other.m3
+              + delta ** 3 * n_a * n_b * (n_a - n_b) / n ** 2
+              + 3 * delta * (n_a * other.m2 - n_b * self.m2) / n)
+        m4 = (self.m4 + other.m4
+              + delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / n ** 3
+              + 6 * delta ** 2 * (n_a ** 2 * other.m2 + n_b ** 2 * self.m2) / n ** 2
+              + 4 * delta * (n_a * other.m3 - n_b * self.m3) / n)
+        self.n = n
+        self.mean = self.mean + delta * n_b / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def skew(self):
+        """不偏化した歪度（pandas の Series.skew と同じ定義）"""
+        n = self.n
+        if n < 3 or self.m2 == 0:
+            return np.nan
+        g1 = np.sqrt(n) * self.m3 / self.m2 ** 1.5
+        return np.sqrt(n * (n - 1)) / (n - 2) * g1
+
+    @property
+    def kurtosis(self):
+        """不偏化した超過尖度（pandas の Series.kurtosis と同じ定義）"""
+        n = self.n
+        if n < 4 or self.m2 == 0:
+            return np.nan
+        g2 = n * self.m4 / self.m2 ** 2 - 3
+        return (n - 1) / ((n - 2) * (n - 3)) * ((n + 1) * g2 + 6)
+
+
+def _bit_length(x):
+    """符号なし 64 ビット整数の配列の各要素のビット長"""
+    x = np.asarray(x, dtype=np.uint64).copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        large = x >= np.uint64(1 << shift)
+        length[large] += shift
+        x[large] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+class DistinctCounter:
+    """
+    異なり数の計数
+
+    ハッシュ値の種類が EXACT_DISTINCT_LIMIT 以下のうちは集合で厳密に数え、
+    超えたら HyperLogLog（相対誤差 約 1.04 / √(2^p)、p=14 で約 0.8%）に切り替える。
+    """
+
+    def __init__(self, p=HLL_P, exact_limit=EXACT_DISTINCT_LIMIT):
+        self.p = p
+        self.exact_limit = exact_limit
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.registers = None
+
+    def update_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) <= self.exact_limit:
+                return
+            hashes, self.hashes = self.hashes, np.empty(0, dtype=np.uint64)
+            self.registers = np.zeros(1 << self.p, dtype=np.uint8)
+        self._add_to_registers(hashes)
+
+    def update(self, values):
+        values = pd.Series(values).dropna()
+        self.update_hashes(pd.util.hash_array(values.to_numpy()))
+
+    def _add_to_registers(self, hashes):
+        p = self.p
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # 残りのビットの先頭の 0 の数 + 1
+        rank = (64 - p - _bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.registers is None:
+            self.update_hashes(other.hashes)
+            return self
+        if self.registers is None:
+            hashes, self.hashes = self.hashes, np.empty(0, dtype=np.uint64)
+            self.registers = other.registers.copy()
+            if len(hashes):
+                self._add_to_registers(hashes)
+            return self
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def count(self):
+        if self.registers is None:
+            return len(self.hashes)
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m ** 2 / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # 少ない範囲は線形計数で補正
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class TopK:
+    """
+    Misra-Gries 法による頻出値の計数
+
+    保持する値の種類が capacity を超えたら、(capacity + 1) 番目の度数を全体から引いて
+    上位 capacity 件だけを残す。度数は過小評価になり得るが、誤差は
+    （全件数 / capacity）以下で、種類が capacity 以下なら厳密。
+    """
+
+    def __init__(self, capacity=TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+
+    def update(self, values):
+        self.merge_counts(pd.Series(values).dropna().value_counts(sort=False))
+
+    def merge_counts(self, counts):
+        combined = self.counts.add(counts, fill_value=0).astype('int64')
+        if len(combined) > self.capacity:
+            combined = combined.sort_values(ascending=False, kind='stable')
+            threshold = combined.iloc[self.capacity]
+            combined = combined.iloc[:self.capacity] - threshold
+            combined = combined[combined > 0]
+        self.counts = combined
+
+    def merge(self, other):
+        self.merge_counts(other.counts)
+        return self
+
+    def most_common(self, n=1):
+        return self.counts.sort_values(ascending=False, kind='stable').head(n)
+
+    @property
+    def candidates(self):
+        """最頻値の候補として残っている値"""
+        return self.counts.index
+
+
+class ColumnSummary:
+    """1 列分のスケッチ（数値列は分位数・モーメント、それ以外は異なり数・最頻値）"""
+
+    def __init__(self, numeric):
+        self.numeric = numeric
+        self.count = 0
+        if numeric:
+            self.quantiles = QuantileSketch()
+            self.moments = Moments()
+        else:
+            self.distinct = DistinctCounter()
+            self.top = TopK()
+            # 最頻値の候補の厳密な度数（count_top_candidates で数え直した場合のみ）
+            self.top_counts = None
+
+    def update(self, series):
+        if self.numeric:
+            values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+            values = values[np.isfinite(values)]
+            self.count += len(values)
+            self.quantiles.update(values)
+            self.moments.update(values)
+        else:
+            values = series.dropna()
+            self.count += len(values)
+            self.distinct.update(values)
+            self.top.update(values)
+
+    def merge(self, other):
+        self.count += other.count
+        if self.numeric:
+            self.quantiles.merge(other.quantiles)
+            self.moments.merge(other.moments)
+        else:
+            self.distinct.merge(other.distinct)
+            self.top.merge(other.top)
+        return self
+
+    @property
+    def top_is_exact(self):
+        """
+        最頻値が厳密かどうか（数値以外の列のみ）
+
+        候補の度数を数え直していて、その最大値が全件数の 1/(capacity + 1) を超えていれば、
+        候補から外れた値がそれより多く現れることはない。
+        """
+        if self.top_counts is None or not self.count:
+            return False
+        return self.top_counts.max() * (self.top.capacity + 1) > self.count
+
+    def describe(self):
+        """df.describe(include='all') の 1 行分に相当する辞書"""
+        row = dict.fromkeys(DESCRIBE_COLUMNS, np.nan)
+        row['count'] = self.count
+        if self.numeric:
+            q1, median, q3 = self.quantiles.quantile([0.25, 0.5, 0.75]) if self.count else [np.nan] * 3
+            row.update({
+                'mean': self.moments.mean if self.count else np.nan,
+                'std': np.sqrt(self.moments.var),
+                'min': self.quantiles.min if self.count else np.nan,
+                '25%': q1,
+                '50%': median,
+                '75%': q3,
+                'max': self.quantiles.max if self.count else np.nan,
+            })
+        elif self.count:
+            if self.top_counts is not None:
+                top = self.top_counts.sort_values(ascending=False, kind='stable').head(1)
+            else:
+                # Misra-Gries の度数は下限（過小評価になり得る）
+                top = self.top.most_common(1)
+            row.update({'unique': self.distinct.count, 'top': top.index[0], 'freq': int(top.iloc[0])})
+        return row
+
+
+class StreamingSummary:
+    """
+    DataFrame のチャンクを順に取り込み、列ごとのスケッチを保持する
+
+    列の種類（数値かどうか）は最初に現れたチャンクの dtype で決める。
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def update(self, chunk):
+        for col in chunk.columns:
+            if col not in self.columns:
+                numeric = pd.api.types.is_numeric_dtype(chunk[col]) and not pd.api.types.is_bool_dtype(chunk[col])
+                self.columns[col] = ColumnSummary(numeric)
+            self.columns[col].update(chunk[col])
+        return self
+
+    def merge(self, other):
+        for col, summary in other.columns.items():
+            if col in self.columns:
+                self.columns[col].merge(summary)
+            else:
+                self.columns[col] = summary
+        return self
+
+    def describe(self):
+        """df.describe(include='all').transpose() と同じ形の要約表"""
+        rows = {col: summary.describe() for col, summary in self.columns.items()}
+        table = pd.DataFrame.from_dict(rows, orient='index', columns=DESCRIBE_COLUMNS)
+        # 数値列しかない場合は describe() と同じく数値用の列だけにする
+        if all(summary.numeric for summary in self.columns.values()):
+            table = table.drop(columns=['unique', 'top', 'freq'])
+        elif not any(summary.numeric for summary in self.columns.values()):
+            table = table[['count', 'unique', 'top', 'freq']]
+        return table
+
+    def approximate_top_columns(self):
+        """最頻値（top）が厳密とは限らない列（度数 freq は top の値の度数）"""
+        return [
+            col for col, summary in self.columns.items()
+            if not summary.numeric and summary.count and not summary.top_is_exact
+        ]
+
+    def quantile(self, col, q):
+        """数値列の分位数（近似）"""
+        return self.columns[col].quantiles.quantile(q)
+
+
+def summarize_chunks(chunks):
+    """DataFrame のチャンクのイテレータから StreamingSummary を作る"""
+    summary = StreamingSummary()
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
+
+
+def use_streaming(file_name, size, streaming_bytes=STREAMING_BYTES):
+    """全体を読み込まずにストリーミングで処理するかどうか（大きな CSV のみ）"""
+    return file_name.lower().endswith('.csv') and size >= streaming_bytes
+
+
+def count_top_candidates(summary, chunks):
+    """
+    2 回目の読み込み：数値以外の列の最頻値の候補について、度数を厳密に数え直す
+
+    真の最頻値の度数が全件数の 1/TOP_K_CAPACITY を超えていれば、候補に必ず含まれる。
+    """
+    targets = {col: column for col, column in summary.columns.items() if not column.numeric and column.count}
+    exact = {col: pd.Series(0, index=column.top.candidates, dtype='int64') for col, column in targets.items()}
+    for chunk in chunks:
+        for col, counts in exact.items():
+            if col in chunk.columns:
+                found = chunk[col].value_counts().reindex(counts.index, fill_value=0)
+                exact[col] = counts + found.to_numpy(dtype='int64')
+    for col, column in targets.items():
+        column.top_counts = exact[col]
+    return summary
+
+
+def summarize_csv(read_chunks):
+    """
+    CSV ファイルを全体を読み込まずに要約する
+
+    1 回目の読み込みで列ごとのスケッチを作り、2 回目の読み込みで
+    最頻値の候補の度数を厳密に数え直す。
+
+    Parameters
+    ----------
+    read_chunks : callable
+        呼ぶたびに先頭から DataFrame のチャンクのイテレータを返す関数
+        （例: lambda: pd.read_csv(path, chunksize=CHUNKSIZE)）
+
+    Returns
+    -------
+    StreamingSummary
+    """
+    summary = summarize_chunks(read_chunks())
+    return count_top_candidates(summary, read_chunks())
+
+
+def cached_summary(key, read_chunks):
+    """
+    summarize_csv の結果をキャッシュする（同じキーのファイルは読み直さない）
+
+    Parameters
+    ----------
+    key : str
+        ファイル内容のハッシュ値（data_loader.file_digest）
+    read_chunks : callable
+        summarize_csv と同じ
+    """
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    summary = summarize_csv(read_chunks)
+    with _cache_lock:
+        _cache[key] = summary
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return summary
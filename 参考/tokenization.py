@@ -0,0 +1,122 @@
+"""
+Janome による形態素解析（内容語の抽出）のまとめ処理
+
+同じ文書を何度も解析しないよう、結果を文書の本文のハッシュ値をキーにして
+モジュール内にキャッシュする（Streamlit の再実行やカテゴリ別の表示でも使い回される）。
+まだ解析していない文書は重複を除いてから解析し、文書数が多い場合は
+プロセスプールに分ける。各ワーカーは起動時に Tokenizer を一度だけ作り、
+以降のバッチで使い回す（辞書の読み込みは文書ごとには行わない）。
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from janome.tokenizer import Tokenizer
+
+
+# 抽出する品詞（品詞情報の先頭）
+CONTENT_POS = ('名詞', '動詞', '形容詞', '副詞')
+# キャッシュする文書数の上限（古いものから捨てる）
+CACHE_SIZE = 200000
+# プロセスプールで解析する最小の文書数（これ未満は辞書の読み込みの方が重い）
+PARALLEL_MIN_DOCS = 2000
+
+# 文書のハッシュ値 → 基本形のタプル
+_cache = OrderedDict()
+# このプロセスで使い回す Tokenizer（ワーカーでは起動時に作る）
+_tokenizer = None
+
+
+def _get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = Tokenizer()
+    return _tokenizer
+
+
+def text_key(text):
+    """文書の本文のハッシュ値（キャッシュのキー）"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def extract_words(text, tokenizer=None):
+    """1 つの文書から内容語の基本形を抜き出す"""
+    tokenizer = tokenizer or _get_tokenizer()
+    return tuple(
+        token.base_form
+        for token in tokenizer.tokenize(text)
+        if token.part_of_speech.split(',')[0] in CONTENT_POS
+    )
+
+
+def _tokenize_batch(texts):
+    tokenizer = _get_tokenizer()
+    return [extract_words(text, tokenizer) for text in texts]
+
+
+def _store(key, tokens):
+    _cache[key] = tokens
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def tokenize_documents(texts, max_workers=None, parallel_min_docs=PARALLEL_MIN_DOCS):
+    """
+    文書ごとに内容語の基本形のタプルを返す（欠損値は空のタプル）
+
+    キャッシュにない文書だけを重複を除いて解析する。
+    解析する文書が parallel_min_docs 以上で max_workers が 2 以上のときは、
+    ワーカーごとに Tokenizer を一度だけ作るプロセスプールで分担する。
+
+    Parameters
+    ----------
+    texts : iterable of str
+    max_workers : int, optional
+        プロセス数（省略時は CPU 数）。1 ならプロセスプールを使わない
+
+    Returns
+    -------
+    list of tuple of str
+        texts と同じ順
+    """
+    texts = list(texts)
+    keys = [None if pd.isnull(text) else text_key(str(text)) for text in texts]
+
+    # この呼び出しで使う結果（キャッシュから捨てられても参照できるよう手元に持つ）
+    resolved = {}
+    pending = {}
+    for text, key in zip(texts, keys):
+        if key is None or key in resolved or key in pending:
+            continue
+        if key in _cache:
+            _cache.move_to_end(key)
+            resolved[key] = _cache[key]
+        else:
+            pending[key] = str(text)
+
+    if pending:
+        pending_keys = list(pending)
+        pending_texts = list(pending.values())
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers > 1 and len(pending_texts) >= parallel_min_docs:
+            # ワーカーごとに数回に分けて渡し、文書の長さのばらつきをならす
+            n_batches = max_workers * 4
+            size = -(-len(pending_texts) // n_batches)
+            batches = [pending_texts[i:i + size] for i in range(0, len(pending_texts), size)]
+            with ProcessPoolExecutor(max_workers, initializer=_get_tokenizer) as pool:
+                results = [tokens for batch in pool.map(_tokenize_batch, batches) for tokens in batch]
+        else:
+            results = _tokenize_batch(pending_texts)
+        for key, tokens in zip(pending_keys, results):
+            resolved[key] = tokens
+            _store(key, tokens)
+
+    return [() if key is None else resolved[key] for key in keys]
+
+
+def tokenized_text(texts, **kwargs):
+    """文書ごとに内容語の基本形を空白で区切った文字列を返す（欠損値は空文字列）"""
+    return [' '.join(tokens) for tokens in tokenize_documents(texts, **kwargs)]
@@ -0,0 +1,224 @@
+"""
+t検定の一括計算エンジン
+
+多数の従属変数（アンケート項目など）に対する t検定を、
+列ごとの Python ループではなく 2 次元配列に対する一度の演算でまとめて行う。
+欠損値（NaN）は列ごとに除外して計算する（scipy の nan_policy='omit' と同じ扱い）。
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+def _column_moments(values):
+    """
+    2 次元配列の列ごとの有効 N・平均・不偏分散を返す
+
+    平均を求めてから偏差平方和を取る 2 段階の計算にして、
+    値が大きい列でも桁落ちしにくくしている。
+    """
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    filled = np.where(valid, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=0) / n
+        dev = np.where(valid, values - mean, 0.0)
+        var = (dev ** 2).sum(axis=0) / (n - 1)
+    return n, mean, var
+
+
+def welch_ttest_arrays(values, in_group0, in_group1):
+    """
+    Welch の t検定を全列まとめて計算する
+
+    Parameters
+    ----------
+    values : ndarray, shape (n_rows, n_vars)
+        従属変数を並べた配列
+    in_group0, in_group1 : ndarray of bool, shape (n_rows,)
+        各行がそれぞれの群に属するかどうか
+
+    Returns
+    -------
+    dict
+        各キーに長さ n_vars の配列を持つ辞書
+        （n0, mean0, var0, n1, mean1, var1, n, mean, var, df, t, p, d）
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+
+    n0, mean0, var0 = _column_moments(values[in_group0])
+    n1, mean1, var1 = _column_moments(values[in_group1])
+    n, mean, var = _column_moments(values[in_group0 | in_group1])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se0_sq = var0 / n0
+        se1_sq = var1 / n1
+        t = (mean0 - mean1) / np.sqrt(se0_sq + se1_sq)
+
+        # Welch–Satterthwaite の式で自由度を計算
+        df_welch = (se0_sq + se1_sq) ** 2 / (se0_sq ** 2 / (n0 - 1) + se1_sq ** 2 / (n1 - 1))
+        p = 2 * stats.t.sf(np.abs(t), df_welch)
+
+        # 効果量 d（プールされた標準偏差を使用）
+        pooled_sd = np.sqrt(((n0 - 1) * var0 + (n1 - 1) * var1) / (n0 + n1 - 2))
+        d = np.abs(mean0 - mean1) / pooled_sd
+
+    return {
+        'n0': n0, 'mean0': mean0, 'var0': var0,
+        'n1': n1, 'mean1': mean1, 'var1': var1,
+        'n': n, 'mean': mean, 'var': var,
+        'df': df_welch, 't': t, 'p': p, 'd': d,
+    }
+
+
+def welch_ttest(df, group_col, value_cols, groups=None):
+    """
+    DataFrame の複数の数値列について、2 群の Welch の t検定をまとめて行う
+
+    Parameters
+    ----------
+    df : DataFrame
+    group_col : str
+        群を表すカテゴリ変数の列名
+    value_cols : list of str
+        従属変数の列名
+    groups : sequence, optional
+        比較する 2 群の値（省略時は出現順の最初の 2 つ）
+
+    Returns
+    -------
+    DataFrame
+        従属変数ごとの行に、群ごとの N・平均値・標準偏差、全体の平均値・標準偏差、
+        自由度、t 値、p 値、効果量 d を持つ
+    """
+    if groups is None:
+        groups = df[group_col].unique()[:2]
+    group_values = df[group_col].to_numpy()
+    in_group0 = group_values == groups[0]
+    in_group1 = group_values == groups[1]
+    values = df[list(value_cols)].to_numpy(dtype=float)
+
+    res = welch_ttest_arrays(values, in_group0, in_group1)
+    return pd.DataFrame({
+        'n0': res['n0'],
+        'mean0': res['mean0'],
+        'sd0': np.sqrt(res['var0']),
+        'n1': res['n1'],
+        'mean1': res['mean1'],
+        'sd1': np.sqrt(res['var1']),
+        'n': res['n'],
+        'mean': res['mean'],
+        'sd': np.sqrt(res['var']),
+        'df': res['df'],
+        't': res['t'],
+        'p': res['p'],
+        'd': res['d'],
+    }, index=pd.Index(list(value_cols)))
+
+
+def paired_ttest_arrays(pre, post):
+    """
+    対応のある t検定を全ペアまとめて計算する
+
+    Parameters
+    ----------
+    pre, post : ndarray, shape (n_rows, n_pairs)
+        事前・事後の測定値を列方向に並べた配列（同じ列番号同士がペア）
+
+    Returns
+    -------
+    dict
+        各キーに長さ n_pairs の配列を持つ辞書
+        （n, mean_pre, var_pre, mean_post, var_post, mean_diff, var_diff,
+        se, df, t, p, d, d_av）
+    """
+    pre = np.asarray(pre, dtype=float)
+    post = np.asarray(post, dtype=float)
+    if pre.ndim == 1:
+        pre = pre[:, None]
+        post = post[:, None]
+
+    # ペアのどちらかが欠損している行は、そのペアの計算から除く
+    complete = ~(np.isnan(pre) | np.isnan(post))
+    pre = np.where(complete, pre, np.nan)
+    post = np.where(complete, post, np.nan)
+
+    n, mean_pre, var_pre = _column_moments(pre)
+    _, mean_post, var_post = _column_moments(post)
+    _, mean_diff, var_diff = _column_moments(pre - post)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se = np.sqrt(var_diff / n)
+        t = mean_diff / se
+        df_t = n - 1
+        p = 2 * stats.t.sf(np.abs(t), df_t)
+
+        # 効果量 d（差得点の標準偏差を使用）
+        d = np.abs(mean_diff) / np.sqrt(var_diff)
+        # 参考：2 時点の標準偏差の平均を使用した効果量
+        d_av = np.abs(mean_diff) / ((np.sqrt(var_pre) + np.sqrt(var_post)) / 2)
+
+    return {
+        'n': n,
+        'mean_pre': mean_pre, 'var_pre': var_pre,
+        'mean_post': mean_post, 'var_post': var_post,
+        'mean_diff': mean_diff, 'var_diff': var_diff,
+        'se': se, 'df': df_t, 't': t, 'p': p, 'd': d, 'd_av': d_av,
+    }
+
+
+def paired_ttest(df, pre_cols, post_cols):
+    """
+    事前・事後の列のペアについて、対応のある t検定をまとめて行う
+
+    Parameters
+    ----------
+    df : DataFrame
+    pre_cols, post_cols : list of str
+        同じ長さの列名のリスト（同じ位置の列同士がペア）
+
+    Returns
+    -------
+    DataFrame
+        「事前 → 事後」を行ラベルとし、各時点の平均値・標準偏差・標準誤差、
+        差の平均・標準誤差、自由度、t 値、p 値、効果量を持つ
+    """
+    if len(pre_cols) != len(post_cols):
+        raise ValueError('事前と事後の変数の数が一致しません。')
+    pre = df[list(pre_cols)].to_numpy(dtype=float)
+    post = df[list(post_cols)].to_numpy(dtype=float)
+
+    res = paired_ttest_arrays(pre, post)
+    sd_pre = np.sqrt(res['var_pre'])
+    sd_post = np.sqrt(res['var_post'])
+    index = [f'{pre_col} → {post_col}' for pre_col, post_col in zip(pre_cols, post_cols)]
+    return pd.DataFrame({
+        'pre': list(pre_cols),
+        'post': list(post_cols),
+        'n': res['n'],
+        'mean_pre': res['mean_pre'],
+        'sd_pre': sd_pre,
+        'se_pre': sd_pre / np.sqrt(res['n']),
+        'mean_post': res['mean_post'],
+        'sd_post': sd_post,
+        'se_post': sd_post / np.sqrt(res['n']),
+        'mean_diff': res['mean_diff'],
+        'se': res['se'],
+        'df': res['df'],
+        't': res['t'],
+        'p': res['p'],
+        'd': res['d'],
+        'd_av': res['d_av'],
+    }, index=pd.Index(index))
+
+
+def significance_marks(p_values):
+    """p 値の配列を有意差の記号（**, *, †, n.s.）に変換する"""
+    p_values = np.asarray(p_values, dtype=float)
+    return np.select(
+        [p_values < 0.01, p_values < 0.05, p_values < 0.1],
+        ['**', '*', '†'],
+        default='n.s.',
+    )
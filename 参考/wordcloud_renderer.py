@@ -0,0 +1,226 @@
+"""
+ワードクラウドの日本語フォントの解決と描画
+
+日本語フォントのパスは初回に matplotlib のフォント一覧（fm.fontManager.ttflist）と
+候補のパスから探し、見つかったパスとその更新時刻を JSON ファイルに記録する。
+以降は記録したフォントファイルが同じ更新時刻のまま存在する限りそのパスを使い、
+フォント一覧を調べない（プロセスが変わっても、ページの初回表示でも同じ）。
+
+描画はモジュール内で 1 つだけ作るプロセスプールで行い、Streamlit の再実行をまたいで使い回す。
+各ワーカープロセスは初期化時にフォントを解決し、描く大きさ（幅・高さ・最大語数）ごとの
+WordCloud を作っておく。1 枚だけの描画も同じプールに送る。
+WordCloud は描画結果（words_, layout_）をインスタンスに持つが、ワーカープロセスは
+タスクを 1 つずつ実行するため、プロセス内で使い回しても結果は混ざらない。
+プロセスプールを使わない場合（max_workers=1）は、Streamlit のセッションが
+スレッドとして同じプロセスで動くため、WordCloud をスレッドごとに持つ（threading.local）。
+"""
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from wordcloud import WordCloud
+
+
+# フォントの解決結果の記録先（環境変数で変更可能）
+FONT_CACHE_PATH = Path(os.environ.get(
+    'EASYSTAT_FONT_CACHE_PATH',
+    Path(tempfile.gettempdir()) / 'easy_stat_font_cache.json',
+))
+# matplotlib のフォント一覧から日本語フォントとみなす名前
+FONT_NAME_KEYWORDS = ('IPA', 'Noto Sans CJK', 'Takao')
+# フォント一覧に見つからない場合に探すシステムフォント
+FONT_CANDIDATES = (
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf',
+    '/usr/share/fonts/truetype/takao-gothic/TakaoGothic.ttf',
+)
+
+# 描画の共通設定（KH Coderスタイル）
+BACKGROUND_COLOR = 'white'
+RELATIVE_SCALING = 0.5
+MIN_FONT_SIZE = 10
+
+# frequencies : 単語 → 出現回数
+CloudJob = namedtuple('CloudJob', ['frequencies', 'width', 'height', 'max_words'])
+# image : RGB の画像（numpy 配列）、失敗した場合は None
+# error : 失敗した場合のエラーメッセージ
+CloudResult = namedtuple('CloudResult', ['image', 'error'])
+
+# スレッドごと（ワーカープロセスではプロセスごと）の WordCloud：
+# (フォントのパス, 幅, 高さ, 最大語数) → WordCloud
+_local = threading.local()
+# 描画用のプロセスプール（初めて使うときに作り、以降の描画で使い回す）
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def scan_font_path():
+    """matplotlib のフォント一覧と候補のパスから日本語フォントを探す（見つからなければ None）"""
+    from matplotlib import font_manager
+
+    for font in font_manager.fontManager.ttflist:
+        if any(keyword in font.name for keyword in FONT_NAME_KEYWORDS):
+            return font.fname
+    for candidate in FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_font_cache(cache_path=None):
+    """記録したフォントのパス（記録がない、またはファイルが変わった場合は None）"""
+    try:
+        with open(cache_path or FONT_CACHE_PATH, encoding='utf-8') as f:
+            record = json.load(f)
+        path = record['path']
+        mtime_ns = record['mtime_ns']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if mtime_ns is None or _mtime_ns(path) != mtime_ns:
+        return None
+    return path
+
+
+def write_font_cache(path, cache_path=None):
+    """
+    フォントのパスと更新時刻を記録する
+
+    一時ファイルに書いてから os.replace で置き換えるため、他のプロセスが読むのは
+    置き換え前か後のどちらかの完全な内容になる（書きかけの内容は見えない）。
+    """
+    target = Path(cache_path or FONT_CACHE_PATH)
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'path': path, 'mtime_ns': _mtime_ns(path)}, f)
+        os.replace(tmp_name, target)
+    except OSError:
+        Path(tmp_name).unlink(missing_ok=True)
+        return False
+    return True
+
+
+def resolve_font_path(cache_path=None):
+    """
+    ワードクラウドに使う日本語フォントのパス
+
+    記録があればフォント一覧を調べずに返す。記録がない（または古い）場合だけ探して記録する。
+    見つからなかった結果は記録しない（フォントを追加すれば次回から見つかる）。
+    """
+    path = read_font_cache(cache_path)
+    if path is not None:
+        return path
+    path = scan_font_path()
+    if path is not None:
+        write_font_cache(path, cache_path)
+    return path
+
+
+def make_renderer(font_path, width, height, max_words):
+    """フォントと大きさを設定した WordCloud"""
+    return WordCloud(
+        width=width,
+        height=height,
+        max_words=max_words,
+        background_color=BACKGROUND_COLOR,
+        font_path=font_path,
+        relative_scaling=RELATIVE_SCALING,
+        min_font_size=MIN_FONT_SIZE
+    )
+
+
+def get_renderer(font_path, width, height, max_words):
+    """このスレッド（ワーカープロセス）用の WordCloud（同じ設定なら作り直さない）"""
+    renderers = getattr(_local, 'renderers', None)
+    if renderers is None:
+        renderers = _local.renderers = {}
+    key = (font_path, width, height, max_words)
+    if key not in renderers:
+        renderers[key] = make_renderer(*key)
+    return renderers[key]
+
+
+def render(job, font_path):
+    """1 枚のワードクラウドを描く（失敗しても例外を投げず CloudResult.error に入れる）"""
+    try:
+        renderer = get_renderer(font_path, job.width, job.height, job.max_words)
+        return CloudResult(image=renderer.generate_from_frequencies(job.frequencies).to_array(), error=None)
+    except Exception as e:
+        return CloudResult(image=None, error=str(e))
+
+
+def _render_one(args):
+    return render(*args)
+
+
+def _init_worker(shapes):
+    """ワーカープロセスの初期化：フォントを解決し、描く大きさごとの WordCloud を作っておく"""
+    font_path = resolve_font_path()
+    for width, height, max_words in shapes:
+        get_renderer(font_path, width, height, max_words)
+
+
+def _get_pool(max_workers, shapes):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(shapes,))
+        return _pool
+
+
+def _discard_pool(pool):
+    """異常終了したプールを捨てる（次の描画で作り直す）"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def render_many(jobs, font_path, max_workers=None):
+    """
+    ワードクラウドを描く（1 枚でもよい）
+
+    モジュール内のプロセスプールに送って描く。プールは初めて使うときに
+    max_workers 個のワーカーで作り、以降の呼び出しでは作り直さずに使い回す。
+    ワーカーが異常終了した場合は、このプロセス内で描き直す。
+
+    Parameters
+    ----------
+    jobs : list of CloudJob
+    font_path : str
+        resolve_font_path で求めたフォントのパス
+    max_workers : int, optional
+        プロセス数（省略時は CPU 数）。1 ならプロセスプールを使わない
+
+    Returns
+    -------
+    list of CloudResult
+        jobs と同じ順
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers <= 1:
+        return [render(job, font_path) for job in jobs]
+    pool = _get_pool(max_workers, sorted({(job.width, job.height, job.max_words) for job in jobs}))
+    try:
+        return list(pool.map(_render_one, [(job, font_path) for job in jobs]))
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return [render(job, font_path) for job in jobs]